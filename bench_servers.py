@@ -0,0 +1,490 @@
+import argparse
+import hashlib
+import html
+import json
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Posts in a profile grid and in every page of the feed responses, like Instagram
+FEED_PAGE_SIZE = 12
+
+WORDS = ("concerto festival serata musica live dj aperitivo evento biglietti ingresso gratuito sabato domenica "
+         "venerdi teatro cinema mostra workshop corso iscrizioni aperte studenti universita sport partita gara "
+         "montagna lago trento verona programma ospiti sconto prenotazione posti limitati info link bio").split()
+
+PROFILE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{handle}</title></head>
+<body>
+<header><h2>{handle}</h2></header>
+<main id="grid" style="min-height: 3000px">{grid}</main>
+<script>
+let nextMaxId = null;
+let loading = false;
+let more = true;
+function loadPage() {{
+    if (loading || !more) return;
+    loading = true;
+    fetch('/api/v1/feed/user/{handle}/?count={page_size}' + (nextMaxId ? '&max_id=' + nextMaxId : ''))
+        .then(response => response.json())
+        .then(data => {{
+            // Older posts are added to the grid like on a scrolled profile
+            const grid = document.getElementById('grid');
+            for (const item of data.items) {{
+                if (!document.querySelector(`a[href='/{handle}/p/${{item.code}}/']`)) {{
+                    grid.insertAdjacentHTML('beforeend', `<a href="/{handle}/p/${{item.code}}/"><div><span>${{item.code}}</span></div></a>`);
+                }}
+            }}
+            more = data.more_available;
+            nextMaxId = data.next_max_id;
+            loading = false;
+        }});
+}}
+loadPage();
+window.addEventListener('scroll', () => {{
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 10) loadPage();
+}});
+</script>
+</body></html>
+"""
+
+GRID_ITEM_TEMPLATE = """<a href="/{handle}/p/{code}/"><div>{pinned}<span>{code}</span></div></a>"""
+
+PINNED_ICON = """<svg aria-label="Pinned post icon" width="10" height="10"></svg>"""
+
+POST_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{handle} post</title></head>
+<body>
+<article>
+<a href="/{handle}/">{handle}</a>
+<h1 dir="auto">{caption}</h1>
+<a href="/p/{code}/"><time datetime="{datetime}">{days} days ago</time></a>
+{next_button}
+</article>
+</body></html>
+"""
+
+NEXT_BUTTON_TEMPLATE = """<button onclick="location.href='/p/{code}/'">\
+<span style="display: inline-block; transform: rotate(90deg);">&gt;</span></button>"""
+
+
+def make_caption(generator):
+    """Returns an HTML caption with links, hashtags and mentions like the scraped ones"""
+    lines = []
+    for _ in range(generator.randint(1, 5)):
+        lines.append(" ".join(generator.choices(WORDS, k=generator.randint(4, 25))))
+    lines.append(" ".join(f"#{word}" for word in generator.sample(WORDS, 3)))
+    if generator.random() < 0.3:
+        lines.append(f"@{generator.choice(WORDS)}_official https://example.com/{generator.choice(WORDS)}")
+    return "<br>".join(html.escape(line) for line in lines)
+
+
+def make_site(handles_count, posts_per_handle, pinned_per_handle=1, max_age_days=30, seed=0):
+    """
+    Generates the profiles served by the fixture server
+
+    Args:
+        handles_count (int): Number of profiles
+        posts_per_handle (int): Posts of every profile, pinned ones included
+        pinned_per_handle (int): Old posts pinned at the top of every profile
+        max_age_days (int): Age of the oldest post that is not pinned
+        seed (int): Seed of the generated content
+
+    Returns:
+        dict: handle -> list of post dictionaries in grid order, with code, caption, taken_at and pinned
+    """
+    generator = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    site = {}
+    for handle_index in range(handles_count):
+        handle = f"bench_handle_{handle_index}"
+        posts = []
+        for post_index in range(posts_per_handle):
+            pinned = post_index < pinned_per_handle
+            if pinned:
+                # Pinned posts are older than the scraped window, so they are skipped
+                age = timedelta(days=max_age_days * 4 + post_index)
+            else:
+                age = timedelta(days=max_age_days) * (post_index + 1) / (posts_per_handle + 1)
+            posts.append({
+                "code": f"B{handle_index}x{post_index}",
+                "caption": make_caption(generator),
+                "taken_at": int((now - age).timestamp()),
+                "pinned": pinned
+            })
+        site[handle] = posts
+    return site
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle would delay every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server.fixture
+        server.wait()
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        server.count(parts[0] if parts else "home")
+
+        if url.path == "/robots.txt":
+            # The session check needs a session cookie
+            return self._send(200, "User-agent: *\nDisallow:\n", "text/plain",
+                              {"Set-Cookie": "sessionid=bench; Path=/; Max-Age=86400"})
+        if url.path.startswith("/api/v1/accounts/current_user/"):
+            return self._send(200, json.dumps({"user": {"username": "bench"}}), "application/json")
+        if len(parts) == 5 and parts[:3] == ["api", "v1", "feed"]:
+            return self._send_feed(parts[4], parse_qs(url.query))
+        if not parts:
+            return self._send(200, "<html><body><h1>Fixtures</h1></body></html>")
+
+        if len(parts) == 1 and parts[0] in server.site:
+            return self._send_profile(parts[0])
+        if len(parts) == 3 and parts[1] in ("p", "reel") and parts[0] in server.site:
+            # The grid links open the post on its own url, like the Instagram post dialog
+            return self._send(302, "", headers={"Location": f"/p/{parts[2]}/"})
+        if len(parts) == 2 and parts[0] in ("p", "reel") and parts[1] in server.posts:
+            return self._send_post(parts[1])
+
+        self._send(404, "<html><body>Sorry, this page isn't available.</body></html>")
+
+    def _send_profile(self, handle):
+        posts = self.server.fixture.site[handle][:FEED_PAGE_SIZE]
+        grid = "".join(
+            GRID_ITEM_TEMPLATE.format(handle=handle, code=post["code"], pinned=PINNED_ICON if post["pinned"] else "")
+            for post in posts
+        )
+        self._send(200, PROFILE_TEMPLATE.format(handle=handle, grid=grid, page_size=FEED_PAGE_SIZE))
+
+    def _send_feed(self, handle, query):
+        posts = self.server.fixture.site.get(handle, [])
+        start = int(query.get("max_id", ["0"])[0])
+        page = posts[start:start + FEED_PAGE_SIZE]
+        items = [{
+            "code": post["code"],
+            "taken_at": post["taken_at"],
+            "product_type": "feed",
+            "caption": {"text": html.unescape(post["caption"].replace("<br>", "\n"))},
+            "user": {"username": handle},
+            "timeline_pinned_user_ids": [1] if post["pinned"] else []
+        } for post in page]
+        more = start + FEED_PAGE_SIZE < len(posts)
+        self._send(200, json.dumps({
+            "items": items,
+            "more_available": more,
+            "next_max_id": str(start + FEED_PAGE_SIZE) if more else None
+        }), "application/json")
+
+    def _send_post(self, code):
+        handle, index = self.server.fixture.posts[code]
+        posts = self.server.fixture.site[handle]
+        post = posts[index]
+        taken_at = datetime.fromtimestamp(post["taken_at"], tz=timezone.utc)
+        next_button = NEXT_BUTTON_TEMPLATE.format(code=posts[index + 1]["code"]) if index + 1 < len(posts) else ""
+        self._send(200, POST_TEMPLATE.format(
+            handle=handle,
+            code=code,
+            caption=post["caption"],
+            datetime=f"{taken_at:%Y-%m-%dT%H:%M:%S}.000Z",
+            days=(datetime.now(timezone.utc) - taken_at).days,
+            next_button=next_button
+        ))
+
+
+class FixtureServer:
+    """
+    Local web server serving synthetic profiles, posts and feed responses shaped like the Instagram
+    pages the scraper reads, with a configurable latency per request.
+    """
+
+    def __init__(self, site, latency=0.05, latency_jitter=0.02, port=0):
+        """
+        Args:
+            site (dict): Profiles to serve, see make_site
+            latency (float): Seconds waited before answering every request
+            latency_jitter (float): Random extra seconds added to the latency
+            port (int): Port to listen on, 0 for any free port
+        """
+        self.site = site
+        self.posts = {post["code"]: (handle, index) for handle, posts in site.items() for index, post in enumerate(posts)}
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.port = port
+
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def wait(self):
+        """Sleeps for the latency of a request"""
+        time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+
+    def count(self, kind):
+        """Counts a served request"""
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def start(self):
+        """Starts serving in a background thread, returns the base url"""
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _FixtureHandler)
+        self._server.daemon_threads = True
+        self._server.fixture = self
+        threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        """Stops serving"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle would delay every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            return self._send_json({"version": "0.0.0-bench"})
+        self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self._read_json()
+        stub.count(self.path)
+
+        if self.path == "/api/tokenize":
+            return self._send_json({"tokens": list(range(stub.count_tokens(body.get("content", ""))))})
+        if self.path == "/api/embed":
+            texts = body.get("input", [])
+            texts = texts if isinstance(texts, list) else [texts]
+            return self._send_json({"model": body.get("model"), "embeddings": [stub.embed(text) for text in texts]})
+        if self.path == "/api/generate":
+            return self._generate(stub, body)
+        self._send_json({"error": "not found"}, 404)
+
+    def _generate(self, stub, body):
+        load_seconds = stub.load(body.get("keep_alive"))
+        prompt = body.get("prompt")
+        if not prompt:
+            # Load or unload request
+            return self._send_json({"model": body.get("model"), "response": "", "done": True,
+                                    "load_duration": int(load_seconds * 1e9)})
+
+        with stub.slots:
+            start = time.monotonic()
+            prompt_tokens = stub.count_tokens(prompt)
+            prompt_seconds = prompt_tokens / stub.prompt_tokens_per_second
+            time.sleep(prompt_seconds)
+
+            tokens = stub.answer(prompt, body.get("format"), (body.get("options") or {}).get("num_predict"))
+            final = lambda eval_seconds: {
+                "model": body.get("model"),
+                "done": True,
+                "total_duration": int((time.monotonic() - start + load_seconds) * 1e9),
+                "load_duration": int(load_seconds * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_seconds * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(eval_seconds * 1e9)
+            }
+
+            if body.get("stream", True):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                eval_start = time.monotonic()
+                for token in tokens:
+                    time.sleep(1 / stub.tokens_per_second)
+                    self._write_chunk({"model": body.get("model"), "response": token, "done": False})
+                self._write_chunk({"response": "", **final(time.monotonic() - eval_start)})
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                eval_seconds = len(tokens) / stub.tokens_per_second
+                time.sleep(eval_seconds)
+                self._send_json({"response": "".join(tokens), **final(eval_seconds)})
+
+    def _write_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+
+
+class StubOllama:
+    """
+    Local server following the Ollama generate, tokenize and embed contracts, answering at a
+    configurable speed, with a limited number of parallel slots like OLLAMA_NUM_PARALLEL.
+    """
+
+    def __init__(self, tokens_per_second=50, prompt_tokens_per_second=1000, load_seconds=2, parallel=4,
+                 answer_tokens=60, embedding_dimensions=64, port=0):
+        """
+        Args:
+            tokens_per_second (float): Generation speed of every slot
+            prompt_tokens_per_second (float): Prompt evaluation speed of every slot
+            load_seconds (float): Time taken by the first request after start or unload
+            parallel (int): Requests served at the same time, the others wait
+            answer_tokens (int): Tokens of an answer, capped by num_predict
+            embedding_dimensions (int): Size of the embedding vectors
+            port (int): Port to listen on, 0 for any free port
+        """
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.load_seconds = load_seconds
+        self.answer_tokens = answer_tokens
+        self.embedding_dimensions = embedding_dimensions
+        self.port = port
+        self.slots = threading.Semaphore(parallel)
+
+        self.requests = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @staticmethod
+    def count_tokens(text):
+        """Approximates the tokens of a text, about 4 characters each"""
+        return len(text) // 4 + 1 if text else 0
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def load(self, keep_alive=None):
+        """
+        Simulates the model load of a request
+
+        Returns:
+            float: Seconds spent loading, 0 when the model was already loaded
+        """
+        if keep_alive == 0:
+            with self._lock:
+                self._loaded = False
+            return 0
+
+        with self._lock:
+            if self._loaded:
+                return 0
+            time.sleep(self.load_seconds)
+            self._loaded = True
+            return self.load_seconds
+
+    def answer(self, prompt, answer_format=None, num_predict=None):
+        """
+        Returns the tokens of the answer to a prompt: a JSON object with a summary per post id
+        for the batch prompts asking for JSON, plain words otherwise
+        """
+        generator = random.Random(prompt)
+        limit = num_predict if num_predict and num_predict > 0 else None
+        if answer_format == "json":
+            post_ids = re.findall(r'<post id="([^"]+)">', prompt)
+            words_per_post = max(5, self.answer_tokens // 2)
+            text = json.dumps({
+                post_id: " ".join(generator.choices(WORDS, k=words_per_post)) for post_id in post_ids
+            })
+            # Split the JSON so that every token carries a few characters
+            return [text[start:start + 4] for start in range(0, len(text), 4)]
+
+        count = min(self.answer_tokens, limit) if limit else self.answer_tokens
+        return [f"{word} " for word in generator.choices(WORDS, k=count)]
+
+    def embed(self, text):
+        """Returns a deterministic normalized bag of words vector, similar texts get similar vectors"""
+        vector = [0.0] * self.embedding_dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+            vector[int.from_bytes(digest, "big") % self.embedding_dimensions] += 1
+        norm = math.sqrt(sum(value * value for value in vector)) or 1
+        return [value / norm for value in vector]
+
+    def start(self):
+        """Starts serving in a background thread, returns the base url"""
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _OllamaHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        threading.Thread(target=self._server.serve_forever, name="stub-ollama", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        """Stops serving"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark fixture server and the stub Ollama server, "
+                                                 "e.g. to run main.py offline with INSTAGRAM_BASE_URL and OLLAMA_URL")
+    parser.add_argument("--handles", type=int, default=20, help="number of profiles")
+    parser.add_argument("--posts-per-handle", type=int, default=15, help="posts of every profile")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="seconds waited by every page request")
+    parser.add_argument("--fixture-port", type=int, default=8765, help="port of the fixture server")
+    parser.add_argument("--ollama-port", type=int, default=11435, help="port of the stub Ollama server")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="generation speed of the stub model")
+    parser.add_argument("--parallel", type=int, default=4, help="requests generated at the same time")
+    args = parser.parse_args()
+
+    site = make_site(args.handles, args.posts_per_handle)
+    fixture = FixtureServer(site, latency=args.page_latency, port=args.fixture_port)
+    ollama = StubOllama(tokens_per_second=args.tokens_per_second, parallel=args.parallel, port=args.ollama_port)
+    print(f"Fixture server: {fixture.start()} (handles bench_handle_0 to bench_handle_{args.handles - 1})")
+    print(f"Stub Ollama: {ollama.start()}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fixture.stop()
+        ollama.stop()
+
+
+if __name__ == "__main__":
+    main()
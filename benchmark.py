@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from bench_servers import FixtureServer, StubOllama, make_site
+from config import MODEL_NAME, SUMMARIZER_WORKERS, SUMMARY_MODE, EXTRACTION_MODE, WALK_MODE
+from database import DatabaseManager, fts_query
+from instrumentation import instrumentation
+from models import InstagramPost
+from preprocess import preprocess_posts
+from summarizer import ContentSummarizer
+
+# Results of a reference run, compared with every new run
+BASELINE_FILE = "data/benchmark_baseline.json"
+# Durations shorter than this are not compared with the baseline
+MIN_COMPARED_SECONDS = 0.001
+
+
+def site_posts(site):
+    """Returns the posts of the fixture site as the scraper would, pinned ones excluded"""
+    posts = []
+    for handle, handle_posts in site.items():
+        for post in handle_posts:
+            if post["pinned"]:
+                continue
+            posts.append(InstagramPost(
+                post_id=post["code"],
+                caption=post["caption"],
+                date=datetime.fromtimestamp(post["taken_at"], timezone.utc).replace(tzinfo=None),
+                url=f"https://www.instagram.com/p/{post['code']}/",
+                handle=handle
+            ))
+    return posts
+
+
+def span_percentiles(report, name, prefix):
+    """Returns the p50 and p95 of a span of the instrumentation report as metrics"""
+    span = report["spans"].get(name)
+    if span is None:
+        return {}
+    return {f"{prefix}_p50_seconds": span["p50_seconds"], f"{prefix}_p95_seconds": span["p95_seconds"]}
+
+
+def bench_scrape(site, args):
+    """Scrapes the fixture site with a real browser, returns the metrics and the scraped posts"""
+    from browser_utils import setup_browser
+    from pacing import Pacer
+    from scraper import InstagramScraper
+
+    fixture = FixtureServer(site, latency=args.page_latency, latency_jitter=args.page_latency_jitter)
+    base_url = fixture.start()
+    driver = setup_browser(network_logs=args.extraction_mode == "network")
+    try:
+        scraper = InstagramScraper(driver, pacer=Pacer(min_jitter=(0, 0)), extraction_mode=args.extraction_mode,
+                                   base_url=base_url, walk_mode=args.walk_mode)
+        min_date = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=args.days)
+        start = time.perf_counter()
+        posts = scraper.scrape_posts(min_date, list(site))
+        elapsed = time.perf_counter() - start
+    finally:
+        driver.quit()
+        fixture.stop()
+
+    report = instrumentation.report()
+    metrics = {
+        "posts": len(posts),
+        "seconds": elapsed,
+        "posts_per_second": len(posts) / elapsed if elapsed else None,
+        "page_requests": sum(fixture.requests.values())
+    }
+    metrics.update(span_percentiles(report, "scraper.go_to_profile", "profile"))
+    metrics.update(span_percentiles(report, "scraper.scrape_post", "post"))
+    metrics.update(span_percentiles(report, "scraper.click_next_post", "next_post"))
+    return metrics, posts
+
+
+def bench_summarize(posts, args):
+    """Summarizes the posts with the stub Ollama server, returns the metrics and the summarizer"""
+    ollama = StubOllama(tokens_per_second=args.tokens_per_second, load_seconds=args.load_seconds,
+                        parallel=args.workers)
+    base_url = ollama.start()
+    try:
+        summarizer = ContentSummarizer(MODEL_NAME, workers=args.workers, mode=args.summary_mode, base_url=base_url)
+        start = time.perf_counter()
+        prepared = preprocess_posts(posts, summarizer.token_counter)
+        preprocess_seconds = time.perf_counter() - start
+        summarizer.create_unified_summary_per_single_post(prepared.posts, args.goal, duplicates=prepared.duplicates)
+        elapsed = time.perf_counter() - start
+    finally:
+        ollama.stop()
+
+    report = instrumentation.report()
+    metrics = {
+        "posts": len(posts),
+        "seconds": elapsed,
+        "posts_per_second": len(posts) / elapsed if elapsed else None,
+        "preprocess_seconds": preprocess_seconds,
+        "generations": report["llm"]["generations"],
+        "first_token_p50_seconds": report["llm"]["first_token_p50_seconds"],
+        "first_token_p95_seconds": report["llm"]["first_token_p95_seconds"]
+    }
+    metrics.update(span_percentiles(report, "summarizer.summarize_single_post", "post"))
+    metrics.update(span_percentiles(report, "summarizer.summarize_batch", "batch"))
+    return metrics, summarizer
+
+
+def bench_database(posts, summarizer, args):
+    """Stores the run in a temporary database and queries it back, returns the metrics"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_manager = DatabaseManager(os.path.join(directory, "benchmark.db"))
+        db_manager.setup_tables()
+
+        start = time.perf_counter()
+        db_manager.save_summary("benchmark", datetime.now().isoformat(), posts, goal=args.goal, model=MODEL_NAME,
+                                overview=summarizer.last_overview, digests=summarizer.post_digests())
+        db_manager.update_handle_states(posts)
+        save_seconds = time.perf_counter() - start
+
+        words = [word for post in posts[:args.queries] for word in post.caption.split()[:1]] or ["concerto"]
+        for i in range(args.queries):
+            with instrumentation.span("benchmark.search"):
+                db_manager.search_posts(fts_query(words[i % len(words)]), limit=20)
+            with instrumentation.span("benchmark.digests"):
+                db_manager.get_digests(handles=[posts[i % len(posts)].handle] if posts else None)
+        db_manager.close()
+
+    report = instrumentation.report()
+    metrics = {
+        "posts": len(posts),
+        "save_seconds": save_seconds,
+        "posts_per_second": len(posts) / save_seconds if save_seconds else None
+    }
+    metrics.update(span_percentiles(report, "benchmark.search", "search"))
+    metrics.update(span_percentiles(report, "benchmark.digests", "digests"))
+    return metrics
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the metrics with the ones of the baseline
+
+    Args:
+        results (dict): stage -> metrics of this run
+        baseline (dict): stage -> metrics of the reference run
+        tolerance (float): Share a metric can get worse before it counts as a regression
+
+    Returns:
+        tuple: (printable comparison lines, list of the regressed metrics)
+    """
+    lines = []
+    regressions = []
+    for stage, metrics in results.items():
+        for name, value in metrics.items():
+            reference = baseline.get(stage, {}).get(name)
+            if value is None or not reference:
+                continue
+            # Sub-millisecond timings are mostly noise
+            if name.endswith("seconds") and max(value, reference) < MIN_COMPARED_SECONDS:
+                continue
+            change = (value - reference) / reference
+            # Throughputs get worse when they drop, durations when they grow
+            if name.endswith("per_second"):
+                regressed = change < -tolerance
+            elif name.endswith("seconds"):
+                regressed = change > tolerance
+            else:
+                regressed = False
+            if regressed:
+                regressions.append(f"{stage}.{name}")
+            lines.append(f"{stage}.{name}: {reference:.4g} -> {value:.4g} ({change:+.1%})"
+                         f"{'  REGRESSION' if regressed else ''}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scraping, summarizing and storing end to end, offline, "
+                                                 "against a local fixture site and a stub Ollama server")
+    parser.add_argument("--handles", type=int, default=5, help="number of fixture profiles")
+    parser.add_argument("--posts-per-handle", type=int, default=10, help="posts of every profile, one pinned")
+    parser.add_argument("--days", type=int, default=30, help="days looked back, every post but the pinned is newer")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="seconds waited by every page request")
+    parser.add_argument("--page-latency-jitter", type=float, default=0.02, help="random extra page latency")
+    parser.add_argument("--extraction-mode", choices=("dom", "network"), default=EXTRACTION_MODE)
+    parser.add_argument("--walk-mode", choices=("grid", "next"), default=WALK_MODE)
+    parser.add_argument("--skip-scrape", action="store_true",
+                        help="summarize the fixture posts directly, without a browser")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="generation speed of the stub model")
+    parser.add_argument("--load-seconds", type=float, default=0.5, help="model load time of the stub server")
+    parser.add_argument("--workers", type=int, default=SUMMARIZER_WORKERS, help="parallel summaries")
+    parser.add_argument("--summary-mode", choices=("per_post", "batch"), default=SUMMARY_MODE)
+    parser.add_argument("--goal", help="goal of the summaries")
+    parser.add_argument("--queries", type=int, default=200, help="database queries of every kind")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="results compared with this run")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="share a metric can get worse before failing, e.g. 0.15")
+    args = parser.parse_args()
+
+    instrumentation.reset()
+    site = make_site(args.handles, args.posts_per_handle, max_age_days=args.days)
+    results = {}
+
+    if args.skip_scrape:
+        posts = site_posts(site)
+    else:
+        print("Scraping the fixture site...")
+        results["scrape"], posts = bench_scrape(site, args)
+
+    print(f"Summarizing {len(posts)} posts...")
+    results["summarize"], summarizer = bench_summarize(posts, args)
+
+    print("Storing and querying...")
+    results["database"] = bench_database(posts, summarizer, args)
+
+    parameters = {name: value for name, value in vars(args).items()
+                  if name not in ("baseline", "save_baseline", "tolerance")}
+    for stage, metrics in results.items():
+        print(f"\n{stage}")
+        for name, value in metrics.items():
+            print(f"  {name}: {value:.4g}" if isinstance(value, float) else f"  {name}: {value}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"parameters": parameters, "results": results}, file, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to create it")
+        return
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline["parameters"] != parameters:
+        print("\nWarning: the baseline was measured with different parameters")
+
+    lines, regressions = compare(results, baseline["results"], args.tolerance)
+    print("\nCompared with the baseline:\n" + "\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} metrics regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
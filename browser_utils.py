@@ -1,5 +1,7 @@
+import json
 import os
 import pickle
+import threading
 import time
 import random
 
@@ -10,7 +12,10 @@ from selenium.webdriver.common.by import By
 from selenium import webdriver
 from webdriver_manager.chrome import ChromeDriverManager
 
-from config import INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD
+from config import INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD, EXTRACTION_MODE, LEAN_BROWSER, BLOCKED_URL_PATTERNS, \
+    BROWSER_STATS_FILE, INSTAGRAM_BASE_URL
+from instrumentation import instrumentation
+from pacing import Pacer, page_loaded, element_present, element_absent
 
 
 def get_random_seconds(from_seconds, to_seconds):
@@ -28,15 +33,239 @@ def sleep_for_random_seconds(from_seconds, to_seconds):
     time.sleep(get_random_seconds(from_seconds, to_seconds))
 
 
-def setup_browser():
+def setup_browser(network_logs=EXTRACTION_MODE == "network", lean=LEAN_BROWSER, user_data_dir=None):
     """
     Initializes and returns a new Chrome WebDriver instance with basic options.
+
+    Args:
+        network_logs (bool): Enable the performance logs used to read the network responses
+        lean (bool): Run headless without GPU and extensions, blocking media, fonts and tracking
+        user_data_dir (str, optional): Persistent Chrome profile directory, can be used by one browser at a time
     """
-    print("Starting browser...")
+    print("Starting browser..." if not lean else "Starting lean browser...")
     chrome_options = Options()
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+    if user_data_dir:
+        chrome_options.add_argument(f"--user-data-dir={os.path.abspath(user_data_dir)}")
+    if network_logs:
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    if lean:
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--autoplay-policy=user-gesture-required")
+        chrome_options.add_argument("--window-size=1280,1024")
+
+    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+
+    if lean:
+        block_requests(driver)
+
+    return count_round_trips(driver)
+
+
+def count_round_trips(driver):
+    """
+    Counts every command sent to chromedriver, each one is a separate HTTP exchange.
+    The count of the driver is kept in driver.round_trips, the one of the run in the
+    "webdriver.round_trips" counter.
+    """
+    driver.round_trips = 0
+    execute = driver.execute
+
+    def counted_execute(driver_command, params=None):
+        driver.round_trips += 1
+        instrumentation.count("webdriver.round_trips")
+        return execute(driver_command, params)
+
+    driver.execute = counted_execute
+    return driver
+
+
+def block_requests(driver, url_patterns=BLOCKED_URL_PATTERNS):
+    """
+    Blocks every request matching the url patterns through the Chrome DevTools protocol.
+    Applies to the current tab only.
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": url_patterns})
+    # Kept to block the same requests in the tabs opened later
+    driver.blocked_url_patterns = url_patterns
+
+
+class BrowserStats:
+    """
+    Collects the bytes transferred and the load time of the pages opened by the browsers of a run,
+    and compares them with the last run done in the other browser mode. Without a full mode run,
+    a lean browser loads a page once without blocking to measure what the blocking saves.
+    """
+
+    # Totals of the current document as seen by the Resource Timing API
+    PAGE_STATS_SCRIPT = """
+    const navigation = performance.getEntriesByType('navigation')[0];
+    let bytes = navigation ? navigation.transferSize : 0;
+    for (const resource of performance.getEntriesByType('resource')) {
+        bytes += resource.transferSize || 0;
+    }
+    return {
+        url: document.location.href,
+        bytes: bytes,
+        load_ms: navigation ? navigation.loadEventEnd - navigation.startTime : 0
+    };
+    """
+
+    def __init__(self, lean=LEAN_BROWSER, stats_file=BROWSER_STATS_FILE):
+        self.mode = "lean" if lean else "full"
+        self.stats_file = stats_file
+        self.pages = 0
+        self.bytes = 0
+        self.load_ms = 0
+        self._recorded_urls = set()
+        self._baseline_claimed = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prepare_page(driver):
+        """Makes room for every resource of a freshly opened page in the Resource Timing buffer"""
+        driver.execute_script("performance.setResourceTimingBufferSize(10000);")
+
+    def record_page(self, driver):
+        """
+        Records the current page, call it right before navigating away so that every resource
+        loaded by the page is counted.
+        """
+        try:
+            stats = driver.execute_script(self.PAGE_STATS_SCRIPT)
+        except Exception as e:
+            print(f"Could not read page stats: {e}")
+            return
+
+        self._add_page(stats)
+
+    def _add_page(self, stats):
+        with self._lock:
+            if not stats or stats["url"] in self._recorded_urls:
+                return
+            self._recorded_urls.add(stats["url"])
+            self.pages += 1
+            self.bytes += stats["bytes"]
+            self.load_ms += max(stats["load_ms"], 0)
+
+    def claim_baseline(self):
+        """
+        Whether the caller should measure the baseline with measure_baseline: only in lean mode, when
+        neither a full mode run nor a baseline is stored, and for a single page of the run.
+        """
+        with self._lock:
+            if self.mode != "lean" or self._baseline_claimed:
+                return False
+            self._baseline_claimed = True
+        previous = self._load_previous()
+        return "full" not in previous and "baseline" not in previous
+
+    def measure_baseline(self, driver, pacer=None):
+        """
+        Loads the current page again with the request blocking lifted and the cache disabled, then
+        stores the bytes and load time of both loads as the baseline of the lean mode savings.
+        The lean load of the page is recorded as usual.
+        """
+        url_patterns = getattr(driver, "blocked_url_patterns", None)
+        if url_patterns is None:
+            return
+        pacer = pacer if pacer is not None else Pacer()
+
+        try:
+            lean = driver.execute_script(self.PAGE_STATS_SCRIPT)
+            self._add_page(lean)
+            driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+            try:
+                driver.refresh()
+                pacer.wait_until(driver, "baseline", page_loaded())
+                full = driver.execute_script(self.PAGE_STATS_SCRIPT)
+            finally:
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": url_patterns})
+                driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": False})
+        except Exception as e:
+            print(f"Could not measure the browser baseline: {e}")
+            return
+
+        if not lean or not full or not lean["bytes"]:
+            return
+        baseline = {
+            "url": lean["url"],
+            "lean_bytes": lean["bytes"],
+            "full_bytes": full["bytes"],
+            "lean_load_ms": max(lean["load_ms"], 0),
+            "full_load_ms": max(full["load_ms"], 0)
+        }
+        print(f"Browser baseline: {baseline['full_bytes'] / 1_000_000:.1f} MB without blocking, "
+              f"{baseline['lean_bytes'] / 1_000_000:.1f} MB in lean mode")
+        self._store("baseline", baseline)
+
+    def averages(self):
+        """Returns the average bytes and load time per page"""
+        if not self.pages:
+            return {"pages": 0, "bytes_per_page": 0, "load_ms_per_page": 0}
+        return {
+            "pages": self.pages,
+            "bytes_per_page": self.bytes / self.pages,
+            "load_ms_per_page": self.load_ms / self.pages
+        }
+
+    def _load_previous(self):
+        """Returns the stored averages of every mode"""
+        if not os.path.exists(self.stats_file):
+            return {}
+        try:
+            with open(self.stats_file, "r") as file:
+                return json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _store(self, key, value):
+        previous = self._load_previous()
+        previous[key] = value
+        os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
+        with open(self.stats_file, "w") as file:
+            json.dump(previous, file, indent=2)
+
+    def save(self):
+        """Stores the averages of this run for its browser mode"""
+        if self.pages:
+            self._store(self.mode, self.averages())
+
+    def report(self):
+        """
+        Returns a printable report of this run, with the savings against the last full mode run or,
+        without one, estimated from the baseline page
+        """
+        averages = self.averages()
+        report = (f"Browser ({self.mode}): {averages['pages']} pages, {self.bytes / 1_000_000:.1f} MB transferred, "
+                  f"{averages['load_ms_per_page']:.0f} ms average page load")
+        if self.mode != "lean" or not averages["pages"]:
+            return report
+
+        previous = self._load_previous()
+        full = previous.get("full")
+        baseline = previous.get("baseline")
+        if full:
+            saved_bytes = (full["bytes_per_page"] - averages["bytes_per_page"]) * averages["pages"]
+            saved_ms = full["load_ms_per_page"] - averages["load_ms_per_page"]
+            report += (f"\nSaved against the last full run: {saved_bytes / 1_000_000:.1f} MB, "
+                       f"{saved_ms:.0f} ms per page load")
+        elif baseline:
+            # The pages of the run are assumed to save the same share as the baseline page
+            saved_bytes = self.bytes * (baseline["full_bytes"] / baseline["lean_bytes"] - 1)
+            saved_ms = 0
+            if baseline["lean_load_ms"]:
+                saved_ms = averages["load_ms_per_page"] * (baseline["full_load_ms"] / baseline["lean_load_ms"] - 1)
+            report += (f"\nSaved against loading without blocking, estimated from {baseline['url']}: "
+                       f"{saved_bytes / 1_000_000:.1f} MB, {saved_ms:.0f} ms per page load")
+
+        return report
 
 
 def load_cookies(driver, cookies_file):
@@ -59,13 +288,15 @@ def load_cookies(driver, cookies_file):
         return False
 
 
-def login(driver, cookies_file):
+def login(driver, cookies_file, pacer=None):
     """
     Logs into Instagram using saved cookies if available, or enters credentials manually.
     Saves cookies to file after login.
     """
-    driver.get("https://www.instagram.com/")
-    sleep_for_random_seconds(2, 3)
+    pacer = pacer if pacer is not None else Pacer()
+
+    driver.get(f"{INSTAGRAM_BASE_URL}/")
+    pacer.wait_until(driver, "home", page_loaded())
 
     # Ensure data directory exists
     os.makedirs(os.path.dirname(cookies_file), exist_ok=True)
@@ -74,10 +305,26 @@ def login(driver, cookies_file):
         print("Loading cookies...")
         cookies_loaded = load_cookies(driver, cookies_file)
         if cookies_loaded:
-            driver.get("https://www.instagram.com/")  # Refresh after loading cookies
-            sleep_for_random_seconds(2, 3)
+            driver.get(f"{INSTAGRAM_BASE_URL}/")  # Refresh after loading cookies
+            pacer.wait_until(driver, "home", page_loaded())
             return
 
+    login_with_credentials(driver, cookies_file, pacer)
+
+
+def login_with_credentials(driver, cookies_file, pacer=None):
+    """
+    Logs into Instagram through the login form with the credentials from the environment.
+    Saves cookies to file after login.
+    """
+    pacer = pacer if pacer is not None else Pacer()
+
+    if not driver.current_url.startswith(f"{INSTAGRAM_BASE_URL}/") or "robots.txt" in driver.current_url:
+        driver.get(f"{INSTAGRAM_BASE_URL}/")
+        pacer.wait_until(driver, "home", page_loaded())
+
+    os.makedirs(os.path.dirname(cookies_file), exist_ok=True)
+
     # Check if credentials are available
     if not INSTAGRAM_USERNAME or not INSTAGRAM_PASSWORD:
         raise ValueError("Instagram credentials not found in environment variables. "
@@ -90,26 +337,28 @@ def login(driver, cookies_file):
     except NoSuchElementException:
         print("Cookies already accepted")
 
-    sleep_for_random_seconds(4, 5)
+    pacer.wait_until(driver, "login_form", element_present("input[name='username']"))
 
     username_input = driver.find_element(By.CSS_SELECTOR, "input[name='username']")
     password_input = driver.find_element(By.CSS_SELECTOR, "input[name='password']")
 
     username_input.send_keys(INSTAGRAM_USERNAME)
-    sleep_for_random_seconds(1, 2)
+    pacer.jitter()
     password_input.send_keys(INSTAGRAM_PASSWORD)
-    sleep_for_random_seconds(1, 2)
+    pacer.jitter()
 
     login_button = driver.find_element(By.XPATH, "//button[@type='submit']")
     login_button.click()
     print("Logged in")
-    sleep_for_random_seconds(7, 8)
+    pacer.wait_until(driver, "login_submit", element_absent("input[name='password']"))
 
+    save_info_xpath = "//button[text()='Save info']"
+    pacer.wait_until(driver, "login_save_info", lambda d: d.find_elements(By.XPATH, save_info_xpath), timeout=10)
     try:
-        driver.find_element(By.XPATH, "//button[text()='Save info']").click()
+        driver.find_element(By.XPATH, save_info_xpath).click()
+        pacer.wait_until(driver, "home", page_loaded())
     except NoSuchElementException:
         print("No 'Save info' button found")
 
-    sleep_for_random_seconds(7, 8)
     pickle.dump(driver.get_cookies(), open(cookies_file, "wb"))
-    print("Stored login cookies")
\ No newline at end of file
+    print("Stored login cookies")
@@ -1,3 +1,7 @@
+import argparse
+from datetime import datetime
+
+
 def prompt_for_goal():
     use_goal = input("Would you like to specify a goal? (y/n): ").strip().lower()
     goal = None
@@ -5,4 +9,12 @@ def prompt_for_goal():
     if use_goal == 'y':
         goal = input("Enter your goal (e.g., events near Verona): ").strip()
 
-    return goal
\ No newline at end of file
+    return goal
+
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD command line date"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {value}")
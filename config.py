@@ -11,6 +11,9 @@ load_dotenv()
 INSTAGRAM_USERNAME = os.environ.get("INSTAGRAM_USERNAME")
 INSTAGRAM_PASSWORD = os.environ.get("INSTAGRAM_PASSWORD")
 
+# Site opened by the browser, pointed to a local fixture server by the benchmarks
+INSTAGRAM_BASE_URL = os.environ.get("INSTAGRAM_BASE_URL", "https://www.instagram.com").rstrip("/")
+
 # Default Instagram handles to scrape
 DEFAULT_HANDLES = [
     "ilmuretto_official",
@@ -41,11 +44,142 @@ DEFAULT_HANDLES = [
 # Browser settings
 COOKIES_FILE = os.path.join("data", "cookies.pkl")
 
+# Lean mode runs Chrome headless without GPU and extensions, blocking the requests below
+LEAN_BROWSER = True
+# Url patterns blocked in lean mode: images, videos, fonts and tracking
+BLOCKED_URL_PATTERNS = [
+    "*.jpg*", "*.jpeg*", "*.png*", "*.webp*", "*.heic*", "*.gif*",
+    "*.mp4*", "*.m4a*", "*.m4v*", "*.webm*",
+    "*.woff*", "*.woff2*", "*.ttf*", "*.otf*",
+    "*/logging_client_events*", "*/ajax/bz*", "*facebook.com/tr*", "*/falco*",
+]
+# Bytes and load time per page of the last run of every browser mode, and of a page loaded once without
+# blocking when no full mode run is stored, used to report the savings
+BROWSER_STATS_FILE = os.path.join("data", "browser_stats.json")
+
+# Persistent Chrome profile keeping the Instagram session between runs
+BROWSER_PROFILE_DIR = os.path.join("data", "chrome_profile")
+
+# Number of Chrome instances scraping handles in parallel (1 disables the pool)
+SCRAPER_WORKERS = 3
+# Minimum seconds a single worker waits between two profile visits
+SCRAPER_WORKER_PROFILE_INTERVAL = 10
+
 # Database settings
 DATABASE_FILE = os.path.join("data", "instagram_scraper.db")
 
 # Scraping settings
 DAYS_TO_LOOK_BACK = 2
+# "network" reads posts from the feed JSON responses captured by Chrome, falling back to the DOM
+# when none is captured, "dom" always opens every post
+EXTRACTION_MODE = "network"
+# Maximum number of grid scrolls done to load older posts in network mode
+NETWORK_MAX_SCROLLS = 5
+# Read every opened post with a single script call instead of one WebDriver command per element
+SCRIPT_EXTRACTION = True
+# "grid" collects the post links of the profile grid and opens the ones not stored yet in parallel
+# tabs, "next" walks the posts one at a time with the next button of the post dialog
+WALK_MODE = "grid"
+# Browser tabs loading posts at the same time in grid mode
+GRID_TABS = 4
+# Maximum number of grid scrolls done to reach older posts in grid mode
+GRID_MAX_SCROLLS = 5
+# Seconds to wait for more posts after scrolling the grid, the end of the grid is reached otherwise
+GRID_SCROLL_TIMEOUT = 5
+
+# Pacing settings
+# Range of seconds always waited after a page is ready, to look human
+PACING_MIN_JITTER = (0.5, 1.5)
+# Maximum seconds to wait for a page to be ready
+PACING_TIMEOUT = 20
+# Back off once pages load this many times slower than the fastest load seen
+PACING_SLOWDOWN_THRESHOLD = 1.5
+# Maximum extra seconds added when backing off
+PACING_MAX_BACKOFF = 10
 
 # Model settings
-MODEL_NAME = "mistral:7b-instruct"
\ No newline at end of file
+MODEL_NAME = "mistral:7b-instruct"
+# Ollama server, pointed to a stub server by the benchmarks
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+# How long Ollama keeps the model loaded after the last request
+OLLAMA_KEEP_ALIVE = "30m"
+# Context window requested to the model, overviews of more posts than fit are reduced in steps
+MODEL_CONTEXT_TOKENS = 8192
+# Posts summarized at the same time, match the OLLAMA_NUM_PARALLEL of the server
+SUMMARIZER_WORKERS = 4
+# Seconds to wait for a single Ollama response
+OLLAMA_TIMEOUT = 300
+# Retries of an Ollama request failing because of connection or server errors
+OLLAMA_RETRIES = 2
+# "per_post" sends one request per post, "batch" packs as many posts as fit BATCH_TOKEN_BUDGET in one request
+SUMMARY_MODE = "per_post"
+# Maximum prompt tokens of a batch of posts
+BATCH_TOKEN_BUDGET = 3000
+# Consume the responses as token streams, reporting time to first token and tokens per second
+OLLAMA_STREAM = True
+
+# Preprocessing settings
+# Captions at least this similar (estimated Jaccard similarity of word shingles) are summarized once
+DUPLICATE_SIMILARITY = 0.8
+# Number of hash functions of the MinHash signatures
+MINHASH_PERMUTATIONS = 64
+
+# Summary cache settings
+# Maximum number of cached per-post summaries, the least recently used are evicted
+SUMMARY_CACHE_MAX_ENTRIES = 10000
+# Cached summaries older than this are evicted
+SUMMARY_CACHE_MAX_AGE_DAYS = 90
+
+# Pipeline settings
+# Summarize the posts while the next ones are scraped instead of after the scraping, per post summaries only
+PIPELINE_MODE = True
+# Scraped posts waiting for the summarizer, the scraping pauses once the queue is full and the browsers
+# of the pool pause once as many more are waiting for the queue
+PIPELINE_QUEUE_SIZE = 8
+
+# Relevance settings
+# With a goal, rank the posts against it and summarize only the relevant ones
+RELEVANCE_FILTER = True
+# Minimum relevance of a post to summarize, from 0 (nothing in common with the goal) to 1 (a word of the goal)
+RELEVANCE_THRESHOLD = 0.1
+# Summarize at most this many of the most relevant posts, None for no limit (not applied while pipelining)
+RELEVANCE_TOP_K = None
+# Ask the model for synonyms and translations of the goal before ranking
+RELEVANCE_EXPANSION = True
+
+# Embedding settings
+# Ollama model embedding the posts for the semantic search, pull it with `ollama pull nomic-embed-text`
+EMBEDDING_MODEL = "nomic-embed-text"
+# Posts embedded in a single request
+EMBEDDING_BATCH_SIZE = 32
+# Embed the new posts at the end of every run
+EMBED_AFTER_RUN = True
+
+# Instrumentation settings
+# Directory of the JSON report of every run, with the timings of every stage and the model statistics
+RUN_REPORTS_DIR = "data/runs"
+# Path of a Prometheus textfile collector file updated after every run, None to skip it
+PROMETHEUS_TEXTFILE = None
+
+# Daemon settings
+# A handle is visited again once this many new posts are expected from its posting rate
+DAEMON_TARGET_NEW_POSTS = 1
+# Bounds of the hours between two visits of the same handle, quiet handles are still visited once in a while
+DAEMON_MIN_INTERVAL_HOURS = 2
+DAEMON_MAX_INTERVAL_HOURS = 7 * 24
+# Days of stored posts used to learn the posting rate of every handle
+DAEMON_RATE_WINDOW_DAYS = 60
+# Maximum profile visits per day over all the handles, spread evenly over the day
+DAEMON_MAX_VISITS_PER_DAY = 150
+# How long Ollama keeps the model loaded between the jobs of the daemon
+DAEMON_KEEP_ALIVE = "24h"
+
+# Export settings
+# Formats written for every report: "markdown", "html", "pdf" and "json"
+EXPORT_TARGETS = ["markdown", "pdf"]
+# Format opened once rendered, None to open nothing
+EXPORT_OPEN = "pdf"
+# Renderings reused when the same content is exported again
+EXPORT_CACHE_FILE = os.path.join("data", "export_cache.json")
+# Maximum number of rendered HTML sections kept in the export cache
+EXPORT_CACHE_MAX_SECTIONS = 5000
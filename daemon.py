@@ -0,0 +1,390 @@
+import argparse
+import asyncio
+import random
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from selenium.common.exceptions import WebDriverException
+
+from browser_utils import BrowserStats
+from config import DATABASE_FILE, DAYS_TO_LOOK_BACK, DEFAULT_HANDLES, MODEL_NAME, RELEVANCE_FILTER, \
+    EMBED_AFTER_RUN, PROMETHEUS_TEXTFILE, DAEMON_TARGET_NEW_POSTS, DAEMON_MIN_INTERVAL_HOURS, \
+    DAEMON_MAX_INTERVAL_HOURS, DAEMON_RATE_WINDOW_DAYS, DAEMON_MAX_VISITS_PER_DAY, DAEMON_KEEP_ALIVE
+from database import DatabaseManager
+from instrumentation import instrumentation
+from ollama_manager import OllamaManager
+from preprocess import preprocess_posts
+from relevance import RelevanceFilter
+from scraper import InstagramScraper
+from session import SessionManager
+from summarizer import ContentSummarizer
+from summary_cache import SummaryCache
+from vector_index import VectorIndex
+
+# Posting rate assumed for a handle without history, one post a week, it weighs less as posts are stored
+PRIOR_POSTS = 1
+PRIOR_HOURS = 7 * 24
+# Share of an interval added or removed at random, so that visits planned together drift apart
+INTERVAL_JITTER = 0.1
+# Visits waiting for the model, the visits pause once this many are waiting
+MAX_PENDING_JOBS = 4
+
+
+def posting_rate(posts_count, observed_hours):
+    """
+    Returns the posting rate of a handle in posts per hour, smoothed towards the prior so that
+    a handle is not dismissed because of a few quiet days.
+
+    Args:
+        posts_count (int): Posts published in the observed hours
+        observed_hours (float): Hours of history the posts were counted over
+    """
+    return (posts_count + PRIOR_POSTS) / (observed_hours + PRIOR_HOURS)
+
+
+class VisitBudget:
+    """
+    Token bucket spreading the profile visits evenly over the day: a visit is allowed every
+    24 hours / visits_per_day, with at most burst visits back to back after a quiet period.
+    """
+
+    def __init__(self, visits_per_day=DAEMON_MAX_VISITS_PER_DAY, burst=1):
+        self.interval = 24 * 3600 / visits_per_day
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+
+    def delay(self):
+        """Returns the seconds to wait before the next visit is allowed"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) * self.interval)
+
+    def take(self):
+        """Spends a visit"""
+        self._refill()
+        self.tokens -= 1
+
+
+class ScrapeScheduler:
+    """
+    Long-running scraper visiting every handle when new posts are expected from its posting rate,
+    learned from the stored posts, instead of visiting every handle on every run. The browser and
+    the model stay loaded between visits, the posts of a visit are summarized while the next
+    handles are visited, and stored like the ones of a main.py run.
+    """
+
+    def __init__(self, db_manager, handles, goal=None, target_new_posts=DAEMON_TARGET_NEW_POSTS,
+                 min_interval_hours=DAEMON_MIN_INTERVAL_HOURS, max_interval_hours=DAEMON_MAX_INTERVAL_HOURS,
+                 rate_window_days=DAEMON_RATE_WINDOW_DAYS, budget=None):
+        """
+        Args:
+            db_manager (DatabaseManager): Database holding the posts, the visits and the summaries
+            handles (list): Instagram handles to follow
+            goal (str, optional): Goal of the summaries
+            target_new_posts (float): A handle is visited once this many new posts are expected
+            min_interval_hours (float): Minimum hours between two visits of the same handle
+            max_interval_hours (float): Maximum hours between two visits of the same handle
+            rate_window_days (int): Days of stored posts used to learn the posting rates
+            budget (VisitBudget, optional): Global limit of the visits, DAEMON_MAX_VISITS_PER_DAY by default
+        """
+        self.db_manager = db_manager
+        self.handles = list(handles)
+        self.goal = goal
+        self.target_new_posts = target_new_posts
+        self.min_interval_hours = min_interval_hours
+        self.max_interval_hours = max_interval_hours
+        self.rate_window_days = rate_window_days
+        self.budget = budget if budget is not None else VisitBudget()
+
+        # handle -> posts per hour, and handle -> (visited_at, new_posts) of the last visit
+        self.rates = {}
+        self.visits = {}
+        # handle -> planned visit, the jitter is drawn once per visit
+        self._planned = {}
+
+        self.driver = None
+        self.scraper = None
+        self.session = None
+        self.summarizer = None
+        self.relevance = None
+        self._stop = None
+        # Set when a visit is planned earlier than the one the daemon is waiting for
+        self._replanned = None
+
+    def refresh(self, now=None):
+        """Learns the posting rates again from the stored posts and loads the last visits"""
+        now = now or datetime.now()
+        stats = self.db_manager.get_posting_stats(now - timedelta(days=self.rate_window_days))
+        self.visits = self.db_manager.get_handle_visits()
+
+        window_hours = self.rate_window_days * 24
+        for handle in self.handles:
+            posts_count, oldest = stats.get(handle, (0, None))
+            if oldest is not None:
+                # Only the scraped history counts, at least the window of a single run
+                observed_hours = max((now - oldest).total_seconds() / 3600, DAYS_TO_LOOK_BACK * 24)
+            elif handle in self.visits:
+                observed_hours = window_hours
+            else:
+                observed_hours = 0
+            self.rates[handle] = posting_rate(posts_count, min(observed_hours, window_hours))
+
+    def interval_hours(self, handle):
+        """Hours after which the target number of new posts is expected from the handle"""
+        hours = self.target_new_posts / self.rates[handle]
+        return min(self.max_interval_hours, max(self.min_interval_hours, hours))
+
+    def _plan_after(self, handle, visited_at):
+        """Plans the visit following the one at visited_at"""
+        jitter = random.uniform(1 - INTERVAL_JITTER, 1 + INTERVAL_JITTER)
+        self._planned[handle] = visited_at + timedelta(hours=self.interval_hours(handle) * jitter)
+
+    def next_visit(self, handle):
+        """Returns when the handle is visited next, handles never visited are due immediately"""
+        if handle not in self._planned:
+            if handle not in self.visits:
+                return datetime.min
+            self._plan_after(handle, self.visits[handle][0])
+        return self._planned[handle]
+
+    def plan(self):
+        """
+        Returns the planned visits, soonest first
+
+        Returns:
+            list: (next_visit, handle, posts_per_day) tuples
+        """
+        return sorted((self.next_visit(handle), handle, self.rates[handle] * 24) for handle in self.handles)
+
+    def _visit(self, handle, min_date, high_water_mark, known_post_ids):
+        """Scrapes the new posts of a handle, starting the browser the first time. Runs on the browser thread."""
+        if self.driver is None:
+            self.driver = self.session.start_browser()
+            self.scraper = InstagramScraper(self.driver, browser_stats=BrowserStats())
+        try:
+            return list(self.scraper.iter_posts(
+                min_date, [handle], {handle: high_water_mark} if high_water_mark else None, {handle: known_post_ids}
+            ))
+        except WebDriverException:
+            # The next visit starts a new browser
+            self._close_browser()
+            raise
+
+    def _close_browser(self):
+        """Quits the browser, runs on the browser thread"""
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+        self.driver = None
+        self.scraper = None
+
+    def _summarize(self, posts):
+        """Summarizes the posts of a visit. Runs on the model thread."""
+        prepared = preprocess_posts(posts, self.summarizer.token_counter)
+        if self.relevance is not None:
+            # The filter and its expanded query live as long as the daemon, only this visit is listed as skipped
+            self.relevance.skipped.clear()
+        relevant_posts = self.relevance.split(prepared.posts) if self.relevance is not None else prepared.posts
+        summary = self.summarizer.create_unified_summary_per_single_post(
+            relevant_posts, self.goal, duplicates=prepared.duplicates,
+            skipped=self.relevance.skipped if self.relevance is not None else None
+        )
+        return summary, self.summarizer.last_overview, self.summarizer.post_digests()
+
+    def _retry_soon(self, handle):
+        """Plans a failed visit again after the minimum interval, its last visit is left as it was"""
+        self._planned[handle] = datetime.now() + timedelta(hours=self.min_interval_hours)
+        self._replanned.set()
+
+    async def _sleep(self, seconds, wake=None):
+        """
+        Sleeps unless the daemon is stopped meanwhile
+
+        Args:
+            seconds (float): Seconds to sleep
+            wake (asyncio.Event, optional): Also ends the sleep when set, it is cleared first
+
+        Returns:
+            bool: True if the daemon was stopped
+        """
+        if seconds > 0:
+            events = [self._stop]
+            if wake is not None:
+                wake.clear()
+                events.append(wake)
+            waiters = [asyncio.ensure_future(event.wait()) for event in events]
+            _, pending = await asyncio.wait(waiters, timeout=seconds, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in pending:
+                waiter.cancel()
+        return self._stop.is_set()
+
+    async def _store_jobs(self, jobs, model_thread):
+        """
+        Summarizes and stores the posts of the visits, one visit at a time, until the None sentinel. A visit
+        is recorded only once its posts are stored, so the next one scrapes them again when storing fails.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await jobs.get()
+            if job is None:
+                return
+
+            handle, visited_at, posts = job
+            try:
+                summary, overview, digests = await loop.run_in_executor(model_thread, self._summarize, posts)
+                # The posts are stored from the event loop thread, the summary cache from the model thread,
+                # both through the lock of the database
+                self.db_manager.save_summary(summary, visited_at.isoformat(), posts, goal=self.goal,
+                                             model=self.summarizer.model, overview=overview, digests=digests)
+                self.db_manager.update_handle_states(posts)
+                self.db_manager.record_handle_visit(handle, visited_at, len(posts))
+                print(f"Stored {len(posts)} new posts of {handle}")
+            except Exception as e:
+                print(f"Could not summarize the posts of {handle}, they are scraped again next time: {e}")
+                self._retry_soon(handle)
+                continue
+
+            if EMBED_AFTER_RUN:
+                try:
+                    print(f"Embedded {VectorIndex(self.db_manager).update()} new posts")
+                except Exception as e:
+                    print(f"Could not embed the new posts: {e}")
+
+            self.refresh()
+            self._planned.pop(handle, None)
+            # Every stored job closes a run, the spans of the visit being scraped meanwhile go to the next one
+            report = instrumentation.report(reset=True)
+            if PROMETHEUS_TEXTFILE:
+                instrumentation.write_prometheus(PROMETHEUS_TEXTFILE, report=report)
+
+    async def run(self, session, summarizer, relevance=None):
+        """
+        Visits the handles as planned until SIGINT or SIGTERM
+
+        Args:
+            session (SessionManager): Login session of the browser
+            summarizer (ContentSummarizer): Summarizer kept loaded between visits
+            relevance (RelevanceFilter, optional): Skips the posts unrelated to the goal
+        """
+        self.session = session
+        self.summarizer = summarizer
+        self.relevance = relevance
+        self._stop = asyncio.Event()
+        self._replanned = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self._stop.set)
+            except NotImplementedError:
+                # Windows, stopped by KeyboardInterrupt instead
+                pass
+
+        # Selenium drivers must stay on the thread that created them, the model gets its own thread
+        browser_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="daemon-browser")
+        model_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="daemon-model")
+        jobs = asyncio.Queue(maxsize=MAX_PENDING_JOBS)
+        storing = asyncio.create_task(self._store_jobs(jobs, model_thread))
+
+        self.refresh()
+        try:
+            while not self._stop.is_set():
+                due, handle, posts_per_day = self.plan()[0]
+                seconds = (due - datetime.now()).total_seconds()
+                if seconds > 0:
+                    # Plans again when a failed visit is retried before the due one
+                    await self._sleep(seconds, self._replanned)
+                    continue
+                if await self._sleep(self.budget.delay()):
+                    break
+                self.budget.take()
+
+                # Posts since the last visit, at least the usual window, the stored ones are skipped anyway
+                visited_at = datetime.now()
+                min_date = visited_at - timedelta(days=DAYS_TO_LOOK_BACK)
+                if handle in self.visits:
+                    min_date = min(min_date, self.visits[handle][0])
+                high_water_mark = self.db_manager.get_handle_states().get(handle)
+                known_post_ids = self.db_manager.get_post_ids_by_handle([handle]).get(handle, set())
+
+                print(f"Visiting {handle}, {posts_per_day:.2f} posts a day expected")
+                try:
+                    posts = await loop.run_in_executor(browser_thread, self._visit, handle, min_date,
+                                                       high_water_mark, known_post_ids)
+                except Exception as e:
+                    print(f"Visit of {handle} failed: {e}")
+                    self._retry_soon(handle)
+                    continue
+
+                if posts:
+                    # Recorded once stored, meanwhile the next visit is planned from this one
+                    self._plan_after(handle, visited_at)
+                    # Waits when the model is behind, the browser stays idle meanwhile
+                    await jobs.put((handle, visited_at, posts))
+                else:
+                    self.db_manager.record_handle_visit(handle, visited_at, 0)
+                    self.visits[handle] = (visited_at, 0)
+                    self._planned.pop(handle, None)
+                print(f"{handle}: {len(posts)} new posts, next visit at {self.next_visit(handle):%Y-%m-%d %H:%M}")
+        finally:
+            await jobs.put(None)
+            await storing
+            await loop.run_in_executor(browser_thread, self._close_browser)
+            browser_thread.shutdown()
+            model_thread.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep scraping and summarizing the handles, visiting each one "
+                                                 "when new posts are expected from its posting rate")
+    parser.add_argument("--handle", action="append", dest="handles",
+                        help="handle to follow, repeatable, the handles of the last run by default")
+    parser.add_argument("--goal", help="goal of the summaries")
+    parser.add_argument("--plan", action="store_true", help="print the planned visits and exit")
+    parser.add_argument("--db", default=DATABASE_FILE, help="database file")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.db)
+    db_manager.setup_tables()
+    handles = args.handles or db_manager.get_scrape_metadata()[0] or DEFAULT_HANDLES
+    scheduler = ScrapeScheduler(db_manager, handles, args.goal)
+
+    if args.plan:
+        scheduler.refresh()
+        for due, handle, posts_per_day in scheduler.plan():
+            when = "now" if due <= datetime.now() else f"{due:%Y-%m-%d %H:%M}"
+            print(f"{handle}: {posts_per_day:.2f} posts a day, next visit {when}")
+        db_manager.close()
+        return
+
+    # The model stays loaded between the visits
+    ollama = OllamaManager(keep_alive=DAEMON_KEEP_ALIVE)
+    ollama.start()
+    ollama.preload()
+    summary_cache = SummaryCache(db_manager)
+    summary_cache.evict()
+    summarizer = ContentSummarizer(model=MODEL_NAME, cache=summary_cache, keep_alive=DAEMON_KEEP_ALIVE)
+    relevance = RelevanceFilter(args.goal, summarizer=summarizer) if args.goal and RELEVANCE_FILTER else None
+
+    print(f"Following {len(handles)} handles, at most {DAEMON_MAX_VISITS_PER_DAY} visits a day")
+    try:
+        asyncio.run(scheduler.run(SessionManager(), summarizer, relevance))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping")
+        ollama.stop()
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
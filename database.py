@@ -1,27 +1,44 @@
 import json
+import re
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 
+from instrumentation import instrumentation
 from models import InstagramPost
+from preprocess import clean_caption
 
 
-class DatabaseManager:
-    def __init__(self, db_name):
-        """Initialize database connection"""
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
+# Connection settings: write ahead log so readers never wait for the writer, fsync only at checkpoints,
+# 16MB page cache, temporary tables in memory and a wait instead of an error when the database is locked
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA busy_timeout = 5000",
+)
 
-    def setup_tables(self):
-        """Create necessary database tables if they don't exist"""
-        self.cursor.execute("""
+# Words of a free text query, quoted so that FTS5 never reads them as operators
+FTS_WORD_PATTERN = re.compile(r"\w+")
+
+# Compiled statements kept by every connection, more than the statements of this module
+CACHED_STATEMENTS = 128
+
+# Schema versions, applied in order to databases whose PRAGMA user_version is lower.
+# Databases created before the versioning have version 0 and may already contain some of the objects,
+# so every statement must tolerate them.
+MIGRATIONS = [
+    (1, "base tables", [
+        """
         CREATE TABLE IF NOT EXISTS summaries (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             summary TEXT NOT NULL,
             scraped_at TIMESTAMP NOT NULL
         )
-        """)
-
-        self.cursor.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS post_summary (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             summary_id INTEGER NOT NULL,
@@ -32,45 +49,270 @@ class DatabaseManager:
             post_date TIMESTAMP NOT NULL,
             FOREIGN KEY (summary_id) REFERENCES summaries(id)
         )
-        """)
-
-        self.cursor.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS last_scrape_metadata (
             id INTEGER PRIMARY KEY CHECK (id = 1),
             last_scrape TIMESTAMP,
             handles TEXT -- JSON array of strings
         )
-        """)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS handle_state (
+            handle TEXT PRIMARY KEY,
+            last_post_id TEXT NOT NULL,
+            last_post_date TIMESTAMP NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            cache_key TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            last_used_at TIMESTAMP NOT NULL
+        )
+        """,
+    ]),
+    (2, "unique posts", [
+        # Older databases may contain the same post more than once, keep the first copy
+        """
+        DELETE FROM post_summary
+        WHERE id NOT IN (SELECT MIN(id) FROM post_summary GROUP BY post_id)
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_post_summary_post_id ON post_summary(post_id)",
+        # Start the high-water marks from the posts stored before them, SQLite takes the post_id
+        # of the row with the MAX(post_date)
+        """
+        INSERT OR IGNORE INTO handle_state (handle, last_post_id, last_post_date)
+        SELECT handle, post_id, MAX(post_date)
+        FROM post_summary
+        WHERE handle IS NOT NULL
+        GROUP BY handle
+        """,
+    ]),
+    (3, "lookup indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_post_summary_post_date ON post_summary(post_date)",
+        "CREATE INDEX IF NOT EXISTS idx_post_summary_handle_date ON post_summary(handle, post_date)",
+        "CREATE INDEX IF NOT EXISTS idx_post_summary_summary_id ON post_summary(summary_id)",
+        "CREATE INDEX IF NOT EXISTS idx_summary_cache_last_used_at ON summary_cache(last_used_at)",
+    ]),
+    (4, "full-text search", [
+        "ALTER TABLE post_summary ADD COLUMN clean_caption TEXT",
+        "UPDATE post_summary SET clean_caption = clean_caption_text(caption)",
+        # External content tables, the text is stored once in post_summary and summaries
+        """
+        CREATE VIRTUAL TABLE posts_fts USING fts5(
+            clean_caption, content='post_summary', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE summaries_fts USING fts5(
+            summary, content='summaries', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        # Keep the indexes in sync with every write
+        """
+        CREATE TRIGGER post_summary_fts_insert AFTER INSERT ON post_summary BEGIN
+            INSERT INTO posts_fts(rowid, clean_caption) VALUES (new.id, new.clean_caption);
+        END
+        """,
+        """
+        CREATE TRIGGER post_summary_fts_delete AFTER DELETE ON post_summary BEGIN
+            INSERT INTO posts_fts(posts_fts, rowid, clean_caption) VALUES ('delete', old.id, old.clean_caption);
+        END
+        """,
+        """
+        CREATE TRIGGER post_summary_fts_update AFTER UPDATE OF clean_caption ON post_summary BEGIN
+            INSERT INTO posts_fts(posts_fts, rowid, clean_caption) VALUES ('delete', old.id, old.clean_caption);
+            INSERT INTO posts_fts(rowid, clean_caption) VALUES (new.id, new.clean_caption);
+        END
+        """,
+        """
+        CREATE TRIGGER summaries_fts_insert AFTER INSERT ON summaries BEGIN
+            INSERT INTO summaries_fts(rowid, summary) VALUES (new.id, new.summary);
+        END
+        """,
+        """
+        CREATE TRIGGER summaries_fts_delete AFTER DELETE ON summaries BEGIN
+            INSERT INTO summaries_fts(summaries_fts, rowid, summary) VALUES ('delete', old.id, old.summary);
+        END
+        """,
+        """
+        CREATE TRIGGER summaries_fts_update AFTER UPDATE OF summary ON summaries BEGIN
+            INSERT INTO summaries_fts(summaries_fts, rowid, summary) VALUES ('delete', old.id, old.summary);
+            INSERT INTO summaries_fts(rowid, summary) VALUES (new.id, new.summary);
+        END
+        """,
+        # Index what was stored before
+        "INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')",
+        "INSERT INTO summaries_fts(summaries_fts) VALUES ('rebuild')",
+    ]),
+    (5, "per-post summaries", [
+        "ALTER TABLE summaries ADD COLUMN goal TEXT",
+        "ALTER TABLE summaries ADD COLUMN model TEXT",
+        "ALTER TABLE summaries ADD COLUMN overview TEXT",
+        # One summary per post, goal and model, the goal is '' when there is none
+        """
+        CREATE TABLE post_digest (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_id TEXT NOT NULL,
+            summary_id INTEGER NOT NULL,
+            goal TEXT NOT NULL,
+            model TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (summary_id) REFERENCES summaries(id),
+            UNIQUE (post_id, goal, model)
+        )
+        """,
+        "CREATE INDEX idx_post_digest_summary_id ON post_digest(summary_id)",
+    ]),
+    (6, "post embeddings", [
+        # Vectors are float32 arrays, one per post and embedding model
+        """
+        CREATE TABLE post_embedding (
+            post_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            dimensions INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (post_id, model)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (7, "handle visits", [
+        # Last profile visit of every handle, used by the daemon to plan the next one
+        """
+        CREATE TABLE handle_visit (
+            handle TEXT PRIMARY KEY,
+            visited_at TIMESTAMP NOT NULL,
+            new_posts INTEGER NOT NULL
+        )
+        """,
+    ]),
+]
 
-        self.conn.commit()
+INSERT_POST = """
+INSERT OR IGNORE INTO post_summary (
+    summary_id, post_id, handle, reference_url, caption, post_date, clean_caption
+)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_POST_DIGEST = """
+INSERT INTO post_digest (post_id, summary_id, goal, model, summary, created_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(post_id, goal, model) DO UPDATE SET
+    summary_id = excluded.summary_id,
+    summary = excluded.summary,
+    created_at = excluded.created_at
+"""
+
+UPSERT_HANDLE_STATE = """
+INSERT INTO handle_state (handle, last_post_id, last_post_date)
+VALUES (?, ?, ?)
+ON CONFLICT(handle) DO UPDATE SET
+    last_post_id = excluded.last_post_id,
+    last_post_date = excluded.last_post_date
+WHERE excluded.last_post_date > handle_state.last_post_date
+"""
+
+
+def fts_query(text, prefix=True):
+    """
+    Turn free text into an FTS5 query matching all its words
+
+    Args:
+        text (str): The text typed by the user
+        prefix (bool): Whether the last word also matches longer words, e.g. "conc" matches "concert"
+
+    Returns:
+        str or None: The query, None if the text has no words
+    """
+    words = FTS_WORD_PATTERN.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class DatabaseManager:
+    def __init__(self, db_name):
+        """Initialize database connection"""
+        # The connection is shared with the summarizer workers, every access from them goes through the lock
+        self.conn = sqlite3.connect(db_name, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        # Used by the migrations to fill the full-text column of the stored posts
+        self.conn.create_function("clean_caption_text", 1, clean_caption, deterministic=True)
+        self.cursor = self.conn.cursor()
+        self.lock = threading.RLock()
+
+    def schema_version(self):
+        """Returns the version of the schema, 0 for databases created before the versioning"""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        """
+        Upgrade the schema in place to the latest version, every migration in its own transaction
+
+        Returns:
+            int: The schema version
+        """
+        with self.lock:
+            version = self.schema_version()
+            for target, description, statements in MIGRATIONS:
+                if target <= version:
+                    continue
+
+                print(f"Migrating database to version {target}: {description}")
+                self.conn.execute("BEGIN")
+                try:
+                    for statement in statements:
+                        self.conn.execute(statement)
+                    # PRAGMA does not accept parameters, target comes from MIGRATIONS
+                    self.conn.execute(f"PRAGMA user_version = {target}")
+                    self.conn.commit()
+                except sqlite3.Error:
+                    self.conn.rollback()
+                    raise
+                version = target
+
+            return version
+
+    def setup_tables(self):
+        """Create necessary database tables if they don't exist and upgrade older databases"""
+        self.migrate()
 
     def get_scrape_metadata(self):
         """Get handles and last scrape date from database"""
-        # Get handles
-        self.cursor.execute("SELECT handles FROM last_scrape_metadata WHERE id = 1")
+        self.cursor.execute("SELECT handles, last_scrape FROM last_scrape_metadata WHERE id = 1")
         result = self.cursor.fetchone()
 
         handles = []
-        if result and result[0]:
+        last_scrape_date = None
+        if result is None:
+            return handles, last_scrape_date
+
+        handles_json, last_scrape = result
+        if handles_json:
             try:
-                handles = json.loads(result[0])
+                handles = json.loads(handles_json)
             except json.JSONDecodeError:
                 handles = []
 
-        # Get last scrape date
-        self.cursor.execute("SELECT last_scrape FROM last_scrape_metadata WHERE id = 1")
-        result = self.cursor.fetchone()
-
-        last_scrape_date = None
-        if result and result[0]:
+        if last_scrape:
             try:
-                last_scrape_date = datetime.fromisoformat(result[0])
+                last_scrape_date = datetime.fromisoformat(last_scrape)
             except ValueError:
                 last_scrape_date = None
 
         return handles, last_scrape_date
 
-    def save_summary(self, summary_text, scraped_at, posts):
+    @instrumentation.timed("db.save_summary")
+    def save_summary(self, summary_text, scraped_at, posts, goal=None, model=None, overview=None, digests=None):
         """
         Save summary and related posts to database
 
@@ -78,34 +320,37 @@ class DatabaseManager:
             summary_text (str): The summary text
             scraped_at (str): ISO format timestamp when scraping was done
             posts (list): List of InstagramPost objects
-        """
-        # Insert summary
-        self.cursor.execute("""
-        INSERT INTO summaries (summary, scraped_at)
-        VALUES (?, ?)
-        """, (summary_text, scraped_at))
+            goal (str, optional): Focus of the summary
+            model (str, optional): Model that wrote the summaries
+            overview (str, optional): Overview of all the posts
+            digests (dict, optional): post_id -> summary of the post, stored for the goal and the model
 
-        self.conn.commit()
-        summary_id = self.cursor.lastrowid
+        Returns:
+            int: The id of the summary
+        """
+        with self.lock, self.conn:
+            # Insert summary
+            summary_id = self.conn.execute("""
+            INSERT INTO summaries (summary, scraped_at, goal, model, overview)
+            VALUES (?, ?, ?, ?, ?)
+            """, (summary_text, scraped_at, goal, model, overview)).lastrowid
 
-        # Insert posts
-        for post in posts:
-            self.cursor.execute("""
-            INSERT INTO post_summary (
-                summary_id, post_id, handle, reference_url, caption, post_date
-            )
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                summary_id,
-                post.post_id,
-                post.handle,
-                post.url,
-                post.caption,
-                post.date.isoformat()
+            # Insert posts in the same transaction, posts already stored are ignored
+            self.conn.executemany(INSERT_POST, (
+                (summary_id, post.post_id, post.handle, post.url, post.caption, post.date.isoformat(),
+                 clean_caption(post.caption))
+                for post in posts
             ))
 
-        self.conn.commit()
+            if digests and model:
+                self.conn.executemany(UPSERT_POST_DIGEST, (
+                    (post_id, summary_id, goal or "", model, summary, scraped_at)
+                    for post_id, summary in digests.items()
+                ))
+
+        return summary_id
 
+    @instrumentation.timed("db.update_scrape_metadata")
     def update_scrape_metadata(self, scraped_at, handles=None):
         """Update last scrape metadata"""
         if handles is not None:
@@ -126,19 +371,205 @@ class DatabaseManager:
 
         self.conn.commit()
 
-    def get_posts(self, limit=100, offset=0):
+    def get_handle_states(self):
+        """
+        Get the newest post already stored for every handle
+
+        Returns:
+            dict: handle -> (last_post_id, last_post_date)
+        """
+        with self.lock:
+            self.cursor.execute("SELECT handle, last_post_id, last_post_date FROM handle_state")
+
+            states = {}
+            for handle, last_post_id, last_post_date in self.cursor.fetchall():
+                states[handle] = (last_post_id, datetime.fromisoformat(last_post_date))
+
+        return states
+
+    def get_posting_stats(self, since):
+        """
+        Get how many posts every handle published since a date, used to learn its posting rate
+
+        Args:
+            since (datetime): Only posts published at or after this date
+
+        Returns:
+            dict: handle -> (posts_count, oldest_post_date)
+        """
+        with self.lock:
+            self.cursor.execute("""
+            SELECT handle, COUNT(*), MIN(post_date)
+            FROM post_summary
+            WHERE post_date >= ?
+            GROUP BY handle
+            """, (since.isoformat(),))
+
+            return {
+                handle: (posts_count, datetime.fromisoformat(oldest))
+                for handle, posts_count, oldest in self.cursor.fetchall()
+            }
+
+    def get_handle_visits(self):
         """
-        Retrieve posts from the database
+        Get the last profile visit of every handle
+
+        Returns:
+            dict: handle -> (visited_at, new_posts)
+        """
+        with self.lock:
+            self.cursor.execute("SELECT handle, visited_at, new_posts FROM handle_visit")
+            return {
+                handle: (datetime.fromisoformat(visited_at), new_posts)
+                for handle, visited_at, new_posts in self.cursor.fetchall()
+            }
+
+    def record_handle_visit(self, handle, visited_at, new_posts):
+        """
+        Store the last profile visit of a handle
+
+        Args:
+            handle (str): The visited handle
+            visited_at (datetime): When the visit started
+            new_posts (int): New posts found by the visit
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+            INSERT INTO handle_visit (handle, visited_at, new_posts)
+            VALUES (?, ?, ?)
+            ON CONFLICT(handle) DO UPDATE SET
+                visited_at = excluded.visited_at,
+                new_posts = excluded.new_posts
+            """, (handle, visited_at.isoformat(), new_posts))
+
+    def get_post_ids_by_handle(self, handles=None):
+        """
+        Get the ids of the stored posts of every handle, so the scraper skips them
+
+        Args:
+            handles (list, optional): Only posts of these handles
+
+        Returns:
+            dict: handle -> set of post ids
+        """
+        where = f"WHERE handle IN ({', '.join('?' for _ in handles)})" if handles else ""
+        with self.lock:
+            self.cursor.execute(f"SELECT handle, post_id FROM post_summary {where}", tuple(handles or ()))
+
+            post_ids = {}
+            for handle, post_id in self.cursor.fetchall():
+                post_ids.setdefault(handle, set()).add(post_id)
+        return post_ids
+
+    @instrumentation.timed("db.update_handle_states")
+    def update_handle_states(self, posts):
+        """
+        Move the high-water mark of every handle to its newest post
+
+        Args:
+            posts (list): List of InstagramPost objects
+        """
+        newest = {}
+        for post in posts:
+            if post.handle and (post.handle not in newest or post.date > newest[post.handle].date):
+                newest[post.handle] = post
+
+        with self.lock, self.conn:
+            self.conn.executemany(UPSERT_HANDLE_STATE, (
+                (handle, post.post_id, post.date.isoformat()) for handle, post in newest.items()
+            ))
+
+    def get_cached_summary(self, cache_key):
+        """
+        Get a cached summary and mark it as used
+
+        Returns:
+            str or None: The summary, None if it is not cached
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT summary FROM summary_cache WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self.conn.execute(
+                "UPDATE summary_cache SET last_used_at = ? WHERE cache_key = ?",
+                (datetime.now().isoformat(), cache_key)
+            )
+            self.conn.commit()
+            return row[0]
+
+    @instrumentation.timed("db.save_cached_summary")
+    def save_cached_summary(self, cache_key, summary):
+        """Store a summary in the cache, replacing the previous one with the same key"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute("""
+            INSERT INTO summary_cache (cache_key, summary, created_at, last_used_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                summary = excluded.summary,
+                created_at = excluded.created_at,
+                last_used_at = excluded.last_used_at
+            """, (cache_key, summary, now, now))
+            self.conn.commit()
+
+    def evict_summary_cache(self, max_entries, max_age_days):
+        """
+        Remove cached summaries older than max_age_days, then the least recently used ones
+        beyond max_entries
+
+        Returns:
+            int: Number of removed summaries
+        """
+        oldest = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+        with self.lock:
+            removed = self.conn.execute(
+                "DELETE FROM summary_cache WHERE created_at < ?", (oldest,)
+            ).rowcount
+            removed += self.conn.execute("""
+            DELETE FROM summary_cache WHERE cache_key IN (
+                SELECT cache_key FROM summary_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+            """, (max_entries,)).rowcount
+            self.conn.commit()
+            return removed
+
+    def get_posts(self, limit=100, offset=0, handles=None, since=None, until=None):
+        """
+        Retrieve posts from the database, newest first
+
+        Args:
+            limit (int): Maximum number of posts
+            offset (int): Number of posts to skip
+            handles (list, optional): Only posts of these handles
+            since (datetime, optional): Only posts published at or after this date
+            until (datetime, optional): Only posts published before this date
 
         Returns:
             list: List of InstagramPost objects
         """
-        self.cursor.execute("""
+        conditions = []
+        parameters = []
+        if handles:
+            conditions.append(f"handle IN ({', '.join('?' for _ in handles)})")
+            parameters.extend(handles)
+        if since is not None:
+            conditions.append("post_date >= ?")
+            parameters.append(since.isoformat())
+        if until is not None:
+            conditions.append("post_date < ?")
+            parameters.append(until.isoformat())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        self.cursor.execute(f"""
         SELECT post_id, caption, post_date, reference_url, handle
         FROM post_summary
+        {where}
         ORDER BY post_date DESC
         LIMIT ? OFFSET ?
-        """, (limit, offset))
+        """, (*parameters, limit, offset))
 
         posts = []
         for row in self.cursor.fetchall():
@@ -154,6 +585,227 @@ class DatabaseManager:
 
         return posts
 
+    def get_runs(self, limit=20):
+        """
+        Get the most recent runs
+
+        Returns:
+            list: List of (summary id, scraped_at, goal, model, number of posts) tuples, newest first
+        """
+        with self.lock:
+            return self.conn.execute("""
+            SELECT s.id, s.scraped_at, s.goal, s.model,
+                   (SELECT COUNT(*) FROM post_summary p WHERE p.summary_id = s.id)
+            FROM summaries s
+            ORDER BY s.scraped_at DESC
+            LIMIT ?
+            """, (limit,)).fetchall()
+
+    def get_run(self, summary_id):
+        """
+        Get a stored run
+
+        Returns:
+            tuple or None: (summary, scraped_at, goal, model, overview), None if there is no such run
+        """
+        with self.lock:
+            return self.conn.execute("""
+            SELECT summary, scraped_at, goal, model, overview FROM summaries WHERE id = ?
+            """, (summary_id,)).fetchone()
+
+    def get_digests(self, handles=None, since=None, until=None, goal=None, model=None):
+        """
+        Get the stored posts with their summary, oldest first. When a post was summarized for more goals
+        or models the most recent matching summary is used.
+
+        Args:
+            handles (list, optional): Only posts of these handles
+            since (datetime, optional): Only posts published at or after this date
+            until (datetime, optional): Only posts published before this date
+            goal (str, optional): Only summaries written for this goal, '' for the ones without a goal
+            model (str, optional): Only summaries written by this model
+
+        Returns:
+            list: List of (InstagramPost, summary) tuples
+        """
+        conditions = []
+        parameters = []
+        if handles:
+            conditions.append(f"p.handle IN ({', '.join('?' for _ in handles)})")
+            parameters.extend(handles)
+        if since is not None:
+            conditions.append("p.post_date >= ?")
+            parameters.append(since.isoformat())
+        if until is not None:
+            conditions.append("p.post_date < ?")
+            parameters.append(until.isoformat())
+        if goal is not None:
+            conditions.append("d.goal = ?")
+            parameters.append(goal)
+        if model is not None:
+            conditions.append("d.model = ?")
+            parameters.append(model)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.lock:
+            rows = self.conn.execute(f"""
+            SELECT post_id, caption, post_date, reference_url, handle, summary FROM (
+                SELECT p.post_id, p.caption, p.post_date, p.reference_url, p.handle, d.summary,
+                       ROW_NUMBER() OVER (PARTITION BY p.post_id ORDER BY d.created_at DESC) AS position
+                FROM post_summary p
+                JOIN post_digest d ON d.post_id = p.post_id
+                {where}
+            )
+            WHERE position = 1
+            ORDER BY post_date
+            """, parameters).fetchall()
+
+        return [
+            (InstagramPost(post_id, caption, datetime.fromisoformat(date_str), url, handle), summary)
+            for post_id, caption, date_str, url, handle, summary in rows
+        ]
+
+    def get_posts_without_embedding(self, model, limit=1000):
+        """
+        Get the stored posts with some text but no vector of the embedding model yet
+
+        Returns:
+            list: List of (post_id, clean caption) tuples, oldest first
+        """
+        with self.lock:
+            return self.conn.execute("""
+            SELECT p.post_id, p.clean_caption
+            FROM post_summary p
+            WHERE p.clean_caption IS NOT NULL AND p.clean_caption != ''
+              AND NOT EXISTS (SELECT 1 FROM post_embedding e WHERE e.post_id = p.post_id AND e.model = ?)
+            ORDER BY p.post_date
+            LIMIT ?
+            """, (model, limit)).fetchall()
+
+    @instrumentation.timed("db.save_embeddings")
+    def save_embeddings(self, model, embeddings):
+        """
+        Store post vectors, replacing the previous ones of the same model
+
+        Args:
+            model (str): The embedding model
+            embeddings (list): List of (post_id, dimensions, float32 bytes) tuples
+        """
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.executemany("""
+            INSERT OR REPLACE INTO post_embedding (post_id, model, dimensions, vector, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """, ((post_id, model, dimensions, vector, now) for post_id, dimensions, vector in embeddings))
+
+    def get_embeddings(self, model):
+        """
+        Get every stored vector of the embedding model
+
+        Returns:
+            list: List of (post_id, dimensions, float32 bytes) tuples
+        """
+        with self.lock:
+            return self.conn.execute("""
+            SELECT post_id, dimensions, vector FROM post_embedding WHERE model = ?
+            """, (model,)).fetchall()
+
+    def get_posts_by_ids(self, post_ids):
+        """
+        Get stored posts by id
+
+        Returns:
+            dict: post_id -> InstagramPost, ids not stored are missing
+        """
+        posts = {}
+        post_ids = list(post_ids)
+        # Stay below the SQLite limit of parameters per statement
+        for start in range(0, len(post_ids), 500):
+            chunk = post_ids[start:start + 500]
+            with self.lock:
+                rows = self.conn.execute(f"""
+                SELECT post_id, caption, post_date, reference_url, handle
+                FROM post_summary
+                WHERE post_id IN ({', '.join('?' for _ in chunk)})
+                """, chunk).fetchall()
+            for post_id, caption, date_str, url, handle in rows:
+                posts[post_id] = InstagramPost(post_id, caption, datetime.fromisoformat(date_str), url, handle)
+        return posts
+
+    def search_posts(self, query, handles=None, since=None, until=None, limit=20):
+        """
+        Full-text search of the stored captions, best matches first
+
+        Args:
+            query (str): FTS5 query, see fts_query to build one from free text
+            handles (list, optional): Only posts of these handles
+            since (datetime, optional): Only posts published at or after this date
+            until (datetime, optional): Only posts published before this date
+            limit (int): Maximum number of results
+
+        Returns:
+            list: List of (InstagramPost, bm25 rank, snippet) tuples, lower ranks are better matches
+        """
+        conditions = ["posts_fts MATCH ?"]
+        parameters = [query]
+        if handles:
+            conditions.append(f"p.handle IN ({', '.join('?' for _ in handles)})")
+            parameters.extend(handles)
+        if since is not None:
+            conditions.append("p.post_date >= ?")
+            parameters.append(since.isoformat())
+        if until is not None:
+            conditions.append("p.post_date < ?")
+            parameters.append(until.isoformat())
+
+        with self.lock:
+            rows = self.conn.execute(f"""
+            SELECT p.post_id, p.caption, p.post_date, p.reference_url, p.handle,
+                   bm25(posts_fts), snippet(posts_fts, 0, '**', '**', '...', 16)
+            FROM posts_fts
+            JOIN post_summary p ON p.id = posts_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25(posts_fts)
+            LIMIT ?
+            """, (*parameters, limit)).fetchall()
+
+        return [
+            (InstagramPost(post_id, caption, datetime.fromisoformat(date_str), url, handle), rank, snippet)
+            for post_id, caption, date_str, url, handle, rank, snippet in rows
+        ]
+
+    def search_summaries(self, query, since=None, until=None, limit=20):
+        """
+        Full-text search of the stored run summaries, best matches first
+
+        Args:
+            query (str): FTS5 query, see fts_query to build one from free text
+            since (datetime, optional): Only runs done at or after this date
+            until (datetime, optional): Only runs done before this date
+            limit (int): Maximum number of results
+
+        Returns:
+            list: List of (summary id, scraped_at, bm25 rank, snippet) tuples
+        """
+        conditions = ["summaries_fts MATCH ?"]
+        parameters = [query]
+        if since is not None:
+            conditions.append("s.scraped_at >= ?")
+            parameters.append(since.isoformat())
+        if until is not None:
+            conditions.append("s.scraped_at < ?")
+            parameters.append(until.isoformat())
+
+        with self.lock:
+            return self.conn.execute(f"""
+            SELECT s.id, s.scraped_at, bm25(summaries_fts), snippet(summaries_fts, 0, '**', '**', '...', 16)
+            FROM summaries_fts
+            JOIN summaries s ON s.id = summaries_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25(summaries_fts)
+            LIMIT ?
+            """, (*parameters, limit)).fetchall()
+
     def close(self):
         """Close database connection"""
         self.conn.close()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import argparse
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import DatabaseManager, INSERT_POST, UPSERT_HANDLE_STATE, fts_query
+from models import InstagramPost
+from preprocess import clean_caption
+
+
+def make_vocabulary(size=5000):
+    """Returns random words and their Zipf weights, so a few words are frequent and most are rare like in captions"""
+    generator = random.Random(0)
+    words = ["".join(generator.choices(string.ascii_lowercase, k=generator.randint(3, 9))) for _ in range(size)]
+    return words, [1 / rank for rank in range(1, size + 1)]
+
+
+VOCABULARY, WEIGHTS = make_vocabulary()
+
+
+def make_posts(count, handles_count, start=0):
+    """Returns synthetic posts spread over the handles and the last year"""
+    now = datetime.now()
+    generator = random.Random(start)
+    posts = []
+    for i in range(start, start + count):
+        handle = f"handle_{i % handles_count}"
+        posts.append(InstagramPost(
+            post_id=f"post_{i}",
+            caption=" ".join(generator.choices(VOCABULARY, WEIGHTS, k=generator.randint(5, 120))),
+            date=now - timedelta(minutes=generator.randint(0, 365 * 24 * 60)),
+            url=f"https://www.instagram.com/p/post_{i}/",
+            handle=handle
+        ))
+    return posts
+
+
+def insert_row_by_row(db_path, batches):
+    """The storage path before the bulk writes, for comparison: default journal, one statement per row
+    and a commit after the summary, the posts and the handle states of every batch"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    for batch in batches:
+        cursor = conn.execute(
+            "INSERT INTO summaries (summary, scraped_at) VALUES (?, ?)", ("benchmark", datetime.now().isoformat())
+        )
+        conn.commit()
+        summary_id = cursor.lastrowid
+
+        for post in batch:
+            conn.execute(INSERT_POST, (
+                summary_id, post.post_id, post.handle, post.url, post.caption, post.date.isoformat(),
+                clean_caption(post.caption)
+            ))
+        conn.commit()
+
+        for post in batch:
+            conn.execute(UPSERT_HANDLE_STATE, (post.handle, post.post_id, post.date.isoformat()))
+        conn.commit()
+    conn.close()
+
+
+def timed(function, *args, repeat=1):
+    """Returns the best wall time of repeat calls of function"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(posts_count, handles_count, queries, batch_size):
+    """Runs the benchmark on temporary databases and prints the throughput of every operation"""
+    with tempfile.TemporaryDirectory() as directory:
+        batches = [
+            make_posts(min(batch_size, posts_count - offset), handles_count, offset)
+            for offset in range(0, posts_count, batch_size)
+        ]
+
+        # Row by row inserts on the legacy settings
+        legacy_path = os.path.join(directory, "legacy.db")
+        legacy_manager = DatabaseManager(legacy_path)
+        legacy_manager.setup_tables()
+        legacy_manager.close()
+        elapsed = timed(insert_row_by_row, legacy_path, batches)
+        print(f"{'Row by row insert:':<24}{posts_count / elapsed:10.0f} posts/s ({elapsed:.2f}s)")
+
+        # Bulk inserts, one transaction per saved summary
+        db_path = os.path.join(directory, "bulk.db")
+        db_manager = DatabaseManager(db_path)
+        db_manager.setup_tables()
+        start = time.perf_counter()
+        for batch in batches:
+            db_manager.save_summary("benchmark", datetime.now().isoformat(), batch)
+            db_manager.update_handle_states(batch)
+        elapsed = time.perf_counter() - start
+        print(f"{'Bulk insert:':<24}{posts_count / elapsed:10.0f} posts/s ({elapsed:.2f}s, batches of {batch_size})")
+
+        generator = random.Random(0)
+        now = datetime.now()
+
+        def by_handle():
+            for _ in range(queries):
+                db_manager.get_posts(limit=50, handles=[f"handle_{generator.randrange(handles_count)}"])
+
+        def by_date():
+            for _ in range(queries):
+                since = now - timedelta(days=generator.randint(1, 365))
+                db_manager.get_posts(limit=50, since=since, until=since + timedelta(days=7))
+
+        def by_handle_and_date():
+            for _ in range(queries):
+                db_manager.get_posts(limit=50, handles=[f"handle_{generator.randrange(handles_count)}"],
+                                     since=now - timedelta(days=30))
+
+        def full_text():
+            for _ in range(queries):
+                words = generator.sample(VOCABULARY[50:2000], 2)
+                db_manager.search_posts(fts_query(" ".join(words), prefix=False), limit=20)
+
+        def full_text_filtered():
+            for _ in range(queries):
+                db_manager.search_posts(fts_query(generator.choice(VOCABULARY[50:2000]), prefix=False),
+                                        handles=[f"handle_{generator.randrange(handles_count)}"],
+                                        since=now - timedelta(days=30), limit=20)
+
+        def metadata():
+            for _ in range(queries):
+                db_manager.get_scrape_metadata()
+                db_manager.get_handle_states()
+
+        for name, function in (("By handle", by_handle), ("By date range", by_date),
+                               ("By handle and date", by_handle_and_date), ("Full-text", full_text),
+                               ("Full-text filtered", full_text_filtered), ("Metadata", metadata)):
+            elapsed = timed(function, repeat=3)
+            print(f"{name + ' query:':<24}{queries / elapsed:10.0f} queries/s")
+
+        db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the insert and query throughput of the database")
+    parser.add_argument("--posts", type=int, default=20000, help="number of synthetic posts")
+    parser.add_argument("--handles", type=int, default=50, help="number of synthetic handles")
+    parser.add_argument("--queries", type=int, default=500, help="number of queries of every kind")
+    parser.add_argument("--batch-size", type=int, default=200, help="posts saved with every summary")
+    args = parser.parse_args()
+
+    run(args.posts, args.handles, args.queries, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
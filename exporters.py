@@ -0,0 +1,357 @@
+import hashlib
+import html
+import importlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from markdown_it import MarkdownIt
+
+from config import EXPORT_TARGETS, EXPORT_OPEN, EXPORT_CACHE_FILE, EXPORT_CACHE_MAX_SECTIONS, RUN_REPORTS_DIR
+from file_utls import create_pdf
+
+# Bump when the output of a target changes, so that the renderings cached before are not reused
+RENDERER_VERSION = 1
+
+# Every heading starts a section, the unit of the HTML rendering cache
+SECTION_PATTERN = re.compile(r"(?m)^(?=#{1,3} )")
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ font-family: -apple-system, "Segoe UI", Helvetica, Arial, sans-serif; max-width: 46rem; margin: 2rem auto;
+       padding: 0 1rem; line-height: 1.5; color: #222; }}
+h1, h2, h3 {{ line-height: 1.2; }}
+a {{ color: #0b5cad; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def content_hash(text):
+    """Returns the hex digest identifying a content"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_sections(markdown):
+    """Splits a markdown report at its headings"""
+    return [section for section in SECTION_PATTERN.split(markdown) if section]
+
+
+def _write_text(path, text):
+    """Writes a file so that readers never see it half written"""
+    temporary_file = f"{path}.tmp"
+    with open(temporary_file, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temporary_file, path)
+
+
+def export_markdown(job, path, cached_sections):
+    _write_text(path, job["report"])
+
+
+def export_html(job, path, cached_sections):
+    """Renders a standalone HTML page, reusing the cached rendering of the unchanged sections"""
+    renderer = MarkdownIt("commonmark").enable("table")
+    sections = {}
+    fragments = []
+    for section in split_sections(job["report"]):
+        key = content_hash(section)
+        fragment = cached_sections.get(key)
+        if fragment is None:
+            fragment = renderer.render(section)
+        sections[key] = fragment
+        fragments.append(fragment)
+
+    _write_text(path, HTML_TEMPLATE.format(title=html.escape(job["title"]), body="".join(fragments)))
+    return sections
+
+
+def export_pdf(job, path, cached_sections):
+    create_pdf(job["report"], job["title"], path)
+
+
+def export_json(job, path, cached_sections):
+    data = job.get("data") or {"title": job["title"], "sections": split_sections(job["report"])}
+    _write_text(path, json.dumps(data, indent=2, ensure_ascii=False))
+
+
+# name -> (file extension, "module:function" writing the file), the function is called with (job, path,
+# cached_sections) and returns the rendered HTML sections or None. References instead of functions, so that
+# the export process and its workers find the registered targets too.
+EXPORTERS = {
+    "markdown": (".md", "exporters:export_markdown"),
+    "html": (".html", "exporters:export_html"),
+    "pdf": (".pdf", "exporters:export_pdf"),
+    "json": (".json", "exporters:export_json"),
+}
+
+
+def function_reference(function):
+    """Returns the "module:function" reference of a module level function"""
+    module = function.__module__
+    if module == "__main__":
+        # The script is imported under its file name by the export process
+        module = os.path.splitext(os.path.basename(sys.modules["__main__"].__file__))[0]
+    return f"{module}:{function.__qualname__}"
+
+
+def resolve_reference(reference):
+    """Imports the function of a "module:function" reference"""
+    module, function = reference.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def register_exporter(name, extension, function):
+    """
+    Adds an export target, the jobs created afterwards carry it to the export process
+
+    Args:
+        name (str): Name used in EXPORT_TARGETS
+        extension (str): Extension of the exported file, e.g. ".txt"
+        function (callable or str): Module level function(job, path, cached_sections) writing the file,
+            or its "module:function" reference. It runs in a worker process, which imports its module.
+    """
+    EXPORTERS[name] = (extension, function if isinstance(function, str) else function_reference(function))
+
+
+def report_data(title, goal, model, overview, post_summaries, posts=()):
+    """
+    Returns the structured content of a report, exported by the json target
+
+    Args:
+        title (str): Title of the report
+        goal (str): Goal of the summaries, None for a general report
+        model (str): Model that wrote the summaries
+        overview (str): Overview of all the posts
+        post_summaries (list): Post summaries as built by the summarizer
+        posts (list, optional): The summarized InstagramPost objects, adding their handle, url and date
+    """
+    posts_by_id = {post.post_id: post for post in posts}
+    entries = []
+    for post_summary in post_summaries:
+        post = posts_by_id.get(post_summary["id"])
+        entries.append({
+            "id": post_summary["id"],
+            "handle": post.handle if post else None,
+            "url": post.url if post else None,
+            "date": post.date.isoformat() if post else None,
+            "summary": post_summary["summary"],
+            "also_posted_by": [{"handle": duplicate.handle, "url": duplicate.url}
+                               for duplicate in post_summary["duplicates"]]
+        })
+    return {
+        "title": title,
+        "goal": goal,
+        "model": model,
+        "overview": overview,
+        "posts": entries
+    }
+
+
+def create_export_job(report, base_path, title, targets=None, data=None, open_target=EXPORT_OPEN):
+    """
+    Describes the exports of a report
+
+    Args:
+        report (str): The markdown report
+        base_path (str): Path of the exported files without extension
+        title (str): Title of the documents
+        targets (list, optional): Export targets, EXPORT_TARGETS by default
+        data (dict, optional): Structured content for the json target, see report_data
+        open_target (str, optional): Target opened once rendered
+
+    Returns:
+        dict: The job, JSON serializable
+    """
+    targets = list(targets if targets is not None else EXPORT_TARGETS)
+    return {
+        "report": report,
+        "base_path": base_path,
+        "title": title,
+        "targets": targets,
+        # target -> [extension, "module:function"], the unknown targets are left out
+        "exporters": {name: list(EXPORTERS[name]) for name in targets if name in EXPORTERS},
+        "data": data,
+        "open": open_target
+    }
+
+
+def _render_target(reference, job, path, cached_sections):
+    """Renders a single target, in a worker process"""
+    start = time.perf_counter()
+    sections = resolve_reference(reference)(job, path, cached_sections)
+    return time.perf_counter() - start, sections or {}
+
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, encoding="utf-8") as file:
+            cache = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        cache = {}
+    cache.setdefault("outputs", {})
+    cache.setdefault("sections", {})
+    return cache
+
+
+def _save_cache(cache, cache_file):
+    # Keep the most recently rendered sections, dictionaries keep the insertion order
+    sections = list(cache["sections"].items())[-EXPORT_CACHE_MAX_SECTIONS:]
+    cache["sections"] = dict(sections)
+    cache["outputs"] = {key: path for key, path in cache["outputs"].items() if os.path.exists(path)}
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    _write_text(cache_file, json.dumps(cache))
+
+
+def export(job, cache_file=EXPORT_CACHE_FILE):
+    """
+    Renders every target of a job, each one in its own worker process. A target whose content was
+    already rendered is not rendered again, and the HTML of unchanged sections is reused.
+
+    Args:
+        job (dict): See create_export_job
+        cache_file (str): File keeping the hashes of the rendered contents
+
+    Returns:
+        dict: target -> {"path", "status", "seconds"}, status is "rendered", "unchanged", "copied" or the error
+    """
+    cache = _load_cache(cache_file)
+    exporters = job["exporters"]
+    # The title is written in the html, pdf and json files
+    report_hash = content_hash(job["title"] + "\n" + job["report"])
+    data_hash = content_hash(json.dumps(job.get("data"), sort_keys=True, default=str))
+    os.makedirs(os.path.dirname(job["base_path"]) or ".", exist_ok=True)
+
+    results = {}
+    pending = {}
+    with ProcessPoolExecutor(max_workers=max(1, len(job["targets"]))) as executor:
+        for name in job["targets"]:
+            if name not in exporters:
+                results[name] = {"path": None, "status": "unknown target", "seconds": None}
+                continue
+
+            extension, reference = exporters[name]
+            path = job["base_path"] + extension
+            # Only the json target depends on the structured data
+            key = f"{name}:{reference}:{RENDERER_VERSION}:{report_hash}:{data_hash if name == 'json' else ''}"
+            previous_path = cache["outputs"].get(key)
+            if previous_path is not None and os.path.exists(previous_path):
+                if os.path.abspath(previous_path) == os.path.abspath(path):
+                    status = "unchanged"
+                else:
+                    shutil.copyfile(previous_path, path)
+                    status = "copied"
+                results[name] = {"path": path, "status": status, "seconds": 0.0}
+                continue
+
+            cached_sections = cache["sections"] if name == "html" else {}
+            pending[name] = (path, key, executor.submit(_render_target, reference, job, path, cached_sections))
+
+        for name, (path, key, future) in pending.items():
+            try:
+                seconds, sections = future.result()
+            except Exception as e:
+                results[name] = {"path": path, "status": f"failed: {e}", "seconds": None}
+                continue
+            cache["outputs"][key] = path
+            cache["sections"].update(sections)
+            results[name] = {"path": path, "status": "rendered", "seconds": seconds}
+
+    _save_cache(cache, cache_file)
+    return results
+
+
+def format_results(results):
+    """Returns a printable line per exported target"""
+    lines = []
+    for name, result in results.items():
+        timing = f" in {result['seconds']:.2f}s" if result["seconds"] else ""
+        lines.append(f"{name}: {result['status']}{timing} - {result['path']}")
+    return "\n".join(lines)
+
+
+def open_file(path):
+    """
+    Opens a file with the default application of the system
+
+    Returns:
+        bool: False when the system has no way to open it
+    """
+    try:
+        if sys.platform == "darwin":
+            subprocess.run(["open", path], check=False)
+        elif os.name == "nt":
+            os.startfile(path)
+        elif shutil.which("xdg-open"):
+            subprocess.run(["xdg-open", path], check=False)
+        else:
+            return False
+    except OSError:
+        return False
+    return True
+
+
+def start_export(job):
+    """
+    Renders the job in a detached process, so the run ends without waiting for it. The process
+    writes its timings in the log and in RUN_REPORTS_DIR, then opens the chosen target.
+
+    Returns:
+        str: Path of the log of the export process
+    """
+    job_file = job["base_path"] + ".export-job.json"
+    log_file = job["base_path"] + ".export.log"
+    os.makedirs(os.path.dirname(job_file) or ".", exist_ok=True)
+    _write_text(job_file, json.dumps(job))
+
+    if os.name == "nt":
+        options = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        options = {"start_new_session": True}
+    # The registered exporters are imported from the import path of this process
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(os.path.abspath(path) for path in sys.path))
+    with open(log_file, "w", encoding="utf-8") as log:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), job_file], env=env,
+                         stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, **options)
+    return log_file
+
+
+def main():
+    # Entry point of the process started by start_export
+    job_file = sys.argv[1]
+    with open(job_file, encoding="utf-8") as file:
+        job = json.load(file)
+
+    start = time.perf_counter()
+    results = export(job)
+    print(format_results(results))
+    print(f"Export took {time.perf_counter() - start:.2f}s")
+
+    os.makedirs(RUN_REPORTS_DIR, exist_ok=True)
+    report_file = os.path.join(RUN_REPORTS_DIR, f"export_{datetime.now():%Y%m%d_%H%M%S}.json")
+    _write_text(report_file, json.dumps({"title": job["title"], "seconds": time.perf_counter() - start,
+                                         "targets": results}, indent=2))
+    os.remove(job_file)
+
+    opened = results.get(job.get("open")) or {}
+    if opened.get("status") in ("rendered", "unchanged", "copied") and not open_file(opened["path"]):
+        print(f"No application to open {opened['path']}")
+
+
+if __name__ == "__main__":
+    main()
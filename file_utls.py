@@ -2,6 +2,8 @@ import os
 from datetime import datetime
 from markdown_pdf import MarkdownPdf, Section
 
+from instrumentation import instrumentation
+
 def create_output_file_name(goal: str | None = None) -> str:
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     goal_slug = goal.replace(" ", "_").lower() if goal else "general"
@@ -18,6 +20,7 @@ def create_summary_output_file(output_dir: str = "summaries", goal: str | None =
 
     return output_file
 
+@instrumentation.timed("report.create_pdf")
 def create_pdf(summary: str, title: str, output_file: str) -> None:
     pdf = MarkdownPdf(optimize=True)
     pdf.add_section(Section(summary))
@@ -25,3 +28,31 @@ def create_pdf(summary: str, title: str, output_file: str) -> None:
     pdf.meta["author"] = "unscroll - Instagram Scraper - giuliopime.dev"
 
     pdf.save(output_file)
+
+
+class MarkdownReportWriter:
+    """Writes the markdown report while it is generated, so that partial results survive an interruption"""
+
+    def __init__(self, output_file: str):
+        """
+        :param output_file: path of the markdown file
+        """
+        self.output_file = output_file
+
+    def start(self, text: str) -> None:
+        """Create the file with its first lines"""
+        os.makedirs(os.path.dirname(self.output_file) or ".", exist_ok=True)
+        with open(self.output_file, "w", encoding="utf-8") as file:
+            file.write(text)
+
+    def append(self, text: str) -> None:
+        """Append a completed section to the file"""
+        with open(self.output_file, "a", encoding="utf-8") as file:
+            file.write(text)
+
+    def finish(self, text: str) -> None:
+        """Replace the partial file with the complete report"""
+        temporary_file = f"{self.output_file}.tmp"
+        with open(temporary_file, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temporary_file, self.output_file)
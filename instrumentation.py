@@ -0,0 +1,235 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Prometheus metrics of the Ollama statistics: unit, help text and (stat label, report key) pairs
+LLM_PROMETHEUS_METRICS = (
+    ("seconds", "Ollama generation durations of the last run", (
+        ("prompt_eval", "prompt_eval_seconds"),
+        ("eval", "eval_seconds"),
+        ("load", "load_seconds"),
+        ("elapsed", "elapsed_seconds"),
+        ("first_token_p50", "first_token_p50_seconds"),
+        ("first_token_p95", "first_token_p95_seconds"),
+    )),
+    ("tokens", "Ollama token counts of the last run", (
+        ("prompt_eval", "prompt_eval_count"),
+        ("eval", "eval_count"),
+    )),
+    ("tokens_per_second", "Ollama token speeds of the last run", (
+        ("prompt_eval", "prompt_tokens_per_second"),
+        ("eval", "tokens_per_second"),
+    )),
+)
+
+
+def percentile(values, share):
+    """Returns the value below which the given share of the sorted values falls, nearest rank"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(share * len(values)) - 1))
+    return values[index]
+
+
+class Instrumentation:
+    """
+    Collects the timings of the stages of a run, the counters and the generation statistics reported
+    by Ollama, and writes them as a JSON run report and optionally as a Prometheus textfile.
+    Safe to use from every thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything collected so far and start a new run"""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        """Start a new run, the lock must be held"""
+        self.started_at = datetime.now()
+        self._start = time.monotonic()
+        # span name -> list of durations in seconds
+        self.spans = {}
+        self.counters = {}
+        self.generations = []
+        self.metadata = {}
+
+    def record_span(self, name, seconds):
+        """Record the duration of a span measured elsewhere"""
+        with self._lock:
+            self.spans.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block, failed blocks are recorded too"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.monotonic() - start)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as a span"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1):
+        """Add to a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_generation(self, stats):
+        """Record the statistics of an Ollama generation, see summarizer.generation_stats"""
+        with self._lock:
+            self.generations.append(stats)
+
+    def set_metadata(self, **values):
+        """Attach descriptive values to the run, e.g. the goal or the model"""
+        with self._lock:
+            self.metadata.update(values)
+
+    def report(self, reset=False):
+        """
+        Returns the run report
+
+        Args:
+            reset (bool): Also start a new run, no span recorded meanwhile by another thread is lost
+
+        Returns:
+            dict: JSON serializable report, durations in seconds
+        """
+        with self._lock:
+            started_at = self.started_at
+            spans = {name: sorted(durations) for name, durations in self.spans.items()}
+            counters = dict(self.counters)
+            generations = list(self.generations)
+            metadata = dict(self.metadata)
+            duration = time.monotonic() - self._start
+            if reset:
+                self._reset()
+
+        span_report = {}
+        for name, durations in sorted(spans.items()):
+            total = sum(durations)
+            span_report[name] = {
+                "count": len(durations),
+                "total_seconds": total,
+                "mean_seconds": total / len(durations),
+                "p50_seconds": percentile(durations, 0.5),
+                "p95_seconds": percentile(durations, 0.95),
+                "max_seconds": durations[-1]
+            }
+
+        def total(key):
+            return sum(generation.get(key) or 0 for generation in generations)
+
+        eval_seconds = total("eval_seconds")
+        prompt_eval_seconds = total("prompt_eval_seconds")
+        first_tokens = sorted(g["first_token_seconds"] for g in generations if g.get("first_token_seconds") is not None)
+        llm_report = {
+            "generations": len(generations),
+            "prompt_eval_count": total("prompt_eval_count"),
+            "prompt_eval_seconds": prompt_eval_seconds,
+            "eval_count": total("eval_count"),
+            "eval_seconds": eval_seconds,
+            "load_seconds": total("load_seconds"),
+            "elapsed_seconds": total("elapsed_seconds"),
+            "prompt_tokens_per_second": total("prompt_eval_count") / prompt_eval_seconds if prompt_eval_seconds else None,
+            "tokens_per_second": total("eval_count") / eval_seconds if eval_seconds else None,
+            "first_token_p50_seconds": percentile(first_tokens, 0.5),
+            "first_token_p95_seconds": percentile(first_tokens, 0.95)
+        }
+
+        return {
+            "started_at": started_at.isoformat(),
+            "duration_seconds": duration,
+            "metadata": metadata,
+            "spans": span_report,
+            "counters": counters,
+            "llm": llm_report
+        }
+
+    def summary(self):
+        """Returns a printable table of the slowest spans"""
+        report = self.report()
+        lines = [f"Run took {report['duration_seconds']:.1f}s"]
+        spans = sorted(report["spans"].items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        for name, span in spans:
+            lines.append(f"{name}: {span['total_seconds']:.1f}s in {span['count']} calls, "
+                         f"p50 {span['p50_seconds']:.2f}s, p95 {span['p95_seconds']:.2f}s")
+        return "\n".join(lines)
+
+    def write_json(self, directory):
+        """
+        Write the run report in the directory, one file per run
+
+        Returns:
+            str: Path of the report
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"run_{self.started_at:%Y%m%d_%H%M%S}.json")
+        _write_atomically(path, json.dumps(self.report(), indent=2))
+        return path
+
+    def write_prometheus(self, path, prefix="unscroll", report=None):
+        """
+        Write the run report in the Prometheus textfile collector format
+
+        Args:
+            path (str): Path of the textfile
+            prefix (str): Prefix of the metric names
+            report (dict, optional): Report to write, by default the one of the current run
+        """
+        report = report if report is not None else self.report()
+        lines = [
+            f"# HELP {prefix}_run_duration_seconds Wall clock duration of the last run",
+            f"# TYPE {prefix}_run_duration_seconds gauge",
+            f"{prefix}_run_duration_seconds {report['duration_seconds']}",
+            f"# HELP {prefix}_span_seconds Time spent in every stage of the last run",
+            f"# TYPE {prefix}_span_seconds gauge",
+        ]
+        lines += [f'{prefix}_span_seconds{{span="{name}"}} {span["total_seconds"]}'
+                  for name, span in report["spans"].items()]
+        lines += [f"# HELP {prefix}_span_calls Calls of every stage of the last run",
+                  f"# TYPE {prefix}_span_calls gauge"]
+        lines += [f'{prefix}_span_calls{{span="{name}"}} {span["count"]}'
+                  for name, span in report["spans"].items()]
+        lines += [f"# HELP {prefix}_counter Counters of the last run", f"# TYPE {prefix}_counter gauge"]
+        lines += [f'{prefix}_counter{{name="{name}"}} {value}' for name, value in report["counters"].items()]
+
+        # One metric per unit, the label tells the statistic apart
+        llm = report["llm"]
+        lines += [f"# HELP {prefix}_llm_generations Ollama generations of the last run",
+                  f"# TYPE {prefix}_llm_generations gauge",
+                  f"{prefix}_llm_generations {llm['generations']}"]
+        for unit, description, stats in LLM_PROMETHEUS_METRICS:
+            lines += [f"# HELP {prefix}_llm_{unit} {description}", f"# TYPE {prefix}_llm_{unit} gauge"]
+            lines += [f'{prefix}_llm_{unit}{{stat="{stat}"}} {llm[key]}' for stat, key in stats if llm[key] is not None]
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _write_atomically(path, "\n".join(lines) + "\n")
+
+
+def _write_atomically(path, text):
+    """Write a file so that readers never see it half written"""
+    temporary_file = f"{path}.tmp"
+    with open(temporary_file, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temporary_file, path)
+
+
+# Shared by every module of a run
+instrumentation = Instrumentation()
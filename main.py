@@ -1,22 +1,83 @@
+import os
 import random
-import signal
-import subprocess
 from datetime import datetime, timedelta
 
-from browser_utils import setup_browser, login, sleep_for_random_seconds
+import requests
+
+from browser_utils import sleep_for_random_seconds, BrowserStats
 from cli_utils import prompt_for_goal
 from database import DatabaseManager
-from file_utls import create_summary_output_file, create_output_file_name, create_pdf
+from file_utls import create_summary_output_file, create_output_file_name, MarkdownReportWriter
+from exporters import create_export_job, report_data, start_export
 from scraper import InstagramScraper
-from config import COOKIES_FILE, DATABASE_FILE, DAYS_TO_LOOK_BACK, DEFAULT_HANDLES, MODEL_NAME
+from scraper_pool import ScraperPool
+from session import SessionManager
+from summary_cache import SummaryCache
+from ollama_manager import OllamaManager
+from pipeline import ScrapePipeline
+from relevance import RelevanceFilter
+from vector_index import VectorIndex
+from instrumentation import instrumentation
+from preprocess import preprocess_posts, StreamingDeduplicator
+from config import DATABASE_FILE, DAYS_TO_LOOK_BACK, DEFAULT_HANDLES, MODEL_NAME, SCRAPER_WORKERS, \
+    SCRAPER_WORKER_PROFILE_INTERVAL, PIPELINE_MODE, PIPELINE_QUEUE_SIZE, SUMMARY_MODE, RELEVANCE_FILTER, \
+    EMBED_AFTER_RUN, RUN_REPORTS_DIR, PROMETHEUS_TEXTFILE
 from summarizer import ContentSummarizer
 
 
+def iter_scraped_posts(session, browser_stats, min_date, handles, high_water_marks, known_post_ids,
+                       failed_handles):
+    """
+    Yields the new posts of the handles as they are scraped, closing the browsers once done.
+
+    Args:
+        session (SessionManager): Login session shared by the browsers
+        browser_stats (BrowserStats): Collects the bytes and load time of the opened pages
+        min_date (datetime): Minimum date for posts to be included
+        handles (list): List of Instagram handles to scrape
+        high_water_marks (dict): handle -> (last_post_id, last_post_date) of the newest post already stored
+        known_post_ids (dict): handle -> set of the ids of the posts already stored
+        failed_handles (list): Filled with the handles whose scraping failed once done
+    """
+    if SCRAPER_WORKERS > 1:
+        # Spread handles over several browsers, each one closes itself once done
+        pool = ScraperPool(session, workers=SCRAPER_WORKERS,
+                           min_seconds_between_profiles=SCRAPER_WORKER_PROFILE_INTERVAL,
+                           browser_stats=browser_stats, max_buffered_posts=PIPELINE_QUEUE_SIZE)
+        yield from pool.iter_posts(min_date, handles, high_water_marks, known_post_ids)
+        failed_handles.extend(pool.failed_handles)
+    else:
+        # Setup browser and make sure the session is valid
+        driver = session.start_browser()
+        try:
+            # Initialize scraper and collect posts
+            scraper = InstagramScraper(driver, browser_stats=browser_stats)
+            yield from scraper.iter_posts(min_date, handles, high_water_marks, known_post_ids)
+            print(f"Page load latencies:\n{scraper.pacer.summary()}")
+        finally:
+            # Close browser once done
+            sleep_for_random_seconds(1, 1)
+            driver.quit()
+
+    print(browser_stats.report())
+    browser_stats.save()
+
+
+def write_run_report():
+    """Writes the timings of the run as JSON and, when configured, as a Prometheus textfile"""
+    print(instrumentation.summary())
+    print(f"Run report written to {instrumentation.write_json(RUN_REPORTS_DIR)}")
+    if PROMETHEUS_TEXTFILE:
+        instrumentation.write_prometheus(PROMETHEUS_TEXTFILE)
+
+
 def main():
-    # Start ollama
-    print("Starting ollama")
-    ollama_sh = subprocess.Popen(["ollama", "run", MODEL_NAME])
-    sleep_for_random_seconds(5, 5)
+    instrumentation.reset()
+
+    # Start ollama and load the model in the background while the browser is scraping
+    ollama = OllamaManager()
+    ollama.start()
+    ollama.preload()
 
     # Ask for goal
     goal = prompt_for_goal()
@@ -24,72 +85,140 @@ def main():
         print("No goal provided")
     else:
         print(f"Goal: {goal}")
+    instrumentation.set_metadata(goal=goal, model=MODEL_NAME)
 
     # Initialize database
     db_manager = DatabaseManager(DATABASE_FILE)
     db_manager.setup_tables()
 
-    # Get handles and last scrape date from database
-    handles, last_scrape_date = db_manager.get_scrape_metadata()
+    # Get handles from database
+    handles, _ = db_manager.get_scrape_metadata()
     if not handles:
         handles = DEFAULT_HANDLES
     random.shuffle(handles)
     print(f"Handles to scrape: {handles}")
 
-    # Determine minimum date for scraping (DAYS_TO_LOOK_BACK days ago or last scrape date, whichever is earlier)
-    days_ago = datetime.now() - timedelta(days=DAYS_TO_LOOK_BACK)
-    min_date = max(last_scrape_date, days_ago) if last_scrape_date else days_ago
+    # Posts older than DAYS_TO_LOOK_BACK days are never scraped, within that window the high-water mark
+    # of every handle stops its walk, so a handle missed by a run is caught up by the next one
+    min_date = datetime.now() - timedelta(days=DAYS_TO_LOOK_BACK)
     print(f"Minimum date for scraping: {min_date}")
 
-    # Setup browser and login
-    driver = setup_browser()
-    login(driver, COOKIES_FILE)
-
-    # Initialize scraper and collect posts
-    scraper = InstagramScraper(driver)
-    posts = scraper.scrape_posts(min_date, handles)
-
-    if not posts:
-        print("No new posts found")
-        driver.quit()
-        ollama_sh.send_signal(signal.SIGINT)
-        subprocess.Popen(["osascript", "-e", 'tell app "Ollama" to quit'])
+    # Newest post already stored for every handle, the scraper stops once it reaches it
+    high_water_marks = db_manager.get_handle_states()
+    # Posts already stored are not opened again when walking the profile grid
+    known_post_ids = db_manager.get_post_ids_by_handle(handles)
+
+    # Bytes and load time of the opened pages, to compare the browser modes
+    browser_stats = BrowserStats()
+    # Login session kept in the persistent browser profile
+    session = SessionManager()
+    # Handles the pool could not scrape, a single browser raises instead
+    failed_handles = []
+    scraped_posts = iter_scraped_posts(session, browser_stats, min_date, handles, high_water_marks,
+                                       known_post_ids, failed_handles)
+
+    # Summaries of unchanged captions are reused
+    summary_cache = SummaryCache(db_manager)
+    summary_cache.evict()
+    summarizer = ContentSummarizer(model=MODEL_NAME, cache=summary_cache)
+
+    # The markdown report is written while the posts are summarized, the pdf is rendered at the end
+    file_name = create_output_file_name(goal=goal)
+    output_file = create_summary_output_file(goal=goal)
+    report_writer = MarkdownReportWriter(os.path.splitext(output_file)[0] + ".md")
+
+    # With a goal, only the posts related to it are summarized
+    relevance = RelevanceFilter(goal, summarizer=summarizer) if goal and RELEVANCE_FILTER else None
+
+    if PIPELINE_MODE and SUMMARY_MODE != "batch":
+        # Summarize the posts while the next ones are scraped, the model is loaded by the first request
+        pipeline = ScrapePipeline(scraped_posts).start()
+        deduplicator = StreamingDeduplicator(summarizer.token_counter)
+        with instrumentation.span("run.scrape_and_summarize"):
+            summary = summarizer.summarize_post_stream(pipeline, goal, report_writer, deduplicator, relevance)
+        posts = pipeline.posts
+        scrape_error = pipeline.error
+        # Done long before, the first summary waited for it
+        ollama.wait_until_loaded()
+        print(ollama.report())
+        print(pipeline.report())
+        print(deduplicator.result().report())
+    else:
+        with instrumentation.span("run.scrape"):
+            posts = list(scraped_posts)
+        scrape_error = None
+        summary = None
+        if posts:
+            print(f"Found {len(posts)} new posts")
+
+            # Usually already done while scraping
+            ollama.wait_until_loaded()
+            print(ollama.report())
+
+            # Clean the captions and summarize cross-posted captions only once
+            with instrumentation.span("run.preprocess"):
+                prepared = preprocess_posts(posts, summarizer.token_counter)
+                print(prepared.report())
+                relevant_posts = relevance.split(prepared.posts) if relevance is not None else prepared.posts
+            with instrumentation.span("run.summarize"):
+                summary = summarizer.create_unified_summary_per_single_post(
+                    relevant_posts, goal, report_writer, duplicates=prepared.duplicates,
+                    skipped=relevance.skipped if relevance is not None else None
+                )
+
+    instrumentation.set_metadata(handles=len(handles), posts=len(posts),
+                                 summarized=len(summarizer.last_post_summaries) if summary is not None else 0)
+
+    # The handle being scraped when the scraping failed may miss older posts, it keeps its high-water mark
+    incomplete_handles = {posts[-1].handle} if scrape_error is not None and posts else set()
+    incomplete_handles.update(failed_handles)
+    if failed_handles:
+        print(f"Could not scrape {', '.join(failed_handles)}, they are scraped again next run")
+
+    if summary is None:
+        print("No new posts found" if scrape_error is None else f"Scraping failed: {scrape_error}")
+        ollama.stop()
         db_manager.close()
+        write_run_report()
         return
-    else:
-        print(f"Found {len(posts)} new posts")
-
-    # Close browser once done
-    sleep_for_random_seconds(1, 1)
-    driver.quit()
 
-    # Create a summary and save data to database
-    summarizer = ContentSummarizer(model=MODEL_NAME)
-    summary = summarizer.create_unified_summary_per_single_post(posts, goal)
-    print("Summary created, stopping ollama")
-
-    # Close ollama
-    ollama_sh.send_signal(signal.SIGINT)
-    subprocess.Popen(["osascript", "-e", 'tell app "Ollama" to quit'])
+    if relevance is not None:
+        print(relevance.report())
+    print("Summary created")
 
     # Save data to database
     scraped_at = datetime.now().isoformat()
-    db_manager.save_summary(summary, scraped_at, posts)
-    # Update last scrape metadata
-    db_manager.update_scrape_metadata(scraped_at)
+    db_manager.save_summary(summary, scraped_at, posts, goal=goal, model=MODEL_NAME,
+                            overview=summarizer.last_overview, digests=summarizer.post_digests())
+    db_manager.update_handle_states([post for post in posts if post.handle not in incomplete_handles])
+    if scrape_error is None and not failed_handles:
+        # Update last scrape metadata
+        db_manager.update_scrape_metadata(scraped_at)
+    else:
+        print("Scraping incomplete, the posts found so far are stored but not the scrape date")
+
+    # The data is stored, the exports are rendered and opened by a background process
+    export_job = create_export_job(summary, os.path.splitext(output_file)[0], file_name, data=report_data(
+        file_name, goal, MODEL_NAME, summarizer.last_overview, summarizer.last_post_summaries, posts
+    ))
+    print(f"Rendering {', '.join(export_job['targets'])} in the background, see {start_export(export_job)}")
+
+    if EMBED_AFTER_RUN:
+        # Keep the semantic index of the archive up to date
+        try:
+            with instrumentation.span("run.embed"):
+                print(f"Embedded {VectorIndex(db_manager).update()} new posts")
+        except (RuntimeError, requests.RequestException) as e:
+            print(f"Could not embed the new posts: {e}")
+
+    # Close ollama
+    print("Stopping ollama")
+    ollama.stop()
 
     # Close database connection
     db_manager.close()
 
-    # Create pdf
-    print("Creating PDF")
-    file_name = create_output_file_name(goal=goal)
-    output_file = create_summary_output_file(goal=goal)
-    create_pdf(summary, file_name, output_file)
-    print("Opening PDF")
-
-    # Open PDF
-    subprocess.run(["open", output_file])
+    write_run_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,7 +6,7 @@ class InstagramPost:
     Class representing an Instagram post with its metadata and content.
     """
 
-    def __init__(self, post_id, caption, date, url, handle=None):
+    def __init__(self, post_id, caption, date, url, handle=None, pinned=False):
         """
         Initialize a new Instagram post object.
 
@@ -16,12 +16,14 @@ class InstagramPost:
             date (datetime): The timestamp of when the post was created
             url (str): The full URL to the post
             handle (str, optional): The Instagram handle of the post author
+            pinned (bool, optional): Whether the post is pinned on the profile grid
         """
         self.post_id = post_id
         self.caption = caption
         self.date = date
         self.url = url
         self.handle = handle
+        self.pinned = pinned
 
     def __str__(self):
         """String representation of the post for logging and debugging."""
@@ -37,7 +39,8 @@ class InstagramPost:
             'caption': self.caption,
             'date': self.date.isoformat(),
             'url': self.url,
-            'handle': self.handle
+            'handle': self.handle,
+            'pinned': self.pinned
         }
 
     @classmethod
@@ -48,5 +51,6 @@ class InstagramPost:
             caption=data['caption'],
             date=datetime.fromisoformat(data['date']),
             url=data['url'],
-            handle=data.get('handle')
+            handle=data.get('handle'),
+            pinned=data.get('pinned', False)
         )
\ No newline at end of file
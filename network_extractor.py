@@ -0,0 +1,202 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+from config import INSTAGRAM_BASE_URL
+from models import InstagramPost
+
+# Parts of the urls of the responses containing the posts of a profile
+FEED_URL_MARKERS = (
+    "/api/v1/feed/user/",
+    "/api/v1/users/web_profile_info/",
+    "/graphql/query",
+    "/api/graphql",
+)
+
+
+def _iter_media_nodes(data):
+    """Recursively yields every dictionary of the response that looks like a post"""
+    if isinstance(data, dict):
+        if ("code" in data and "taken_at" in data) or ("shortcode" in data and "taken_at_timestamp" in data):
+            yield data
+            return
+        for value in data.values():
+            yield from _iter_media_nodes(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from _iter_media_nodes(value)
+
+
+def _caption_text(node):
+    """Returns the caption of a post node in both the REST and the legacy GraphQL shape"""
+    caption = node.get("caption")
+    if isinstance(caption, dict):
+        return caption.get("text") or ""
+
+    edges = (node.get("edge_media_to_caption") or {}).get("edges") or []
+    if edges:
+        return edges[0].get("node", {}).get("text") or ""
+
+    return ""
+
+
+def _is_pinned(node):
+    """Whether the post is pinned on the profile grid"""
+    return bool(
+        node.get("timeline_pinned_user_ids")
+        or node.get("clips_tab_pinned_user_ids")
+        or node.get("pinned_for_users")
+    )
+
+
+def _owner_username(node):
+    """Returns the username of the author of the post, if present"""
+    owner = node.get("user") or node.get("owner") or {}
+    return owner.get("username")
+
+
+def parse_media_node(node, handle=None):
+    """
+    Converts a post node of a feed response into an InstagramPost.
+
+    Args:
+        node (dict): The post node
+        handle (str, optional): The Instagram handle associated with this post
+
+    Returns:
+        InstagramPost or None: The post, None if the node misses the shortcode or the timestamp
+    """
+    shortcode = node.get("code") or node.get("shortcode")
+    timestamp = node.get("taken_at") or node.get("taken_at_timestamp")
+    if not shortcode or not timestamp:
+        return None
+
+    is_reel = node.get("product_type") == "clips"
+    url = f"{INSTAGRAM_BASE_URL}/{'reel' if is_reel else 'p'}/{shortcode}/"
+    # Same naive UTC datetime produced by the DOM scraping
+    date = datetime.fromtimestamp(int(timestamp), tz=timezone.utc).replace(tzinfo=None)
+
+    return InstagramPost(shortcode, _caption_text(node), date, url, handle, pinned=_is_pinned(node))
+
+
+def parse_feed_response(data, handle=None):
+    """
+    Parses every post contained in a feed response.
+
+    Args:
+        data (dict | list): The decoded JSON response
+        handle (str, optional): Only keep posts authored by this handle, when the author is present
+
+    Returns:
+        list: List of InstagramPost objects, in the order of the response, without duplicates
+    """
+    posts = []
+    seen = set()
+    for node in _iter_media_nodes(data):
+        owner = _owner_username(node)
+        if handle and owner and owner != handle:
+            continue
+
+        post = parse_media_node(node, handle)
+        if post and post.post_id not in seen:
+            seen.add(post.post_id)
+            posts.append(post)
+
+    return posts
+
+
+def load_feed_response(body):
+    """
+    Decodes the body of a feed response.
+
+    Returns:
+        dict | list | None: The decoded JSON, None if the body is not JSON
+    """
+    # GraphQL responses can be prefixed with an anti JSON hijacking guard
+    body = body.strip()
+    if body.startswith("for (;;);"):
+        body = body[len("for (;;);"):]
+
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_feed_file(file_path, handle=None):
+    """
+    Parses a feed response saved to disk, e.g. a fixture recorded from the browser.
+
+    Returns:
+        list: List of InstagramPost objects
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        data = load_feed_response(file.read())
+
+    return parse_feed_response(data, handle) if data is not None else []
+
+
+class NetworkExtractor:
+    """
+    Reads the posts of a profile from the JSON responses captured in the Chrome performance logs.
+    The browser must be started with performance logging enabled.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def reset(self):
+        """Drop the responses captured so far, call before navigating to a new profile"""
+        self.driver.get_log("performance")
+
+    def _feed_request_ids(self):
+        """Returns the ids of the feed requests captured since the last call"""
+        request_ids = []
+        for entry in self.driver.get_log("performance"):
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, json.JSONDecodeError):
+                continue
+
+            if message.get("method") != "Network.responseReceived":
+                continue
+
+            response = message["params"]["response"]
+            if any(marker in response.get("url", "") for marker in FEED_URL_MARKERS):
+                request_ids.append(message["params"]["requestId"])
+
+        return request_ids
+
+    def _response_body(self, request_id):
+        """Returns the body of a captured response, None if it is not available anymore"""
+        try:
+            result = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except Exception:
+            return None
+
+        body = result.get("body", "")
+        if result.get("base64Encoded"):
+            body = base64.b64decode(body).decode("utf-8", errors="replace")
+        return body
+
+    def extract_posts(self, handle):
+        """
+        Parses the posts of the handle out of the feed responses captured since the last call.
+
+        Returns:
+            list: List of InstagramPost objects, empty if no feed response was captured
+        """
+        posts = []
+        seen = set()
+        for request_id in self._feed_request_ids():
+            body = self._response_body(request_id)
+            data = load_feed_response(body) if body else None
+            if data is None:
+                continue
+
+            for post in parse_feed_response(data, handle):
+                if post.post_id not in seen:
+                    seen.add(post.post_id)
+                    posts.append(post)
+
+        return posts
@@ -0,0 +1,150 @@
+import subprocess
+import threading
+import time
+
+import requests
+
+from config import MODEL_NAME, OLLAMA_URL, OLLAMA_KEEP_ALIVE, MODEL_CONTEXT_TOKENS, EMBEDDING_MODEL
+from instrumentation import instrumentation
+
+
+class OllamaManager:
+    """
+    Starts the local Ollama server when needed, loads the model in the background while the browser
+    is scraping and shuts everything down at the end of the run.
+    """
+
+    def __init__(self, model=MODEL_NAME, base_url=OLLAMA_URL, keep_alive=OLLAMA_KEEP_ALIVE, startup_timeout=30,
+                 context_tokens=MODEL_CONTEXT_TOKENS, embedding_model=EMBEDDING_MODEL):
+        """
+        Args:
+            model (str): The model to load
+            base_url (str): Ollama server url
+            keep_alive (str): How long Ollama keeps the model loaded after the last request, e.g. "30m"
+            startup_timeout (float): Seconds to wait for the server to answer after starting it
+            context_tokens (int): Context window the summaries are requested with
+            embedding_model (str): The embedding model, unloaded by stop as well when it is loaded
+        """
+        self.model = model
+        self.base_url = base_url
+        self.keep_alive = keep_alive
+        self.context_tokens = context_tokens
+        self.embedding_model = embedding_model
+        self.startup_timeout = startup_timeout
+
+        self.process = None
+        self.load_seconds = None
+        self.load_error = None
+        self._loaded = threading.Event()
+        self._preload_thread = None
+
+    def is_healthy(self):
+        """Whether the server answers its version endpoint"""
+        try:
+            return requests.get(f"{self.base_url}/api/version", timeout=2).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def start(self):
+        """Starts `ollama serve` unless a server is already running, then waits until it answers"""
+        if self.is_healthy():
+            print("Ollama already running")
+            return
+
+        print("Starting ollama")
+        self.process = subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"ollama serve exited with code {self.process.returncode}")
+            if self.is_healthy():
+                return
+            time.sleep(0.2)
+
+        raise RuntimeError(f"Ollama did not answer within {self.startup_timeout} seconds")
+
+    def _load_model(self):
+        """
+        Sends an empty generate request, which loads the model without generating anything. The context
+        is the one of the summaries, Ollama loads the model again when a request changes num_ctx.
+        """
+        start = time.monotonic()
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/generate",
+                json={"model": self.model, "keep_alive": self.keep_alive, "options": {"num_ctx": self.context_tokens}},
+                timeout=600
+            )
+            if response.status_code == 200:
+                self.load_seconds = time.monotonic() - start
+                instrumentation.record_span("ollama.load_model", self.load_seconds)
+            else:
+                self.load_error = f"{response.status_code}, {response.text}"
+        except requests.RequestException as e:
+            self.load_error = str(e)
+        finally:
+            self._loaded.set()
+
+    def preload(self):
+        """Loads the model in a background thread"""
+        self._loaded.clear()
+        self._preload_thread = threading.Thread(target=self._load_model, name="ollama-preload", daemon=True)
+        self._preload_thread.start()
+
+    def wait_until_loaded(self, timeout=None):
+        """
+        Waits for the background load started by preload.
+
+        Returns:
+            bool: True if the model is loaded
+        """
+        if self._preload_thread is None:
+            return False
+        self._loaded.wait(timeout)
+        return self._loaded.is_set() and self.load_error is None
+
+    def report(self):
+        """Returns a printable report of the model load"""
+        if self.load_error:
+            return f"Could not load {self.model}: {self.load_error}"
+        if self.load_seconds is None:
+            return f"{self.model} not loaded yet"
+        return f"{self.model} loaded in {self.load_seconds:.1f}s, in the background"
+
+    def _embedding_model_loaded(self):
+        """Whether the server lists the embedding model among the loaded ones"""
+        try:
+            response = requests.get(f"{self.base_url}/api/ps", timeout=2)
+            names = {model.get("name") for model in response.json().get("models", [])}
+        except (requests.RequestException, ValueError):
+            return False
+        return self.embedding_model in names or f"{self.embedding_model}:latest" in names
+
+    def stop(self):
+        """Unloads the models and stops the server if it was started by this manager"""
+        try:
+            requests.post(
+                f"{self.base_url}/api/generate",
+                json={"model": self.model, "keep_alive": 0},
+                timeout=10
+            )
+            # Embedding models do not generate, an empty embed request unloads them
+            if self.embedding_model and self._embedding_model_loaded():
+                requests.post(
+                    f"{self.base_url}/api/embed",
+                    json={"model": self.embedding_model, "input": [], "keep_alive": 0},
+                    timeout=10
+                )
+        except requests.RequestException:
+            pass
+
+        if self.process is not None and self.process.poll() is None:
+            print("Stopping ollama")
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
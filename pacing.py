@@ -0,0 +1,170 @@
+import random
+import time
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+from config import PACING_MIN_JITTER, PACING_TIMEOUT, PACING_SLOWDOWN_THRESHOLD, PACING_MAX_BACKOFF
+from instrumentation import instrumentation
+
+
+def page_loaded():
+    """Condition satisfied once the document finished loading."""
+    def condition(driver):
+        return driver.execute_script("return document.readyState") == "complete"
+    return condition
+
+
+def element_present(css_selector):
+    """Condition satisfied once at least one element matches the css selector."""
+    def condition(driver):
+        return len(driver.find_elements(By.CSS_SELECTOR, css_selector)) > 0
+    return condition
+
+
+def element_absent(css_selector):
+    """Condition satisfied once no element matches the css selector."""
+    def condition(driver):
+        return len(driver.find_elements(By.CSS_SELECTOR, css_selector)) == 0
+    return condition
+
+
+def profile_ready(handle):
+    """Condition satisfied once the profile grid shows at least one post, or the page says it has none."""
+    def condition(driver):
+        return len(driver.find_elements(
+            By.XPATH,
+            f"//a[starts-with(@href, '/{handle}/p/') or starts-with(@href, '/{handle}/reel/')]"
+            " | //*[contains(text(), 'No posts yet') or contains(text(), 'This account is private')]"
+        )) > 0
+    return condition
+
+
+def post_ready(previous_url=None):
+    """
+    Condition satisfied once a post is shown: the url moved away from previous_url and the <time>
+    element of the post in the url is rendered. The url changes before the content, meanwhile
+    the caption and the <time> of the previous post are still in the page.
+    """
+    def condition(driver):
+        # A single round-trip per poll, the post id is read like the extraction script does
+        return driver.execute_script(
+            "const postId = location.pathname.split('/').filter(Boolean)[1] || '';"
+            "return location.href !== arguments[0] && postId !== ''"
+            " && document.querySelector(`a[href*='/p/${postId}'] time, a[href*='/reel/${postId}'] time`) !== null",
+            previous_url
+        )
+    return condition
+
+
+class Pacer:
+    """
+    Waits on real page readiness conditions instead of fixed sleeps, adds a small human-like
+    jitter on top and backs off when pages load slower than usual.
+    """
+
+    def __init__(self, min_jitter=PACING_MIN_JITTER, timeout=PACING_TIMEOUT, poll_frequency=0.1, smoothing=0.3,
+                 slowdown_threshold=PACING_SLOWDOWN_THRESHOLD, max_backoff=PACING_MAX_BACKOFF):
+        """
+        Initialize a new pacer.
+
+        Args:
+            min_jitter (tuple): Range of seconds always waited after a page is ready
+            timeout (float): Maximum seconds to wait for a readiness condition
+            poll_frequency (float): Seconds between two checks of a condition
+            smoothing (float): Weight of the newest sample in the moving average of load latencies
+            slowdown_threshold (float): Ratio between the average and the fastest latency
+                of a page type above which the pacer backs off
+            max_backoff (float): Maximum extra seconds added when backing off
+        """
+        assert min_jitter[0] <= min_jitter[1], "min_jitter must be a (from_seconds, to_seconds) range"
+        self.min_jitter = min_jitter
+        self.timeout = timeout
+        self.poll_frequency = poll_frequency
+        self.smoothing = smoothing
+        self.slowdown_threshold = slowdown_threshold
+        self.max_backoff = max_backoff
+
+        # page type -> {"average", "fastest", "samples", "timeouts"}
+        self.latencies = {}
+
+    def _record_latency(self, page_type, latency, timed_out):
+        """Update the learned load latency of a page type"""
+        stats = self.latencies.get(page_type)
+        if stats is None:
+            stats = {"average": latency, "fastest": latency, "samples": 0, "timeouts": 0}
+            self.latencies[page_type] = stats
+        else:
+            stats["average"] = self.smoothing * latency + (1 - self.smoothing) * stats["average"]
+            if not timed_out:
+                stats["fastest"] = min(stats["fastest"], latency)
+
+        stats["samples"] += 1
+        if timed_out:
+            stats["timeouts"] += 1
+
+    def backoff_seconds(self, page_type):
+        """
+        Returns the extra seconds to wait for a page type, proportional to how much slower
+        than the fastest observed load the recent loads have been.
+        """
+        stats = self.latencies.get(page_type)
+        if not stats or stats["fastest"] <= 0:
+            return 0
+
+        slowdown = stats["average"] / stats["fastest"]
+        if slowdown < self.slowdown_threshold:
+            return 0
+
+        return min(self.max_backoff, stats["average"] - stats["fastest"])
+
+    def jitter(self, page_type=None):
+        """Sleeps for the minimum human-like jitter plus the backoff of the page type"""
+        seconds = random.uniform(*self.min_jitter)
+        if page_type is not None:
+            seconds += self.backoff_seconds(page_type)
+        time.sleep(seconds)
+        instrumentation.record_span("pacing.jitter", seconds)
+
+    def wait_until(self, driver, page_type, condition, timeout=None, jitter=True):
+        """
+        Waits until the condition is satisfied, learns how long it took and adds the jitter.
+
+        Args:
+            driver: The WebDriver instance
+            page_type (str): Name used to group latencies, e.g. "profile" or "post"
+            condition (callable): Function receiving the driver, truthy once the page is ready
+            timeout (float, optional): Overrides the default timeout
+            jitter (bool): Whether to sleep for the jitter once the page is ready
+
+        Returns:
+            bool: True if the condition was satisfied, False if it timed out
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=self.poll_frequency).until(condition)
+            ready = True
+        except TimeoutException:
+            ready = False
+
+        latency = time.monotonic() - start
+        self._record_latency(page_type, latency, timed_out=not ready)
+        instrumentation.record_span(f"pacing.wait.{page_type}", latency)
+        if not ready:
+            instrumentation.count(f"pacing.timeouts.{page_type}")
+        if jitter:
+            self.jitter(page_type)
+
+        return ready
+
+    def summary(self):
+        """Returns a printable summary of the learned latencies"""
+        lines = []
+        for page_type, stats in sorted(self.latencies.items()):
+            lines.append(
+                f"{page_type}: avg {stats['average']:.2f}s, fastest {stats['fastest']:.2f}s, "
+                f"{stats['samples']} loads, {stats['timeouts']} timeouts"
+            )
+        return "\n".join(lines)
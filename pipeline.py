@@ -0,0 +1,76 @@
+import threading
+import time
+from queue import Queue
+
+from config import PIPELINE_QUEUE_SIZE
+
+# Put in the queue once the producer is done
+_END = object()
+
+
+class ScrapePipeline:
+    """
+    Runs a post producer, e.g. the scraper, in a background thread and hands the posts over through
+    a bounded queue, so that they can be summarized while the next ones are scraped. When the consumer
+    falls behind the queue fills up and the producer waits.
+    """
+
+    def __init__(self, source, queue_size=PIPELINE_QUEUE_SIZE):
+        """
+        Args:
+            source (iterable): Iterable of InstagramPost, iterated in the background thread
+            queue_size (int): Maximum number of posts waiting for the consumer
+        """
+        self.source = source
+        self.queue = Queue(maxsize=queue_size)
+
+        # Every produced post, including the ones the consumer skips
+        self.posts = []
+        self.error = None
+        self.started_at = None
+        self.produced_seconds = None
+        self.blocked_seconds = 0
+        self._thread = None
+
+    def _produce(self):
+        try:
+            for post in self.source:
+                self.posts.append(post)
+                put_start = time.monotonic()
+                self.queue.put(post)
+                self.blocked_seconds += time.monotonic() - put_start
+        except Exception as e:
+            print(f"Error while producing posts: {e}")
+            self.error = e
+        finally:
+            self.produced_seconds = time.monotonic() - self.started_at
+            self.queue.put(_END)
+
+    def start(self):
+        """Starts producing posts in the background"""
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._produce, name="scrape-pipeline", daemon=True)
+        self._thread.start()
+        return self
+
+    def __iter__(self):
+        """Yields the posts as soon as they are produced, until the producer is done"""
+        if self._thread is None:
+            self.start()
+
+        while True:
+            post = self.queue.get()
+            if post is _END:
+                break
+            yield post
+
+        self._thread.join()
+
+    def report(self):
+        """Returns a printable report of how much producing and consuming overlapped"""
+        if self.produced_seconds is None:
+            return "Pipeline still running"
+
+        total = time.monotonic() - self.started_at
+        return (f"Pipeline: {len(self.posts)} posts produced in {self.produced_seconds:.1f}s "
+                f"({self.blocked_seconds:.1f}s waiting for the summarizer), {total:.1f}s end to end")
@@ -0,0 +1,259 @@
+import hashlib
+import html
+import random
+import re
+from html.parser import HTMLParser
+
+from config import DUPLICATE_SIMILARITY, MINHASH_PERMUTATIONS
+from models import InstagramPost
+
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+TAG_PATTERN = re.compile(r"(?<!\w)[#@][\w.]+")
+WORD_PATTERN = re.compile(r"\w+")
+
+# Prime larger than every 64-bit shingle hash, for the universal hashing of the permutations
+MINHASH_PRIME = (1 << 89) - 1
+SHINGLE_SIZE = 3
+BAND_ROWS = 4
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the text of an HTML fragment, turning line breaks into new lines"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("br", "p", "div", "li"):
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def clean_caption(caption):
+    """
+    Turns the raw caption HTML into clean text: no markup, links, hashtags or mentions.
+
+    Args:
+        caption (str): The caption as scraped, HTML or plain text
+
+    Returns:
+        str: The clean caption
+    """
+    extractor = _TextExtractor()
+    extractor.feed(caption or "")
+    extractor.close()
+    text = html.unescape("".join(extractor.parts))
+
+    text = URL_PATTERN.sub(" ", text)
+    text = TAG_PATTERN.sub(" ", text)
+
+    lines = [re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Returns the set of word shingles of a text"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Estimates the Jaccard similarity of shingle sets with MinHash signatures"""
+
+    def __init__(self, permutations=MINHASH_PERMUTATIONS, seed=42):
+        generator = random.Random(seed)
+        self.permutations = [
+            (generator.randrange(1, MINHASH_PRIME), generator.randrange(0, MINHASH_PRIME))
+            for _ in range(permutations)
+        ]
+
+    def signature(self, shingle_set):
+        """Returns the MinHash signature of a set of shingles, None for an empty set"""
+        if not shingle_set:
+            return None
+
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+            for shingle in shingle_set
+        ]
+        return tuple(min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in self.permutations)
+
+    @staticmethod
+    def similarity(first, second):
+        """Returns the estimated Jaccard similarity of two signatures"""
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+def find_duplicate_clusters(texts, threshold=DUPLICATE_SIMILARITY, hasher=None):
+    """
+    Groups near-duplicate texts. Candidate pairs come from locality sensitive hashing of the
+    signature bands and are confirmed against the threshold.
+
+    Args:
+        texts (list): The texts to compare
+        threshold (float): Minimum estimated Jaccard similarity of two duplicates
+        hasher (MinHasher, optional): Hasher to use
+
+    Returns:
+        list: Clusters as lists of indexes of texts, in order, including single texts
+    """
+    hasher = hasher if hasher is not None else MinHasher()
+    signatures = [hasher.signature(shingles(text)) for text in texts]
+
+    parents = list(range(len(texts)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    buckets = {}
+    for index, signature in enumerate(signatures):
+        if signature is None:
+            continue
+        for start in range(0, len(signature), BAND_ROWS):
+            buckets.setdefault((start, signature[start:start + BAND_ROWS]), []).append(index)
+
+    for candidates in buckets.values():
+        for position, first in enumerate(candidates):
+            for other in candidates[position + 1:]:
+                first_root, other_root = find(first), find(other)
+                if first_root != other_root and hasher.similarity(signatures[first], signatures[other]) >= threshold:
+                    parents[max(first_root, other_root)] = min(first_root, other_root)
+
+    clusters = {}
+    for index in range(len(texts)):
+        clusters.setdefault(find(index), []).append(index)
+    return sorted(clusters.values(), key=lambda cluster: cluster[0])
+
+
+class PreprocessResult:
+    """Posts ready for the summarizer, with the duplicates collapsed into them"""
+
+    def __init__(self, posts, duplicates, raw_tokens, clean_tokens):
+        """
+        Args:
+            posts (list): One InstagramPost with a clean caption per cluster of duplicates
+            duplicates (dict): post_id of the kept post -> list of the InstagramPost collapsed into it
+            raw_tokens (int): Tokens of the raw captions of every post
+            clean_tokens (int): Tokens of the clean captions of the kept posts
+        """
+        self.posts = posts
+        self.duplicates = duplicates
+        self.raw_tokens = raw_tokens
+        self.clean_tokens = clean_tokens
+
+    def report(self):
+        """Returns a printable report of the preprocessing"""
+        collapsed = sum(len(posts) for posts in self.duplicates.values())
+        saved = self.raw_tokens - self.clean_tokens
+        share = saved / self.raw_tokens if self.raw_tokens else 0
+        return (f"Preprocessing: {collapsed} near-duplicate posts collapsed, "
+                f"{saved} prompt tokens saved ({share:.0%})")
+
+
+def preprocess_posts(posts, token_counter=None, threshold=DUPLICATE_SIMILARITY):
+    """
+    Cleans the captions and keeps a single representative of every group of near-duplicate posts,
+    the one with the longest clean caption.
+
+    Args:
+        posts (list): List of InstagramPost as scraped, they are not modified
+        token_counter (TokenCounter, optional): Counts the saved tokens, estimated otherwise
+        threshold (float): Minimum estimated Jaccard similarity of two duplicates
+
+    Returns:
+        PreprocessResult: The posts to summarize
+    """
+    count = token_counter.count if token_counter is not None else (lambda text: len(text) // 4 + 1)
+
+    clean_captions = [clean_caption(post.caption) for post in posts]
+    kept = []
+    duplicates = {}
+    for cluster in find_duplicate_clusters(clean_captions, threshold):
+        representative = max(cluster, key=lambda index: (len(clean_captions[index]), -index))
+        post = posts[representative]
+        kept.append((representative, InstagramPost(
+            post.post_id, clean_captions[representative], post.date, post.url, post.handle, post.pinned
+        )))
+        others = [posts[index] for index in cluster if index != representative]
+        if others:
+            duplicates[post.post_id] = others
+
+    # Keep the scraping order
+    kept.sort(key=lambda item: item[0])
+    kept_posts = [post for _, post in kept]
+
+    raw_tokens = sum(count(post.caption or "") for post in posts)
+    clean_tokens = sum(count(post.caption) for post in kept_posts)
+    return PreprocessResult(kept_posts, duplicates, raw_tokens, clean_tokens)
+
+
+class StreamingDeduplicator:
+    """
+    Cleans the captions and collapses near-duplicates of posts arriving one at a time, e.g. while
+    they are still being scraped. The first post of every group of duplicates is the one kept.
+    """
+
+    def __init__(self, token_counter=None, threshold=DUPLICATE_SIMILARITY, hasher=None):
+        """
+        Args:
+            token_counter (TokenCounter, optional): Counts the saved tokens, estimated otherwise
+            threshold (float): Minimum estimated Jaccard similarity of two duplicates
+            hasher (MinHasher, optional): Hasher to use
+        """
+        self.count = token_counter.count if token_counter is not None else (lambda text: len(text) // 4 + 1)
+        self.threshold = threshold
+        self.hasher = hasher if hasher is not None else MinHasher()
+
+        self.posts = []
+        self.duplicates = {}
+        self.raw_tokens = 0
+        self.clean_tokens = 0
+        self._signatures = []
+        self._buckets = {}
+
+    def _find_duplicate(self, signature):
+        """Returns the index of a kept post similar to the signature, None if there is none"""
+        for start in range(0, len(signature), BAND_ROWS):
+            for index in self._buckets.get((start, signature[start:start + BAND_ROWS]), []):
+                if self.hasher.similarity(signature, self._signatures[index]) >= self.threshold:
+                    return index
+        return None
+
+    def add(self, post):
+        """
+        Args:
+            post (InstagramPost): The post as scraped, it is not modified
+
+        Returns:
+            InstagramPost: A copy with a clean caption, None if the post duplicates one already added
+        """
+        caption = clean_caption(post.caption)
+        self.raw_tokens += self.count(post.caption or "")
+
+        signature = self.hasher.signature(shingles(caption))
+        if signature is not None:
+            duplicate = self._find_duplicate(signature)
+            if duplicate is not None:
+                self.duplicates.setdefault(self.posts[duplicate].post_id, []).append(post)
+                return None
+
+            for start in range(0, len(signature), BAND_ROWS):
+                self._buckets.setdefault((start, signature[start:start + BAND_ROWS]), []).append(len(self.posts))
+
+        clean_post = InstagramPost(post.post_id, caption, post.date, post.url, post.handle, post.pinned)
+        self.posts.append(clean_post)
+        self._signatures.append(signature)
+        self.clean_tokens += self.count(caption)
+        return clean_post
+
+    def result(self):
+        """Returns the posts kept so far as a PreprocessResult"""
+        return PreprocessResult(list(self.posts), self.duplicates, self.raw_tokens, self.clean_tokens)
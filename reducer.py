@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from config import MODEL_CONTEXT_TOKENS
+from instrumentation import instrumentation
+
+# Prompt used to merge a group of summaries into an overview
+OVERVIEW_PROMPT = """Based on these {kind}, create an overview that captures the main events with dates, be concise:
+
+{content}
+"""
+
+
+class HierarchicalReducer:
+    """
+    Builds an overview of any number of summaries without overflowing the context of the model:
+    summaries are grouped into chunks fitting the context, every chunk gets its overview in parallel
+    and the overviews are reduced again until a single one is left.
+    """
+
+    def __init__(self, summarizer, token_counter, context_tokens=MODEL_CONTEXT_TOKENS):
+        """
+        Args:
+            summarizer (ContentSummarizer): Summarizer used to send the requests and run the workers
+            token_counter (TokenCounter): Counts the tokens of the summaries
+            context_tokens (int): Context window of the model, set on every request
+        """
+        self.summarizer = summarizer
+        self.token_counter = token_counter
+        self.context_tokens = context_tokens
+        # An overview is at most an eighth of the context, so every chunk holds several of them
+        self.output_tokens = context_tokens // 8
+        self._input_tokens = None
+
+    @property
+    def input_tokens(self):
+        """Tokens left for the summaries of a chunk once the prompt and the answer are accounted for"""
+        if self._input_tokens is None:
+            prompt_tokens = self.token_counter.count(OVERVIEW_PROMPT.format(kind="partial overviews", content=""))
+            self._input_tokens = self.context_tokens - self.output_tokens - prompt_tokens
+        return self._input_tokens
+
+    def _split_oversized(self, text, tokens):
+        """Split a text larger than a chunk into consecutive pieces that fit"""
+        pieces_count = tokens // self.input_tokens + 1
+        piece_chars = len(text) // pieces_count + 1
+        return [text[start:start + piece_chars] for start in range(0, len(text), piece_chars)]
+
+    def chunk(self, items):
+        """
+        Group consecutive items into chunks whose tokens fit the context.
+
+        Returns:
+            list: List of lists of strings, every item is kept
+        """
+        chunks = []
+        chunk = []
+        chunk_tokens = 0
+        for item in items:
+            tokens = self.token_counter.count(item) + 1
+            pieces = [item] if tokens <= self.input_tokens else self._split_oversized(item, tokens)
+            for piece in pieces:
+                piece_tokens = tokens if len(pieces) == 1 else self.token_counter.count(piece) + 1
+                if chunk and chunk_tokens + piece_tokens > self.input_tokens:
+                    chunks.append(chunk)
+                    chunk = []
+                    chunk_tokens = 0
+                chunk.append(piece)
+                chunk_tokens += piece_tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _overview(self, chunk, kind):
+        """Returns the overview of a chunk, None if it could not be generated"""
+        overview, error = self.summarizer.generate({
+            "model": self.summarizer.model,
+            "prompt": OVERVIEW_PROMPT.format(kind=kind, content="\n\n".join(chunk)),
+            "options": {"num_ctx": self.context_tokens, "num_predict": self.output_tokens}
+        })
+        if overview is None:
+            print(f"Could not create an overview: {error}")
+        return overview
+
+    @instrumentation.timed("summarizer.reduce")
+    def reduce(self, items, kind="individual post summaries"):
+        """
+        Reduce the items to a single overview.
+
+        Args:
+            items (list): The summaries to merge
+            kind (str): What the items are, used in the prompt of the first level
+
+        Returns:
+            str: The overview, None if there is nothing to reduce or every overview of a level failed
+        """
+        if not items:
+            return None
+
+        level = 0
+        with ThreadPoolExecutor(max_workers=self.summarizer.workers) as executor:
+            while True:
+                chunks = self.chunk(items)
+                if len(chunks) == 1:
+                    return self._overview(chunks[0], kind)
+
+                level += 1
+                print(f"Reducing {len(items)} summaries in {len(chunks)} chunks (level {level})")
+                overviews = executor.map(lambda chunk, kind=kind: self._overview(chunk, kind), chunks)
+                # The failed chunks are left out of the next level
+                items = [overview for overview in overviews if overview is not None]
+                if not items:
+                    return None
+                kind = "partial overviews"
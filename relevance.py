@@ -0,0 +1,202 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from config import RELEVANCE_THRESHOLD, RELEVANCE_TOP_K, RELEVANCE_EXPANSION
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Common English and Italian words, they say nothing about the relevance of a post
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its near of on or that the this to was were will with
+about after all also any before can do into more new not only our out over so than their them then there these
+they up we what when where which who you your
+a ad agli ai al alla alle allo anche che chi ci con da dal dalla dei del della delle di e ed gli ha i il in la
+le lo ma mi nei nel nella non o per piu più se si sono su sua sul sulla suo tra un una uno vi
+""".split())
+
+# Prompt used to expand the goal with related words before ranking the posts
+EXPANSION_PROMPT = """List up to 15 single keywords that posts relevant to this goal would likely contain: synonyms, \
+related terms, other word forms and translations in English and Italian.
+Answer only with the keywords separated by commas.
+
+Goal: {goal}
+"""
+
+# Weight of the expansion keywords, the words of the goal weigh 1
+EXPANSION_WEIGHT = 0.5
+
+
+def tokenize(text):
+    """Returns the lowercase words of a text without accents and stopwords"""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return [word for word in WORD_PATTERN.findall(text) if word not in STOPWORDS and len(word) > 1]
+
+
+class BM25Index:
+    """
+    Document statistics for BM25 scoring. Documents can be added one at a time, the scores always
+    use the statistics of the documents added so far.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = 0
+        self.total_length = 0
+        self.document_frequencies = Counter()
+
+    def add(self, terms):
+        """Add the terms of a document"""
+        self.documents += 1
+        self.total_length += len(terms)
+        self.document_frequencies.update(set(terms))
+
+    def idf(self, term):
+        """Inverse document frequency of a term, always positive"""
+        frequency = self.document_frequencies[term]
+        return math.log(1 + (self.documents - frequency + 0.5) / (frequency + 0.5))
+
+    def max_score(self, query):
+        """Upper bound of the score of the query, reached by documents repeating every term"""
+        return sum(weight * self.idf(term) * (self.k1 + 1) for term, weight in query.items())
+
+    def score(self, query, terms):
+        """
+        Returns the BM25 score of a document
+
+        Args:
+            query (dict): term -> weight
+            terms (list): The terms of the document
+        """
+        if not query or not terms or not self.documents:
+            return 0.0
+
+        average_length = self.total_length / self.documents
+        term_counts = Counter(terms)
+        length_norm = self.k1 * (1 - self.b + self.b * len(terms) / average_length)
+
+        score = 0.0
+        for term, weight in query.items():
+            count = term_counts[term]
+            if count:
+                score += weight * self.idf(term) * count * (self.k1 + 1) / (count + length_norm)
+        return score
+
+
+class RelevanceFilter:
+    """
+    Ranks posts against the goal with BM25 over the clean captions, so that only the relevant ones
+    are summarized. The others are listed in the report as skipped.
+    """
+
+    def __init__(self, goal, threshold=RELEVANCE_THRESHOLD, top_k=RELEVANCE_TOP_K, expansion=RELEVANCE_EXPANSION,
+                 summarizer=None):
+        """
+        Args:
+            goal (str): The focus of the summary
+            threshold (float): Minimum relevance of a kept post, from 0 to 1 for a post repeating a word of the goal
+            top_k (int, optional): Keep at most this many posts, only applied by split
+            expansion (bool): Expand the goal with related keywords written by the model of the summarizer,
+                once the first post is scored so that creating the filter does not wait for the model
+            summarizer (ContentSummarizer, optional): Needed by the expansion
+        """
+        self.goal = goal
+        self.threshold = threshold
+        self.top_k = top_k
+        self.index = BM25Index()
+
+        self.goal_terms = {term: 1.0 for term in tokenize(goal)}
+        self.query = dict(self.goal_terms)
+        # Cleared once the goal is expanded
+        self._expansion_summarizer = summarizer if expansion else None
+
+        # (post, score) of the posts below the threshold or beyond top_k
+        self.skipped = []
+
+    def _expand(self):
+        """Add the keywords the model relates to the goal to the query, the first time it is called"""
+        summarizer = self._expansion_summarizer
+        if summarizer is None:
+            return
+        self._expansion_summarizer = None
+
+        text, error = summarizer.generate({
+            "model": summarizer.model,
+            "prompt": EXPANSION_PROMPT.format(goal=self.goal),
+            "temperature": 0.2,
+            "options": {"num_predict": 100}
+        })
+        if text is None:
+            print(f"Could not expand the goal: {error}")
+            return
+
+        for term in tokenize(text):
+            self.query.setdefault(term, EXPANSION_WEIGHT)
+        print(f"Relevance keywords: {', '.join(self.query)}")
+
+    def _relevance(self, terms):
+        """Score of a post relative to the score of a post made of a single word of the goal, capped at 1:
+        posts matching any word of the goal are fully relevant, the expansion keywords count partially"""
+        reference = self.index.max_score(self.goal_terms) / len(self.goal_terms)
+        return min(1.0, self.index.score(self.query, terms) / reference) if reference else 0.0
+
+    def split(self, posts):
+        """
+        Rank the whole set of posts at once
+
+        Args:
+            posts (list): List of InstagramPost with clean captions
+
+        Returns:
+            list: The relevant posts, in their original order
+        """
+        if not self.goal_terms:
+            return list(posts)
+
+        self._expand()
+        documents = [tokenize(post.caption) for post in posts]
+        for terms in documents:
+            self.index.add(terms)
+        scores = [self._relevance(terms) for terms in documents]
+
+        ranked = sorted(range(len(posts)), key=lambda index: scores[index], reverse=True)
+        kept = [index for index in ranked if scores[index] >= self.threshold]
+        if self.top_k is not None:
+            kept = kept[:self.top_k]
+
+        if posts and not kept:
+            # More likely a goal worded unlike the captions than a run without anything relevant
+            print("No post matches the goal, summarizing all of them")
+            return list(posts)
+
+        kept_indexes = set(kept)
+        self.skipped.extend((posts[index], scores[index]) for index in ranked if index not in kept_indexes)
+        return [post for index, post in enumerate(posts) if index in kept_indexes]
+
+    def accepts(self, post):
+        """
+        Score a single post against the posts seen so far, for posts arriving while they are scraped.
+        Only the threshold applies.
+
+        Returns:
+            bool: Whether the post is relevant
+        """
+        if not self.goal_terms:
+            return True
+
+        self._expand()
+        terms = tokenize(post.caption)
+        self.index.add(terms)
+        score = self._relevance(terms)
+        if score >= self.threshold:
+            return True
+
+        self.skipped.append((post, score))
+        return False
+
+    def report(self):
+        """Returns a printable report of the filtering"""
+        return f"Relevance: {len(self.skipped)} posts skipped below {self.threshold:.2f}"
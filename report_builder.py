@@ -0,0 +1,138 @@
+import argparse
+import os
+import time
+
+from cli_utils import parse_date
+from config import DATABASE_FILE, MODEL_NAME, EXPORT_TARGETS
+from database import DatabaseManager
+from exporters import create_export_job, export, format_results
+from file_utls import create_summary_output_file
+from summarizer import ContentSummarizer, render_report
+
+
+class ReportBuilder:
+    """
+    Renders reports from the summaries stored in the database, without scraping and, unless an overview
+    is requested, without any model call.
+    """
+
+    def __init__(self, db_manager, output_dir="summaries"):
+        """
+        Args:
+            db_manager (DatabaseManager): Database holding the runs and the per-post summaries
+            output_dir (str): Directory of the rendered reports
+        """
+        self.db_manager = db_manager
+        self.output_dir = output_dir
+
+    def run_report(self, summary_id):
+        """
+        Returns the report of a past run exactly as it was written
+
+        Returns:
+            tuple: (report, goal), the report is None if there is no such run
+        """
+        run = self.db_manager.get_run(summary_id)
+        if run is None:
+            return None, None
+        summary, _, goal, _, _ = run
+        return summary, goal
+
+    def range_report(self, handles=None, since=None, until=None, goal=None, model=None, summarizer=None):
+        """
+        Builds a report from the stored per-post summaries
+
+        Args:
+            handles (list, optional): Only posts of these handles
+            since (datetime, optional): Only posts published at or after this date
+            until (datetime, optional): Only posts published before this date
+            goal (str, optional): Only summaries written for this goal, any goal when None
+            model (str, optional): Only summaries written by this model, any model when None
+            summarizer (ContentSummarizer, optional): Writes an overview of the posts, none otherwise
+
+        Returns:
+            str or None: The report, None if no stored post matches
+        """
+        digests = self.db_manager.get_digests(handles, since, until, goal, model)
+        if not digests:
+            return None
+
+        post_summaries = [{
+            "id": post.post_id,
+            "title": f"[{i + 1} - {post.handle}]({post.url})",
+            "summary": summary,
+            "duplicates": []
+        } for i, (post, summary) in enumerate(digests)]
+
+        first_date = digests[0][0].date
+        last_date = digests[-1][0].date
+        header = (f"# {first_date:%Y-%m-%d} to {last_date:%Y-%m-%d} - {goal.capitalize() if goal else 'General'}\n\n"
+                  f"{len(digests)} posts{' of ' + ', '.join(handles) if handles else ''}\n\n")
+
+        overview = None
+        if summarizer is not None:
+            overview = summarizer.reducer.reduce(
+                [f"Post {i + 1}: {post['summary']}" for i, post in enumerate(post_summaries)]
+            )
+
+        return render_report(header, overview, post_summaries, include_overview=summarizer is not None)
+
+    def write(self, report, goal=None, pdf=True):
+        """
+        Exports the report to the markdown file and the other EXPORT_TARGETS, rendered in parallel;
+        a report exported before is copied instead of rendered again
+
+        Returns:
+            dict: target -> {"path", "status", "seconds"}, see exporters.export
+        """
+        output_file = create_summary_output_file(self.output_dir, goal)
+        targets = ["markdown"] + [target for target in EXPORT_TARGETS if target != "markdown" and (pdf or target != "pdf")]
+        job = create_export_job(report, os.path.splitext(output_file)[0], os.path.basename(output_file), targets)
+        return export(job)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render reports from the stored summaries, without scraping")
+    parser.add_argument("--list", action="store_true", help="list the most recent runs and exit")
+    parser.add_argument("--run", type=int, help="render the report of a past run, see --list")
+    parser.add_argument("--handle", action="append", dest="handles", help="only posts of this handle, repeatable")
+    parser.add_argument("--since", type=parse_date, help="only posts published from this date, YYYY-MM-DD")
+    parser.add_argument("--until", type=parse_date, help="only posts published before this date, YYYY-MM-DD")
+    parser.add_argument("--goal", help="only summaries written for this goal, use '' for the ones without a goal")
+    parser.add_argument("--model", help="only summaries written by this model")
+    parser.add_argument("--overview", action="store_true", help=f"write an overview with {MODEL_NAME}")
+    parser.add_argument("--no-pdf", action="store_true", help="only write the markdown file")
+    parser.add_argument("--db", default=DATABASE_FILE, help="database file")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.db)
+    db_manager.setup_tables()
+    builder = ReportBuilder(db_manager)
+
+    if args.list:
+        for summary_id, scraped_at, goal, model, posts_count in db_manager.get_runs():
+            print(f"[run {summary_id}] {scraped_at} - {goal or 'General'} - {model or 'unknown model'} - "
+                  f"{posts_count} posts")
+        db_manager.close()
+        return
+
+    start = time.perf_counter()
+    if args.run is not None:
+        report, goal = builder.run_report(args.run)
+    else:
+        summarizer = ContentSummarizer(model=MODEL_NAME) if args.overview else None
+        goal = args.goal
+        report = builder.range_report(args.handles, args.since, args.until, args.goal, args.model, summarizer)
+    db_manager.close()
+
+    if report is None:
+        print("Nothing stored matches")
+        return
+
+    results = builder.write(report, goal, pdf=not args.no_pdf)
+    print(format_results(results))
+    print(f"Report written in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,92 @@
 # scraper.p
+from contextlib import contextmanager
 from datetime import datetime
 from urllib.parse import urlparse
 
 from selenium.common import ElementNotInteractableException
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
 from selenium.webdriver.common.by import By
 
-from browser_utils import sleep_for_random_seconds
+from browser_utils import block_requests
+from config import EXTRACTION_MODE, NETWORK_MAX_SCROLLS, INSTAGRAM_BASE_URL, SCRIPT_EXTRACTION, WALK_MODE, \
+    GRID_TABS, GRID_MAX_SCROLLS, GRID_SCROLL_TIMEOUT
+from instrumentation import instrumentation
 from models import InstagramPost
+from network_extractor import NetworkExtractor
+from pacing import Pacer, profile_ready, page_loaded, post_ready
+
+# Reads the opened post in a single round-trip: the same elements found by the WebDriver lookups of
+# _extract_post and click_next_post, the next button is returned as an element to click
+EXTRACT_POST_SCRIPT = """
+const postId = location.pathname.split('/').filter(Boolean)[1] || '';
+const captions = document.querySelectorAll("h1[dir='auto']");
+const times = document.querySelectorAll(`a[href*='/p/${postId}'] time, a[href*='/reel/${postId}'] time`);
+const nextButtons = Array.from(document.querySelectorAll('button'))
+    .filter(button => button.querySelector("span[style*='rotate']"));
+return {
+    url: location.href,
+    caption: captions.length ? captions[captions.length - 1].innerHTML : null,
+    datetime: times.length ? times[times.length - 1].getAttribute('datetime') : null,
+    next_button: nextButtons.length ? nextButtons[nextButtons.length - 1] : null
+};
+"""
+
+# Links of the posts shown by the profile grid, in grid order, with their pinned marker
+GRID_LINKS_SCRIPT = """
+const handle = arguments[0];
+return Array.from(document.querySelectorAll(`a[href^='/${handle}/p/'], a[href^='/${handle}/reel/']`))
+    .map(link => [link.getAttribute('href'), link.querySelector("svg[aria-label='Pinned post icon']") !== null]);
+"""
+
+# Starts loading a page without waiting for it, returns the url being left
+NAVIGATE_SCRIPT = """
+const previousUrl = location.href;
+window.location.href = arguments[0];
+return previousUrl;
+"""
 
 
 class InstagramScraper:
-    def __init__(self, driver):
+    def __init__(self, driver, pacer=None, extraction_mode=EXTRACTION_MODE, browser_stats=None,
+                 base_url=INSTAGRAM_BASE_URL, script_extraction=SCRIPT_EXTRACTION, walk_mode=WALK_MODE,
+                 grid_tabs=GRID_TABS, grid_max_scrolls=GRID_MAX_SCROLLS):
         self.driver = driver
+        self.base_url = base_url
+        self.script_extraction = script_extraction
+        self.walk_mode = walk_mode
+        self.grid_tabs = grid_tabs
+        self.grid_max_scrolls = grid_max_scrolls
+        # Window handles of the tabs loading posts in grid mode, opened once and reused
+        self._tabs = []
+        # Url and next button of the post read by the last script extraction
+        self._post_url = None
+        self._next_button = None
+        # WebDriver round-trips spent reading posts and moving to the next one
+        self.posts_opened = 0
+        self.post_round_trips = 0
+        self._counting_depth = 0
+        self.pacer = pacer if pacer is not None else Pacer()
+        self.browser_stats = browser_stats
+        self.network_extractor = NetworkExtractor(driver) if extraction_mode == "network" else None
 
+    @instrumentation.timed("scraper.go_to_profile")
     def go_to_profile(self, handle):
         """Navigate to an Instagram profile by handle"""
-        self.driver.get(f"https://www.instagram.com/{handle}/")
-        sleep_for_random_seconds(6, 7)
+        if self.browser_stats is not None:
+            self.browser_stats.record_page(self.driver)
+
+        self._post_url = self._next_button = None
+        self.driver.get(f"{self.base_url}/{handle}/")
+        self.pacer.wait_until(self.driver, "profile", profile_ready(handle))
 
+        if self.browser_stats is not None:
+            if self.browser_stats.claim_baseline():
+                # Once, so that a lean run can report its savings without a full mode run
+                self.browser_stats.measure_baseline(self.driver, self.pacer)
+                self.pacer.wait_until(self.driver, "profile", profile_ready(handle))
+            self.browser_stats.prepare_page(self.driver)
+
+    @instrumentation.timed("scraper.go_to_first_post")
     def go_to_first_post(self, handle):
         """
         Opens the first post on an Instagram profile.
@@ -27,14 +95,30 @@ class InstagramScraper:
             bool: True if the post was found and opened, False otherwise.
         """
         try:
+            previous_url = self.driver.current_url
             self.driver.find_element(By.XPATH,
                                      f"//a[starts-with(@href, '/{handle}/p/') or starts-with(@href, '/{handle}/reel/')]").click()
-            sleep_for_random_seconds(1, 2)
+            self.pacer.wait_until(self.driver, "post", post_ready(previous_url))
             return True
         except NoSuchElementException:
             print(f"No posts found for {handle}")
             return False
 
+    @contextmanager
+    def _counting_round_trips(self):
+        """Adds the WebDriver round-trips of the enclosed block to the per-post counters, once when nested"""
+        self._counting_depth += 1
+        start = getattr(self.driver, "round_trips", 0)
+        try:
+            yield
+        finally:
+            self._counting_depth -= 1
+            if self._counting_depth == 0:
+                round_trips = getattr(self.driver, "round_trips", 0) - start
+                self.post_round_trips += round_trips
+                instrumentation.count("scraper.post_round_trips", round_trips)
+
+    @instrumentation.timed("scraper.scrape_post")
     def scrape_post(self, handle=None):
         """
         Scrapes the caption and timestamp of the currently opened post.
@@ -45,6 +129,29 @@ class InstagramScraper:
         Returns:
             InstagramPost or None: An InstagramPost object if scraping was successful, None otherwise
         """
+        with self._counting_round_trips():
+            post = self._extract_post_with_script(handle) if self.script_extraction else self._extract_post(handle)
+
+        if post is not None:
+            self.posts_opened += 1
+            instrumentation.count("scraper.posts_opened")
+        return post
+
+    def _extract_post_with_script(self, handle=None):
+        """Reads the opened post and its next button with a single execute_script call"""
+        data = self.driver.execute_script(EXTRACT_POST_SCRIPT)
+        self._post_url = data["url"]
+        self._next_button = data["next_button"]
+
+        if not data["datetime"] or data["caption"] is None:
+            return None
+
+        post_id = urlparse(data["url"]).path.strip("/").split("/")[1]
+        date = datetime.strptime(data["datetime"], "%Y-%m-%dT%H:%M:%S.%fZ")
+        return InstagramPost(post_id, data["caption"], date, data["url"], handle)
+
+    def _extract_post(self, handle=None):
+        """Reads the opened post with a WebDriver command per element"""
         post_caption_containers = self.driver.find_elements(By.XPATH, "//h1[@dir='auto']")
         url = self.driver.current_url
         post_id = urlparse(url).path.strip("/").split("/")[1]
@@ -73,6 +180,7 @@ class InstagramScraper:
 
         return InstagramPost(post_id, caption, date, url, handle)
 
+    @instrumentation.timed("scraper.click_next_post")
     def click_next_post(self):
         """
         Clicks on the "Next" button to go to the next post if available.
@@ -80,75 +188,330 @@ class InstagramScraper:
         Returns:
             bool: True if the next button was found and clicked, False otherwise.
         """
-        try:
-            next_buttons = self.driver.find_elements(By.XPATH, "//button[.//span[contains(@style, 'rotate')]]")
-            if next_buttons:
-                next_button = next_buttons[-1]
-                next_button.click()
-                sleep_for_random_seconds(3, 4)
-                return True
-            else:
+        with self._counting_round_trips():
+            if self._post_url is not None:
+                return self._click_extracted_next_button()
+
+            try:
+                next_buttons = self.driver.find_elements(By.XPATH, "//button[.//span[contains(@style, 'rotate')]]")
+                if next_buttons:
+                    next_button = next_buttons[-1]
+                    previous_url = self.driver.current_url
+                    next_button.click()
+                    return self.pacer.wait_until(self.driver, "post", post_ready(previous_url))
+                else:
+                    return False
+            except ElementNotInteractableException:
+                print("Could not click on 'Next' button.")
                 return False
-        except ElementNotInteractableException:
+            except NoSuchElementException:
+                print("No more posts to scrape")
+                return False
+
+    def _click_extracted_next_button(self):
+        """Clicks the next button found by the last script extraction, without looking it up again"""
+        next_button, previous_url = self._next_button, self._post_url
+        self._next_button = self._post_url = None
+        if next_button is None:
+            return False
+
+        try:
+            next_button.click()
+        except (ElementNotInteractableException, StaleElementReferenceException):
             print("Could not click on 'Next' button.")
             return False
-        except NoSuchElementException:
-            print("No more posts to scrape")
+        return self.pacer.wait_until(self.driver, "post", post_ready(previous_url))
+
+    def grid_links(self, handle):
+        """
+        Returns the posts linked by the profile grid, in grid order.
+
+        Args:
+            handle (str): The Instagram handle of the opened profile
+
+        Returns:
+            list: (kind, code, pinned) tuples, kind is "p" or "reel"
+        """
+        links = []
+        for href, pinned in self.driver.execute_script(GRID_LINKS_SCRIPT, handle):
+            kind, code = urlparse(href).path.strip("/").split("/")[-2:]
+            links.append((kind, code, pinned))
+        return links
+
+    def _post_tabs(self, count):
+        """Returns count tabs for loading posts, opening the missing ones, and goes back to the current tab"""
+        current_window = self.driver.current_window_handle
+        while len(self._tabs) < count:
+            self.driver.switch_to.new_window("tab")
+            blocked_url_patterns = getattr(self.driver, "blocked_url_patterns", None)
+            if blocked_url_patterns is not None:
+                # Request blocking applies to a single tab
+                block_requests(self.driver, blocked_url_patterns)
+            self._tabs.append(self.driver.current_window_handle)
+        self.driver.switch_to.window(current_window)
+        return self._tabs[:count]
+
+    @instrumentation.timed("scraper.open_posts_in_tabs")
+    def open_posts_in_tabs(self, handle, links):
+        """
+        Loads posts at the same time in separate tabs, then scrapes them one tab after the other.
+
+        Args:
+            handle (str): The Instagram handle the posts belong to
+            links (list): (kind, code, pinned) tuples of the posts, at most one per tab
+
+        Returns:
+            list: InstagramPost, or None when it could not be scraped, for every link
+        """
+        with self._counting_round_trips():
+            profile_window = self.driver.current_window_handle
+            tabs = self._post_tabs(len(links))
+
+            # Start every load without waiting for it
+            previous_urls = []
+            for tab, (kind, code, _) in zip(tabs, links):
+                url = f"{self.base_url}/{kind}/{code}/"
+                self.driver.switch_to.window(tab)
+                previous_url = self.driver.execute_script(NAVIGATE_SCRIPT, url)
+                previous_urls.append(previous_url if previous_url != url else None)
+
+            posts = []
+            for tab, previous_url, (_, _, pinned) in zip(tabs, previous_urls, links):
+                self.driver.switch_to.window(tab)
+                post = None
+                if self.pacer.wait_until(self.driver, "post", post_ready(previous_url), jitter=False):
+                    post = self.scrape_post(handle)
+                if post is not None:
+                    post.pinned = pinned
+                posts.append(post)
+
+            self._post_url = self._next_button = None
+            self.driver.switch_to.window(profile_window)
+
+        # A single pause for the whole batch
+        self.pacer.jitter("post")
+        return posts
+
+    def iter_grid_posts(self, handle, min_date, high_water_mark=None, known_post_ids=None):
+        """
+        Yields the new posts of the opened profile from the links of its grid. The posts not stored yet are
+        opened in parallel tabs, the grid is scrolled only when every visible post was new.
+
+        Args:
+            handle (str): The Instagram handle of the opened profile
+            min_date (datetime): Minimum date for posts to be included
+            high_water_mark (tuple, optional): (last_post_id, last_post_date) of the handle
+            known_post_ids (set, optional): Ids of the posts already stored, they are not opened
+        """
+        known_post_ids = set(known_post_ids or ())
+        if high_water_mark is not None:
+            known_post_ids.add(high_water_mark[0])
+
+        seen_codes = set()
+        scrolls = 0
+        while True:
+            new_links = []
+            reached_known = False
+            for kind, code, pinned in self.grid_links(handle):
+                if code in seen_codes:
+                    continue
+                seen_codes.add(code)
+                if code in known_post_ids:
+                    # After the pinned posts the grid is newest first, everything below is stored already
+                    if not pinned:
+                        reached_known = True
+                        break
+                    continue
+                new_links.append((kind, code, pinned))
+
+            for start in range(0, len(new_links), self.grid_tabs):
+                batch = new_links[start:start + self.grid_tabs]
+                reached_old = False
+                for post in self.open_posts_in_tabs(handle, batch):
+                    if post is None:
+                        continue
+                    if self.is_new_post(post, min_date, high_water_mark):
+                        yield post
+                    elif not post.pinned:
+                        # Pinned posts can be old and still be followed by newer ones
+                        reached_old = True
+                if reached_old:
+                    return
+
+            if reached_known or scrolls >= self.grid_max_scrolls:
+                return
+
+            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            scrolls += 1
+            grid_extended = lambda driver: any(code not in seen_codes for _, code, _ in self.grid_links(handle))
+            if not self.pacer.wait_until(self.driver, "profile_scroll", grid_extended, timeout=GRID_SCROLL_TIMEOUT):
+                # End of the grid
+                return
+
+    @staticmethod
+    def is_new_post(post, min_date, high_water_mark=None):
+        """
+        Whether a post is inside the date window and newer than the newest post already stored.
+
+        Args:
+            post (InstagramPost): The scraped post
+            min_date (datetime): Minimum date for posts to be included
+            high_water_mark (tuple, optional): (last_post_id, last_post_date) of the handle
+
+        Returns:
+            bool: True if the post has not been seen yet
+        """
+        if post.date < min_date:
             return False
 
-    def scrape_posts(self, min_date, handles):
+        if high_water_mark is not None:
+            last_post_id, last_post_date = high_water_mark
+            return post.post_id != last_post_id and post.date > last_post_date
+
+        return True
+
+    @instrumentation.timed("scraper.network_extraction")
+    def scrape_posts_from_network(self, handle, min_date, high_water_mark=None):
         """
-        Scrapes posts from multiple Instagram handles.
+        Reads the posts of the currently opened profile from the captured feed responses,
+        scrolling the grid to load older posts until an already known one is found.
 
         Args:
+            handle (str): The Instagram handle of the opened profile
             min_date (datetime): Minimum date for posts to be included
-            handles (list): List of Instagram handles to scrape
+            high_water_mark (tuple, optional): (last_post_id, last_post_date) of the handle
 
         Returns:
-            list: List of InstagramPost objects
+            list or None: List of new InstagramPost objects, None if no feed response was captured
+        """
+        captured = self.network_extractor.extract_posts(handle)
+        if not captured:
+            return None
+
+        scrolls = 0
+        while scrolls < NETWORK_MAX_SCROLLS:
+            # Pinned posts can be old and still be followed by newer ones
+            if any(not self.is_new_post(post, min_date, high_water_mark) for post in captured if not post.pinned):
+                break
+
+            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            self.pacer.wait_until(self.driver, "profile_scroll", page_loaded())
+            scrolls += 1
+
+            seen = {post.post_id for post in captured}
+            older = [post for post in self.network_extractor.extract_posts(handle) if post.post_id not in seen]
+            if not older:
+                break
+            captured.extend(older)
+
+        return [post for post in captured if self.is_new_post(post, min_date, high_water_mark)]
+
+    def iter_handle_posts(self, handle, min_date, high_water_mark=None, known_post_ids=None):
         """
-        posts = []
+        Yields the new posts of a single handle as soon as they are scraped.
 
-        for handle in handles:
-            print(f"Scraping {handle}...")
-            self.go_to_profile(handle)
+        Args:
+            handle (str): The Instagram handle to scrape
+            min_date (datetime): Minimum date for posts to be included
+            high_water_mark (tuple, optional): (last_post_id, last_post_date) of the newest post already stored,
+                the walk of the profile stops once it reaches it
+            known_post_ids (set, optional): Ids of the posts already stored, not opened again in grid mode
+        """
+        if self.network_extractor is not None:
+            self.network_extractor.reset()
+        self.go_to_profile(handle)
 
-            try:
-                pinned_posts = self.driver.find_elements(By.CSS_SELECTOR, "svg[aria-label='Pinned post icon']")
-                pinned_posts_count = len(pinned_posts)
-            except NoSuchElementException:
-                pinned_posts_count = 0
+        if self.network_extractor is not None:
+            network_posts = self.scrape_posts_from_network(handle, min_date, high_water_mark)
+            if network_posts is not None:
+                yield from network_posts
+                return
+            print("No feed response captured, falling back to DOM scraping")
+
+        if self.walk_mode == "grid":
+            yield from self.iter_grid_posts(handle, min_date, high_water_mark, known_post_ids)
+            return
 
-            pinned_clicked = 0
+        try:
+            pinned_posts = self.driver.find_elements(By.CSS_SELECTOR, "svg[aria-label='Pinned post icon']")
+            pinned_posts_count = len(pinned_posts)
+        except NoSuchElementException:
+            pinned_posts_count = 0
+
+        pinned_clicked = 0
+
+        if self.go_to_first_post(handle):
+            post = self.scrape_post(handle)
+
+            if post:
+                if self.is_new_post(post, min_date, high_water_mark):
+                    yield post
+                else:
+                    pinned_clicked += 1
+                    if pinned_clicked > pinned_posts_count:
+                        return
+            else:
+                print("No posts found for this handle. Skipping...")
+                return
 
-            if self.go_to_first_post(handle):
+            # Continue to next posts, stopping at the first known post after the pinned ones
+            while self.click_next_post():
                 post = self.scrape_post(handle)
 
                 if post:
-                    if post.date >= min_date:
-                        posts.append(post)
-                        print(f"Scraped {post}")
+                    if self.is_new_post(post, min_date, high_water_mark):
+                        yield post
                     else:
                         pinned_clicked += 1
                         if pinned_clicked > pinned_posts_count:
-                            continue
+                            break
                 else:
-                    print("No posts found for this handle. Skipping...")
+                    break
+
+    def iter_posts(self, min_date, handles, high_water_marks=None, known_post_ids=None):
+        """
+        Yields the posts of multiple Instagram handles as soon as they are scraped.
+
+        Args:
+            min_date (datetime): Minimum date for posts to be included
+            handles (list): List of Instagram handles to scrape
+            high_water_marks (dict, optional): handle -> (last_post_id, last_post_date) of the newest
+                post already stored, the walk of a profile stops once it reaches it
+            known_post_ids (dict, optional): handle -> set of the ids of the posts already stored,
+                not opened again in grid mode
+        """
+        high_water_marks = high_water_marks or {}
+        known_post_ids = known_post_ids or {}
+        seen_post_ids = set()
+
+        for handle in handles:
+            print(f"Scraping {handle}...")
+            for post in self.iter_handle_posts(handle, min_date, high_water_marks.get(handle),
+                                               known_post_ids.get(handle)):
+                # The same post can be shared by more than one handle
+                if post.post_id in seen_post_ids:
                     continue
+                seen_post_ids.add(post.post_id)
+                print(f"Scraped {post}")
+                yield post
 
-                # Continue to next posts
-                while self.click_next_post():
-                    post = self.scrape_post(handle)
+        if self.posts_opened:
+            print(f"{self.post_round_trips / self.posts_opened:.1f} WebDriver round-trips per opened post")
+        if self.browser_stats is not None:
+            self.browser_stats.record_page(self.driver)
 
-                    if post:
-                        if post.date >= min_date:
-                            posts.append(post)
-                            print(f"Scraped {post}")
-                        else:
-                            pinned_clicked += 1
-                            if pinned_clicked > pinned_posts_count:
-                                break
-                    else:
-                        break
+    def scrape_posts(self, min_date, handles, high_water_marks=None, known_post_ids=None):
+        """
+        Scrapes posts from multiple Instagram handles.
 
-        return posts
\ No newline at end of file
+        Args:
+            min_date (datetime): Minimum date for posts to be included
+            handles (list): List of Instagram handles to scrape
+            high_water_marks (dict, optional): handle -> (last_post_id, last_post_date) of the newest
+                post already stored, the walk of a profile stops once it reaches it
+            known_post_ids (dict, optional): handle -> set of the ids of the posts already stored
+
+        Returns:
+            list: List of InstagramPost objects, without duplicates
+        """
+        return list(self.iter_posts(min_date, handles, high_water_marks, known_post_ids))
@@ -0,0 +1,223 @@
+import threading
+import time
+from queue import Queue, Empty
+
+from browser_utils import setup_browser
+from pacing import Pacer
+from scraper import InstagramScraper
+
+
+class ScraperPool:
+    """
+    Spreads Instagram handles over several Chrome instances that share the same login session.
+    """
+
+    def __init__(self, session, workers=2, min_seconds_between_profiles=0, browser_stats=None,
+                 max_buffered_posts=None):
+        """
+        Initialize a new scraper pool.
+
+        Args:
+            session (SessionManager): Session validated once and shared by every worker
+            workers (int): Number of Chrome instances to run in parallel
+            min_seconds_between_profiles (float): Pacing budget, minimum time a single worker
+                waits between two profile visits
+            browser_stats (BrowserStats, optional): Shared collector of the page stats of every worker
+            max_buffered_posts (int, optional): Scraped posts not yet consumed by iter_posts, the workers
+                pause once there are this many, unbounded by default
+        """
+        assert workers >= 1, "workers must be at least 1"
+        self.session = session
+        self.workers = workers
+        self.min_seconds_between_profiles = min_seconds_between_profiles
+        self.browser_stats = browser_stats
+        self.max_buffered_posts = max_buffered_posts
+        # Handles of the last iter_posts whose scraping failed, their posts may be incomplete
+        self.failed_handles = []
+
+    def _start_worker_browser(self, pacer):
+        """Start a browser and log it in with the shared session"""
+        driver = setup_browser()
+        self.session.attach(driver, pacer)
+        return driver
+
+    def _run_worker(self, worker_id, driver, pacer, handles_queue, min_date, high_water_marks, known_post_ids,
+                    buffer, done):
+        """
+        Scrape handles from the queue until it is empty.
+
+        Args:
+            worker_id (int): Identifier used for logging
+            driver: A logged in WebDriver, or None to start a new one in this thread
+            pacer (Pacer): The pacer of this worker, learning its own page latencies
+            handles_queue (Queue): Queue of (index, handle) tuples
+            min_date (datetime): Minimum date for posts to be included
+            high_water_marks (dict): handle -> (last_post_id, last_post_date) of the newest stored post
+            known_post_ids (dict): handle -> set of the ids of the stored posts
+            buffer (_PostBuffer): Receives the scraped posts, shared by the workers and the consumer
+            done (threading.Condition): Guards the buffer, notified every time it changes
+        """
+        try:
+            if driver is None:
+                driver = self._start_worker_browser(pacer)
+        except Exception as e:
+            print(f"Worker {worker_id} could not start: {e}")
+            return
+
+        scraper = InstagramScraper(driver, pacer, browser_stats=self.browser_stats)
+        last_profile_visit = None
+
+        try:
+            while True:
+                try:
+                    index, handle = handles_queue.get_nowait()
+                except Empty:
+                    break
+
+                # Respect the per-worker pacing budget
+                if last_profile_visit is not None:
+                    elapsed = time.monotonic() - last_profile_visit
+                    if elapsed < self.min_seconds_between_profiles:
+                        time.sleep(self.min_seconds_between_profiles - elapsed)
+                last_profile_visit = time.monotonic()
+
+                print(f"[worker {worker_id}] Scraping {handle}...")
+                try:
+                    for post in scraper.iter_posts(min_date, [handle], high_water_marks, known_post_ids):
+                        with done:
+                            # The handle being consumed never waits, the consumer needs it to go on
+                            while buffer.is_full(self.max_buffered_posts) and index != buffer.consumed_index:
+                                done.wait()
+                            buffer.add(index, post)
+                            done.notify_all()
+                except Exception as e:
+                    print(f"[worker {worker_id}] Error scraping {handle}: {e}")
+                    with done:
+                        self.failed_handles.append(handle)
+
+                with done:
+                    buffer.finished.add(index)
+                    done.notify_all()
+        finally:
+            driver.quit()
+            with done:
+                done.notify_all()
+
+    def iter_posts(self, min_date, handles, high_water_marks=None, known_post_ids=None):
+        """
+        Yields the posts of multiple Instagram handles scraped by all the workers of the pool,
+        handle by handle in the given order, the posts of a handle as soon as every previous handle is
+        completed. The workers pause while max_buffered_posts posts are waiting to be consumed.
+
+        Args:
+            min_date (datetime): Minimum date for posts to be included
+            handles (list): List of Instagram handles to scrape
+            high_water_marks (dict, optional): handle -> (last_post_id, last_post_date) of the newest
+                post already stored
+            known_post_ids (dict, optional): handle -> set of the ids of the posts already stored
+        """
+        self.failed_handles = []
+        if not handles:
+            return
+
+        handles_queue = Queue()
+        for index, handle in enumerate(handles):
+            handles_queue.put((index, handle))
+
+        # The first browser validates the session on the persistent profile before the others start,
+        # so that a login is done only once when the session has expired
+        first_pacer = Pacer()
+        first_driver = self.session.start_browser(first_pacer)
+
+        buffer = _PostBuffer()
+        done = threading.Condition()
+        threads = []
+        for worker_id in range(min(self.workers, len(handles))):
+            driver = first_driver if worker_id == 0 else None
+            pacer = first_pacer if worker_id == 0 else Pacer()
+            thread = threading.Thread(
+                target=self._run_worker,
+                args=(worker_id, driver, pacer, handles_queue, min_date, high_water_marks or {}, known_post_ids or {},
+                      buffer, done),
+                name=f"scraper-worker-{worker_id}"
+            )
+            thread.start()
+            threads.append(thread)
+
+        # Merge back in a deterministic order
+        seen_post_ids = set()
+        try:
+            for index in range(len(handles)):
+                handle_finished = False
+                while not handle_finished:
+                    with done:
+                        buffer.consumed_index = index
+                        done.notify_all()
+                        while not buffer.posts.get(index) and index not in buffer.finished:
+                            if not any(thread.is_alive() for thread in threads):
+                                # Every worker stopped, e.g. none could start a browser
+                                buffer.finished.add(index)
+                                self.failed_handles.append(handles[index])
+                                break
+                            done.wait(timeout=1)
+                        handle_posts = buffer.take(index)
+                        handle_finished = index in buffer.finished
+                        done.notify_all()
+
+                    # Yielded without the lock, the workers go on while the consumer is busy
+                    for post in handle_posts:
+                        if post.post_id not in seen_post_ids:
+                            seen_post_ids.add(post.post_id)
+                            yield post
+        finally:
+            # A consumer stopping early must not leave the workers waiting
+            with done:
+                buffer.closed = True
+                done.notify_all()
+
+        for thread in threads:
+            thread.join()
+
+    def scrape_posts(self, min_date, handles, high_water_marks=None, known_post_ids=None):
+        """
+        Scrapes posts from multiple Instagram handles using all the workers of the pool.
+
+        Args:
+            min_date (datetime): Minimum date for posts to be included
+            handles (list): List of Instagram handles to scrape
+            high_water_marks (dict, optional): handle -> (last_post_id, last_post_date) of the newest
+                post already stored
+            known_post_ids (dict, optional): handle -> set of the ids of the posts already stored
+
+        Returns:
+            list: List of InstagramPost objects, ordered like the given handles, without duplicates
+        """
+        return list(self.iter_posts(min_date, handles, high_water_marks, known_post_ids))
+
+
+class _PostBuffer:
+    """Posts scraped by the workers and not yet consumed, guarded by the condition of the pool"""
+
+    def __init__(self):
+        # index of the handle -> its posts waiting to be consumed
+        self.posts = {}
+        # Indexes of the completed handles
+        self.finished = set()
+        # Index of the handle the consumer is waiting for
+        self.consumed_index = 0
+        self.count = 0
+        # Set once the consumer is gone, the workers do not wait anymore
+        self.closed = False
+
+    def is_full(self, max_posts):
+        return not self.closed and max_posts is not None and self.count >= max_posts
+
+    def add(self, index, post):
+        self.posts.setdefault(index, []).append(post)
+        self.count += 1
+
+    def take(self, index):
+        """Removes and returns the waiting posts of a handle"""
+        posts = self.posts.pop(index, [])
+        self.count -= len(posts)
+        return posts
@@ -0,0 +1,50 @@
+import argparse
+import time
+
+from cli_utils import parse_date
+from config import DATABASE_FILE
+from database import DatabaseManager, fts_query
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the scraped captions and the run summaries")
+    parser.add_argument("query", nargs="+", help="words to search, all of them must match")
+    parser.add_argument("--handle", action="append", dest="handles", help="only posts of this handle, repeatable")
+    parser.add_argument("--since", type=parse_date, help="only posts published from this date, YYYY-MM-DD")
+    parser.add_argument("--until", type=parse_date, help="only posts published before this date, YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=20, help="maximum number of results")
+    parser.add_argument("--summaries", action="store_true", help="search the run summaries instead of the posts")
+    parser.add_argument("--raw", action="store_true", help="pass the query as FTS5 syntax, e.g. 'concert NOT jazz'")
+    parser.add_argument("--db", default=DATABASE_FILE, help="database file")
+    args = parser.parse_args()
+
+    text = " ".join(args.query)
+    query = text if args.raw else fts_query(text)
+    if not query:
+        parser.error("the query has no words to search")
+
+    db_manager = DatabaseManager(args.db)
+    db_manager.setup_tables()
+
+    start = time.perf_counter()
+    if args.summaries:
+        results = db_manager.search_summaries(query, args.since, args.until, args.limit)
+    else:
+        results = db_manager.search_posts(query, args.handles, args.since, args.until, args.limit)
+    elapsed = time.perf_counter() - start
+    db_manager.close()
+
+    if args.summaries:
+        for summary_id, scraped_at, rank, snippet in results:
+            print(f"[run {summary_id}] {scraped_at} ({-rank:.2f})")
+            print(f"    {' '.join(snippet.split())}\n")
+    else:
+        for post, rank, snippet in results:
+            print(f"{post.date:%Y-%m-%d} {post.handle} {post.url} ({-rank:.2f})")
+            print(f"    {' '.join(snippet.split())}\n")
+
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import pickle
+import time
+
+from selenium.webdriver.common.by import By
+
+from browser_utils import setup_browser, load_cookies, login_with_credentials
+from config import COOKIES_FILE, BROWSER_PROFILE_DIR, INSTAGRAM_BASE_URL
+from pacing import Pacer, page_loaded, element_present
+
+# Small same-origin plain text page, opening it costs no rendering but gives access to the cookies
+SESSION_CHECK_URL = f"{INSTAGRAM_BASE_URL}/robots.txt"
+
+# Asks Instagram who the current user is, answers 200 only with a valid session
+SESSION_CHECK_SCRIPT = """
+const done = arguments[arguments.length - 1];
+fetch('/api/v1/accounts/current_user/?edit=true', {
+    credentials: 'include',
+    headers: {'X-IG-App-ID': '936619743392459', 'X-Requested-With': 'XMLHttpRequest'}
+}).then(response => done(response.status)).catch(() => done(0));
+"""
+
+# Rendered by the home page, the login form without a session and the navigation with one
+HOME_READY_SELECTOR = "input[name='password'], a[href='/explore/']"
+
+
+class SessionManager:
+    """
+    Keeps the Instagram session in a persistent Chrome profile, validates it without rendering
+    a page and logs in again only once it has expired.
+    """
+
+    def __init__(self, cookies_file=COOKIES_FILE, user_data_dir=BROWSER_PROFILE_DIR):
+        """
+        Initialize a new session manager.
+
+        Args:
+            cookies_file (str): Path of the pickled login cookies, shared with browsers not using the profile
+            user_data_dir (str): Persistent Chrome profile directory
+        """
+        self.cookies_file = cookies_file
+        self.user_data_dir = user_data_dir
+
+    def _open_check_page(self, driver, pacer):
+        """Opens the cheap same-origin page used for cookie operations"""
+        if driver.current_url != SESSION_CHECK_URL:
+            driver.get(SESSION_CHECK_URL)
+            pacer.wait_until(driver, "session_check", page_loaded(), jitter=False)
+
+    @staticmethod
+    def has_session_cookie(driver):
+        """Whether the browser holds a session cookie that has not expired yet"""
+        cookie = driver.get_cookie("sessionid")
+        if not cookie or not cookie.get("value"):
+            return False
+        expiry = cookie.get("expiry")
+        return expiry is None or expiry > time.time()
+
+    def is_session_valid(self, driver, pacer=None):
+        """
+        Checks the session with a single request to Instagram, without rendering any page.
+        When the request cannot be sent, the home page is rendered and checked instead.
+
+        Returns:
+            bool: True if the browser is logged in
+        """
+        pacer = pacer if pacer is not None else Pacer()
+        self._open_check_page(driver, pacer)
+
+        if not self.has_session_cookie(driver):
+            return False
+
+        driver.set_script_timeout(15)
+        status = driver.execute_async_script(SESSION_CHECK_SCRIPT)
+        if status == 0:
+            # The request could not be sent, the home page tells instead
+            print("Session check request failed, checking the home page")
+            return self._home_page_logged_in(driver, pacer)
+        return status == 200
+
+    @staticmethod
+    def _home_page_logged_in(driver, pacer):
+        """Whether the home page shows the logged in navigation instead of the login form"""
+        driver.get(f"{INSTAGRAM_BASE_URL}/")
+        if not pacer.wait_until(driver, "home", element_present(HOME_READY_SELECTOR)):
+            return False
+        return not driver.find_elements(By.CSS_SELECTOR, "input[name='password']")
+
+    def store_cookies(self, driver):
+        """Stores the cookies of the browser for the browsers not using the profile"""
+        os.makedirs(os.path.dirname(self.cookies_file), exist_ok=True)
+        with open(self.cookies_file, "wb") as cookies:
+            pickle.dump(driver.get_cookies(), cookies)
+
+    def ensure_session(self, driver, pacer=None):
+        """
+        Makes sure the browser is logged in: keeps a valid session, otherwise loads the stored
+        cookies and, as last resort, logs in through the form.
+        """
+        pacer = pacer if pacer is not None else Pacer()
+
+        if self.is_session_valid(driver, pacer):
+            print("Session still valid")
+            self.store_cookies(driver)
+            return
+
+        if os.path.exists(self.cookies_file):
+            print("Session expired, loading stored cookies...")
+            driver.delete_all_cookies()
+            if load_cookies(driver, self.cookies_file) and self.is_session_valid(driver, pacer):
+                print("Session restored from cookies")
+                return
+
+        print("Stored session expired, logging in")
+        driver.delete_all_cookies()
+        login_with_credentials(driver, self.cookies_file, pacer)
+
+    def start_browser(self, pacer=None):
+        """
+        Starts the browser on the persistent profile and makes sure it is logged in.
+        Only one browser at a time can use the profile.
+
+        Returns:
+            WebDriver: The logged in browser
+        """
+        driver = setup_browser(user_data_dir=self.user_data_dir)
+        self.ensure_session(driver, pacer)
+        return driver
+
+    def attach(self, driver, pacer=None):
+        """
+        Shares the session validated by start_browser with another browser, e.g. a parallel worker,
+        by copying the stored cookies.
+        """
+        pacer = pacer if pacer is not None else Pacer()
+        self._open_check_page(driver, pacer)
+        if not load_cookies(driver, self.cookies_file):
+            raise RuntimeError("No stored session to share, start the primary browser first")
@@ -1,142 +1,576 @@
-import requests
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import OLLAMA_URL, OLLAMA_KEEP_ALIVE, OLLAMA_TIMEOUT, OLLAMA_RETRIES, OLLAMA_STREAM, SUMMARIZER_WORKERS, SUMMARY_MODE, \
+    BATCH_TOKEN_BUDGET
+from instrumentation import instrumentation
 from models import InstagramPost
+from reducer import HierarchicalReducer
+from token_counter import TokenCounter
+
+# Prompt used to summarize a single post, changing it invalidates the cached summaries
+SINGLE_POST_PROMPT = """{instruction}.
+
+    Post:
+    ---
+    {post_content}
+    ---
+
+    Your summary should be 2-3 concise sentences capturing the key points, I'm interested in only the useful information, I don't want social media tags and hashtags.
+    """
+
+
+# Prompt used to summarize many posts in a single call, changing it invalidates the cached summaries
+BATCH_PROMPT = """{instruction}.
+
+The posts are provided in XML format below, each one with its id:
+{xml_content}
+
+Answer with a JSON object only. Use the id of every post as key and its summary as value. Do not skip any post.
+Every summary should be 2-3 concise sentences capturing the key points, I'm interested in only the useful information, I don't want social media tags and hashtags.
+"""
+
+
+class FailedSummary(str):
+    """The error message written in place of the summary of a post whose generation failed,
+    shown in the report but neither stored nor merged in the overview"""
+
+
+def posts_to_xml(posts, with_ids=False):
+    """Combine posts into a single XML document
+    :param posts: list of InstagramPost
+    :param with_ids: add the post id to every post, to recognize the posts in the answer
+    :return: the XML as a string
+    """
+    xml_content = "<posts>\n"
+    for i, post in enumerate(posts):
+        xml_content += post_to_xml(post, i, with_ids)
+    xml_content += "</posts>"
+    return xml_content
+
+
+def post_to_xml(post, index, with_ids=False):
+    """Format a single post as an XML element"""
+    title = f"{index} - {post.handle}"
+    content = post.caption.replace('<', '&lt;').replace('>', '&gt;')  # Escape XML special chars
+
+    xml_content = f"  <post id=\"{post.post_id}\">\n" if with_ids else f"  <post>\n"
+    xml_content += f"    <title>{title}</title>\n"
+    xml_content += f"    <url>{post.url}</url>\n"
+    xml_content += f"    <content>{content}</content>\n"
+    xml_content += f"  </post>\n"
+    return xml_content
+
+
+def parse_batch_summaries(text, post_ids):
+    """Validate the JSON answer of a batch and split it into per-post summaries
+    :param text: the model answer
+    :param post_ids: ids of the posts sent in the batch
+    :return: dictionary post_id -> summary, posts missing or invalid in the answer are left out
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, json.JSONDecodeError):
+        return {}
+
+    # Accept also a list of {"id", "summary"} objects, possibly wrapped in an object
+    if isinstance(data, dict) and len(data) == 1 and isinstance(next(iter(data.values())), list):
+        data = next(iter(data.values()))
+    if isinstance(data, list):
+        data = {
+            str(item.get("id") or item.get("post_id")): item.get("summary")
+            for item in data if isinstance(item, dict)
+        }
+    if not isinstance(data, dict):
+        return {}
+
+    summaries = {}
+    for post_id in post_ids:
+        summary = data.get(post_id)
+        if isinstance(summary, str) and summary.strip():
+            summaries[post_id] = summary.strip()
+    return summaries
+
+
+def format_post_section(post_summary):
+    """Format the markdown section of a single post summary"""
+    section = f"### {post_summary['title']}\n{post_summary['summary']}\n\n"
+    if post_summary.get("duplicates"):
+        links = ", ".join(f"[{post.handle}]({post.url})" for post in post_summary["duplicates"])
+        section += f"Also posted by {links}\n\n"
+    return section
+
+
+def render_report(header, overview, post_summaries, include_overview=True, skipped=None):
+    """Render the complete markdown report
+    :param header: the title lines
+    :param overview: the overview of all posts, None if it could not be generated
+    :param post_summaries: list of post summaries as built by the summarizer
+    :param include_overview: whether the report has an overview section
+    :param skipped: optional list of (InstagramPost, relevance) not summarized because of their low relevance
+    :return: the report as a string
+    """
+    parts = [header]
+    if include_overview:
+        parts.append("## Overview\n\n")
+        parts.append(f"{overview}\n\n" if overview is not None else "Error generating overview.\n\n")
+
+    # Write individual post summaries
+    parts.append("## Post Summaries\n\n")
+    parts.extend(format_post_section(post) for post in post_summaries)
+
+    if skipped:
+        parts.append("## Skipped, low relevance\n\n")
+        parts.extend(f"- [{post.handle}]({post.url}) ({score:.2f})\n" for post, score in skipped)
+        parts.append("\n")
+    return "".join(parts)
+
+
+def generation_stats(response, elapsed_seconds, first_token_seconds=None):
+    """Extract the timings of a generation from the last Ollama response
+    :param response: the final (done) response of Ollama
+    :param elapsed_seconds: wall clock seconds of the whole request
+    :param first_token_seconds: seconds until the first token was received, only known when streaming
+    :return: a dictionary of timings, durations in seconds
+    """
+    eval_count = response.get("eval_count", 0)
+    eval_seconds = response.get("eval_duration", 0) / 1e9
+    return {
+        "elapsed_seconds": elapsed_seconds,
+        "first_token_seconds": first_token_seconds,
+        "prompt_eval_count": response.get("prompt_eval_count", 0),
+        "prompt_eval_seconds": response.get("prompt_eval_duration", 0) / 1e9,
+        "eval_count": eval_count,
+        "eval_seconds": eval_seconds,
+        "load_seconds": response.get("load_duration", 0) / 1e9,
+        "tokens_per_second": eval_count / eval_seconds if eval_seconds else None
+    }
 
 
 class ContentSummarizer:
-    def __init__(self, model):
+    def __init__(self, model, workers=SUMMARIZER_WORKERS, timeout=OLLAMA_TIMEOUT, retries=OLLAMA_RETRIES, cache=None,
+                 stream=OLLAMA_STREAM, mode=SUMMARY_MODE, batch_token_budget=BATCH_TOKEN_BUDGET, base_url=OLLAMA_URL,
+                 keep_alive=OLLAMA_KEEP_ALIVE):
+        """
+        :param model: the Ollama model name
+        :param workers: number of requests sent to Ollama at the same time, match OLLAMA_NUM_PARALLEL
+        :param timeout: seconds to wait for a single response
+        :param retries: retries of a request failing because of connection errors or server errors
+        :param cache: optional SummaryCache returning the summaries of already seen captions
+        :param stream: consume the responses as token streams, reporting the time to first token
+        :param mode: "per_post" sends one request per post, "batch" packs many posts in a single request
+        :param batch_token_budget: maximum prompt tokens of a single batch
+        :param base_url: Ollama server url
+        :param keep_alive: how long Ollama keeps the model loaded after every request, e.g. "30m"
+        """
         self.model = model
-        self.api_url = "http://localhost:11434/api/generate"
+        self.cache = cache
+        self.api_url = f"{base_url}/api/generate"
+        self.workers = workers
+        self.timeout = timeout
+        self.stream = stream
+        self.mode = mode
+        self.batch_token_budget = batch_token_budget
+        self.keep_alive = keep_alive
+
+        # Timings of every generation, filled by the workers
+        self.generation_stats = []
+        self._stats_lock = threading.Lock()
+
+        # Keep-alive connections shared by every worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=1,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset({"POST"})
+            )
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Keeps the overview of many posts inside the context of the model
+        self.token_counter = TokenCounter(model, self.session, base_url)
+        self.reducer = HierarchicalReducer(self, self.token_counter)
 
+        # Results of the last unified summary
+        self.last_overview = None
+        self.last_post_summaries = []
+
+    def post_digests(self):
+        """Summaries of the last unified summary worth storing, failed generations are left out
+        :return: dictionary post_id -> summary, near-duplicates share the summary of their post
+        """
+        digests = {}
+        for post_summary in self.last_post_summaries:
+            summary = post_summary["summary"]
+            if not summary or post_summary["failed"]:
+                continue
+            digests[post_summary["id"]] = summary
+            for duplicate in post_summary["duplicates"]:
+                digests[duplicate.post_id] = summary
+        return digests
+
+    def _record_stats(self, stats, prompt):
+        """Keep the timings of a completed generation"""
+        self.token_counter.calibrate(len(prompt), stats["prompt_eval_count"])
+        instrumentation.record_generation(stats)
+        with self._stats_lock:
+            self.generation_stats.append(stats)
+
+    def generate(self, payload, stream=None):
+        """Send a generate request to Ollama and wait for the whole response
+        :param payload: the request body, "stream" is set by this method
+        :param stream: consume the NDJSON token stream instead of a single response, defaults to OLLAMA_STREAM
+        :return: a (text, error) tuple, text is None when the generation failed
+        """
+        stream = self.stream if stream is None else stream
+        # Set the context explicitly, Ollama silently truncates prompts longer than its default one
+        options = {"num_ctx": self.reducer.context_tokens, **payload.get("options", {})}
+        payload = {"keep_alive": self.keep_alive, **payload, "stream": stream, "options": options}
+        start = time.monotonic()
+
+        try:
+            response = self.session.post(self.api_url, json=payload, timeout=self.timeout, stream=stream)
+        except requests.RequestException as e:
+            print(f"Ollama request failed: {e}")
+            return None, "Error: Ollama did not answer"
+
+        with response:
+            if response.status_code != 200:
+                return None, f"Error: {response.status_code}, {response.text}"
+
+            if not stream:
+                data = response.json()
+                self._record_stats(generation_stats(data, time.monotonic() - start), payload["prompt"])
+                return data['response'], None
+
+            parts = []
+            first_token_seconds = None
+            final_chunk = {}
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        return None, f"Error: {chunk['error']}"
+
+                    token = chunk.get("response", "")
+                    if token and first_token_seconds is None:
+                        first_token_seconds = time.monotonic() - start
+                    parts.append(token)
+
+                    if chunk.get("done"):
+                        final_chunk = chunk
+                        break
+            except (requests.RequestException, json.JSONDecodeError) as e:
+                print(f"Ollama stream interrupted: {e}")
+                return None, "Error: Ollama stream interrupted"
+
+            # A stream closed by the server before the done chunk holds a truncated answer
+            if not final_chunk:
+                return None, "Error: Ollama stream ended early"
+
+        self._record_stats(generation_stats(final_chunk, time.monotonic() - start, first_token_seconds),
+                           payload["prompt"])
+        return "".join(parts), None
+
+    def stats_report(self):
+        """Returns a printable report of the generation timings collected so far"""
+        with self._stats_lock:
+            stats = list(self.generation_stats)
+        if not stats:
+            return "LLM: no generations"
+
+        first_tokens = [s["first_token_seconds"] for s in stats if s["first_token_seconds"] is not None]
+        speeds = [s["tokens_per_second"] for s in stats if s["tokens_per_second"]]
+        report = f"LLM: {len(stats)} generations"
+        if first_tokens:
+            report += f", {sum(first_tokens) / len(first_tokens):.2f}s average time to first token"
+        if speeds:
+            report += f", {sum(speeds) / len(speeds):.1f} tokens/s average"
+        return report
+
+    @instrumentation.timed("summarizer.summarize_single_post")
     def summarize_single_post(self, post_content, goal=None):
         """Summarize a single post with optional goal focus
         :param post_content: the main content of the post
         :param goal: optional focus
-        :return: the summary as a string
+        :return: the summary as a string, a FailedSummary with the error when the generation failed
         """
+        if self.cache is not None:
+            cached = self.cache.get(post_content, goal, self.model, SINGLE_POST_PROMPT)
+            if cached is not None:
+                return cached
+
         instruction = "Create a brief summary of the following post"
         if goal:
             instruction += f" with special focus on {goal}"
 
-        prompt = f"""{instruction}.
+        prompt = SINGLE_POST_PROMPT.format(instruction=instruction, post_content=post_content)
 
-    Post:
-    ---
-    {post_content}
-    ---
+        summary, error = self.generate({
+            "model": self.model,
+            "prompt": prompt,
+            "temperature": 0.3
+        })
 
-    Your summary should be 2-3 concise sentences capturing the key points, I'm interested in only the useful information, I don't want social media tags and hashtags.
-    """
+        if summary is None:
+            return FailedSummary(error)
 
-        response = requests.post(
-            self.api_url,
-            json={
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "temperature": 0.3
-            }
-        )
+        if self.cache is not None:
+            self.cache.put(post_content, goal, self.model, SINGLE_POST_PROMPT, summary)
+        return summary
 
-        if response.status_code == 200:
-            return response.json()['response']
-        else:
-            return f"Error: {response.status_code}, {response.text}"
+    def _batch_instruction(self, goal):
+        instruction = "Create a brief summary of each of the following posts"
+        if goal:
+            instruction += f" with special focus on {goal}"
+        return instruction
 
-    def create_unified_summary_per_single_post(self, posts: list[InstagramPost], goal: str|None =None):
+    def pack_batches(self, posts, goal=None):
+        """Split posts into consecutive batches whose prompt fits the token budget
+        :param posts: list of InstagramPost
+        :param goal: optional focus
+        :return: list of lists of InstagramPost
         """
-        Process all posts and create a single unified markdown summary file
+        prompt_tokens = self.token_counter.count(
+            BATCH_PROMPT.format(instruction=self._batch_instruction(goal), xml_content="")
+        )
+        batches = []
+        batch = []
+        batch_tokens = prompt_tokens
+        for i, post in enumerate(posts):
+            post_tokens = self.token_counter.count(post_to_xml(post, i, with_ids=True))
+            # A post larger than the budget still gets its own batch
+            if batch and batch_tokens + post_tokens > self.batch_token_budget:
+                batches.append(batch)
+                batch = []
+                batch_tokens = prompt_tokens
+            batch.append(post)
+            batch_tokens += post_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @instrumentation.timed("summarizer.summarize_batch")
+    def summarize_batch(self, posts, goal=None):
+        """Summarize many posts with a single request, re-running alone the posts missing from the answer
         :param posts: list of InstagramPost
-        :param goal: the optional focus
-        :return: the summary as a string
+        :param goal: optional focus
+        :return: dictionary post_id -> summary
         """
+        prompt = BATCH_PROMPT.format(
+            instruction=self._batch_instruction(goal),
+            xml_content=posts_to_xml(posts, with_ids=True)
+        )
+        text, error = self.generate({
+            "model": self.model,
+            "prompt": prompt,
+            "format": "json",
+            "temperature": 0.3
+        })
+
+        summaries = parse_batch_summaries(text, [post.post_id for post in posts]) if text is not None else {}
+        failed = [post for post in posts if post.post_id not in summaries]
+        if failed:
+            print(f"Batch answer missing {len(failed)}/{len(posts)} posts ({error or 'invalid answer'}), "
+                  f"summarizing them one by one")
+
+        for post in failed:
+            summaries[post.post_id] = self.summarize_single_post(post.caption, goal)
+
+        if self.cache is not None:
+            # The batch lookup only checks BATCH_PROMPT, the summaries of the fallback are cached there too
+            for post in posts:
+                if not isinstance(summaries[post.post_id], FailedSummary):
+                    self.cache.put(post.caption, goal, self.model, BATCH_PROMPT, summaries[post.post_id])
+
+        return summaries
+
+    def _submit_summaries(self, executor, posts, goal):
+        """Start the summarization of every post
+        :return: list of functions, one per post, waiting for and returning its summary
+        """
+        if self.mode != "batch":
+            futures = [executor.submit(self.summarize_single_post, post.caption, goal) for post in posts]
+            return [future.result for future in futures]
 
-        print(f"Creating unified summary of {len(posts)} posts...")
-
-        # Create individual summaries first
-        post_summaries = []
+        results = [None] * len(posts)
+        pending = []
         for i, post in enumerate(posts):
-            print(f"Processing post {i + 1}/{len(posts)}...")
-
-            summary = self.summarize_single_post(post.caption, goal)
-            post_summaries.append({
-                "id": post.post_id,
-                "title": f"[{i + 1} - {post.handle}]({post.url})",
-                "summary": summary
-            })
-
-        print(f"Individual post summaries procecced, creating overview")
-
-        # Create the unified markdown file
-        result = ""
-        # Write header
+            cached = self.cache.get(post.caption, goal, self.model, BATCH_PROMPT) if self.cache is not None else None
+            if cached is not None:
+                results[i] = lambda summary=cached: summary
+            else:
+                pending.append((i, post))
+
+        pending_posts = [post for _, post in pending]
+        position = 0
+        for batch in self.pack_batches(pending_posts, goal):
+            future = executor.submit(self.summarize_batch, batch, goal)
+            for post in batch:
+                index = pending[position][0]
+                results[index] = lambda future=future, post_id=post.post_id: future.result()[post_id]
+                position += 1
+
+        print(f"Summarizing {len(pending_posts)} posts in batches of at most {self.batch_token_budget} tokens")
+        return results
+
+    def _start_report(self, goal, report_writer):
+        """Start the report of the post summaries
+        :return: the header of the summary
+        """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        result += f"# {timestamp} - {goal.capitalize() if goal else "General"}\n\n"
-
-        # Create an overall summary of all posts
-        result += f"## Overview\n\n"
-        all_content = "\n\n".join([f"Post {i + 1}: {post['summary']}" for i, post in enumerate(post_summaries)])
-        overall_prompt = f"""Based on these individual post summaries, create an overview that captures the main events with dates, be concise:
-    
-        {all_content}
+        header = f"# {timestamp} - {goal.capitalize() if goal else 'General'}\n\n"
+        if report_writer is not None:
+            report_writer.start(header + "## Post Summaries\n\n")
+        return header
+
+    def _post_summary(self, post, index, summary, duplicates):
+        """Build the report entry of a summarized post"""
+        return {
+            "id": post.post_id,
+            "title": f"[{index + 1} - {post.handle}]({post.url})",
+            "summary": summary,
+            "failed": isinstance(summary, FailedSummary),
+            "duplicates": duplicates.get(post.post_id, [])
+        }
+
+    def _finish_report(self, header, post_summaries, report_writer, duplicates, skipped=None):
+        """Create the overview of the post summaries and the final report
+        :return: the summary as a string
         """
+        print(f"Individual post summaries procecced, creating overview")
+        print(self.stats_report())
+        if self.cache is not None:
+            print(self.cache.report())
 
-        overall_response = requests.post(
-            self.api_url,
-            json={
-                "model": self.model,
-                "prompt": overall_prompt,
-                "stream": False
-            }
+        # Create an overall summary of all posts, reduced in steps when they do not fit the context
+        overview = self.reducer.reduce(
+            [f"Post {i + 1}: {post['summary']}" for i, post in enumerate(post_summaries) if not post["failed"]]
         )
 
-        if overall_response.status_code == 200:
-            overview = overall_response.json()['response']
-            result += f"{overview}\n\n"
-        else:
-            result += "Error generating overview.\n\n"
+        # Duplicates may have been found after the section of their post was written
+        for post_summary in post_summaries:
+            post_summary["duplicates"] = duplicates.get(post_summary["id"], [])
+
+        # Kept to store the per-post summaries once the run is saved
+        self.last_overview = overview
+        self.last_post_summaries = post_summaries
+
+        # Create the unified markdown file
+        result = render_report(header, overview, post_summaries, skipped=skipped)
 
-        # Write individual post summaries
-        result += f"## Post Summaries\n\n"
-        for post in post_summaries:
-            result += f"### {post['title']}\n"
-            result += f"{post['summary']}\n\n"
+        if report_writer is not None:
+            report_writer.finish(result)
 
         print(f"Unified summary created")
         return result
 
-    def create_unified_summary(self, posts, goal=None):
+    def create_unified_summary_per_single_post(self, posts: list[InstagramPost], goal: str|None =None,
+                                               report_writer=None, duplicates=None, skipped=None):
         """
-        Process all posts together and create a single unified summary
+        Process all posts and create a single unified markdown summary file
+        :param posts: list of InstagramPost
+        :param goal: the optional focus
+        :param report_writer: optional MarkdownReportWriter receiving every post section as soon as it is ready
+        :param duplicates: optional dictionary post_id -> near-duplicate posts listed under its summary
+        :param skipped: optional list of (InstagramPost, relevance) listed at the end as not summarized
+        :return: the summary as a string
+        """
+        duplicates = duplicates or {}
 
-        Args:
-            :param posts: List of InstagramPost
-            :param goal: Optional focus/goal for the summarization
+        print(f"Creating unified summary of {len(posts)} posts...")
+        header = self._start_report(goal, report_writer)
 
-        :return the markdown summary as a string
+        # Create individual summaries first, in parallel but collected in the order of the posts
+        post_summaries = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            summary_results = self._submit_summaries(executor, posts, goal)
+            for i, (post, summary_result) in enumerate(zip(posts, summary_results)):
+                summary = summary_result()
+                print(f"Processed post {i + 1}/{len(posts)}")
+                post_summary = self._post_summary(post, i, summary, duplicates)
+                post_summaries.append(post_summary)
+                if report_writer is not None:
+                    report_writer.append(format_post_section(post_summary))
+
+        return self._finish_report(header, post_summaries, report_writer, duplicates, skipped)
+
+    def summarize_post_stream(self, posts, goal=None, report_writer=None, deduplicator=None, relevance=None):
         """
-        print(f"Creating unified summary of {len(posts)} posts...")
+        Summarize posts while they are still being produced, e.g. scraped, and create the unified summary.
+        At most twice the workers posts are in flight: the posts are consumed only as fast as they are
+        summarized, so a slow model holds back the producer. Every post is summarized on its own.
+        :param posts: iterable of InstagramPost, e.g. a ScrapePipeline
+        :param goal: the optional focus
+        :param report_writer: optional MarkdownReportWriter receiving every post section as soon as it is ready
+        :param deduplicator: optional StreamingDeduplicator cleaning the captions and skipping the near-duplicates
+        :param relevance: optional RelevanceFilter skipping the posts unrelated to the goal
+        :return: the summary as a string, None if no post was produced
+        """
+        duplicates = deduplicator.duplicates if deduplicator is not None else {}
 
-        # Combine all posts into a single document
-        xml_content = "<posts>\n"
-        for i, post in enumerate(posts):
-            title = f"{i} - {post.handle}"
-            content = post.caption.replace('<', '&lt;').replace('>', '&gt;')  # Escape XML special chars
+        header = None
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        pending = deque()
+        post_summaries = []
 
-            xml_content += f"  <post>\n"
-            xml_content += f"    <title>{title}</title>\n"
-            xml_content += f"    <url>{post.url}</url>\n"
-            xml_content += f"    <content>{content}</content>\n"
-            xml_content += f"  </post>\n"
-        xml_content += "</posts>"
+        def collect(wait):
+            # Write the summaries in the order of the posts, as soon as all the previous ones are done
+            while pending and (wait or pending[0][1].done()):
+                post, future = pending.popleft()
+                post_summary = self._post_summary(post, len(post_summaries), future.result(), duplicates)
+                post_summaries.append(post_summary)
+                print(f"Processed post {len(post_summaries)}")
+                if report_writer is not None:
+                    report_writer.append(format_post_section(post_summary))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for post in posts:
+                if deduplicator is not None:
+                    post = deduplicator.add(post)
+                    if post is None:
+                        continue
+
+                if header is None:
+                    header = self._start_report(goal, report_writer)
+
+                if relevance is not None and not relevance.accepts(post):
+                    continue
+
+                in_flight.acquire()
+                future = executor.submit(self.summarize_single_post, post.caption, goal)
+                future.add_done_callback(lambda _: in_flight.release())
+                pending.append((post, future))
+                collect(wait=False)
+
+            collect(wait=True)
+
+        if header is None:
+            return None
+        skipped = relevance.skipped if relevance is not None else None
+        return self._finish_report(header, post_summaries, report_writer, duplicates, skipped)
 
-        # Create the summary prompt
+    def _unified_prompt(self, xml_content, goal=None):
         instruction = "Create a comprehensive markdown summary of the following collection of posts"
         if goal:
             instruction += f" with special focus on information related to {goal}"
 
-        prompt = f"""{instruction}.
+        return f"""{instruction}.
 
 The posts are provided in XML format below:
 {xml_content}
@@ -150,24 +584,69 @@ Guidelines:
 6. Ignore social media tags
 """
 
-        # Call the API
-        print("Sending request to model...")
-        response = requests.post(
-            self.api_url,
-            json={
+    def _create_unified_summary_in_chunks(self, posts, goal=None):
+        """Summarize posts that do not fit the context in chunks, then reduce the chunks into an overview
+        :return: the markdown summary without header, None if every chunk failed
+        """
+        chunks = self.reducer.chunk([post_to_xml(post, i) for i, post in enumerate(posts)])
+        print(f"Posts do not fit the context, summarizing them in {len(chunks)} chunks")
+
+        def summarize_chunk(chunk):
+            prompt = self._unified_prompt("<posts>\n" + "".join(chunk) + "</posts>", goal)
+            summary, error = self.generate({
                 "model": self.model,
                 "prompt": prompt,
-                "stream": False,
                 "temperature": 0.3
-            }
-        )
+            })
+            if summary is None:
+                print(error)
+            return summary
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            chunk_summaries = [summary for summary in executor.map(summarize_chunk, chunks) if summary is not None]
+
+        if not chunk_summaries:
+            return None
+
+        overview = self.reducer.reduce(chunk_summaries, kind="partial summaries")
+        if overview is None:
+            overview = "Error generating overview."
+        return f"## Overview\n\n{overview}\n\n" + "\n\n".join(chunk_summaries)
+
+    def create_unified_summary(self, posts, goal=None):
+        """
+        Process all posts together and create a single unified summary
 
-        if response.status_code == 200:
-            summary = response.json()['response']
+        Args:
+            :param posts: List of InstagramPost
+            :param goal: Optional focus/goal for the summarization
+
+        :return the markdown summary as a string
+        """
+        print(f"Creating unified summary of {len(posts)} posts...")
+
+        # Combine all posts into a single document
+        xml_content = posts_to_xml(posts)
+
+        # Create the summary prompt
+        prompt = self._unified_prompt(xml_content, goal)
+
+        if self.token_counter.count(prompt) > self.reducer.input_tokens:
+            summary = self._create_unified_summary_in_chunks(posts, goal)
+            error = "Error: no chunk could be summarized"
+        else:
+            # Call the API
+            print("Sending request to model...")
+            summary, error = self.generate({
+                "model": self.model,
+                "prompt": prompt,
+                "temperature": 0.3
+            })
 
+        if summary is not None:
             # Add header with metadata
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            header = f"# {timestamp} - {goal.capitalize() if goal else "General"}\n\n"
+            header = f"# {timestamp} - {goal.capitalize() if goal else 'General'}\n\n"
 
             # Write to file
             result = header + summary
@@ -175,5 +654,5 @@ Guidelines:
             print(f"Unified summary created")
             return result
         else:
-            print(f"Error: {response.status_code}, {response.text}")
+            print(error)
             return None
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+
+from config import SUMMARY_CACHE_MAX_ENTRIES, SUMMARY_CACHE_MAX_AGE_DAYS
+
+
+def normalize_caption(caption):
+    """Normalize a caption so that captions differing only in whitespace share the same cache entry"""
+    caption = unicodedata.normalize("NFC", caption or "")
+    return re.sub(r"\s+", " ", caption).strip()
+
+
+class SummaryCache:
+    """
+    Persistent cache of the per-post summaries, stored in the database and keyed by the normalized
+    caption, the goal, the model and the prompt template.
+    """
+
+    def __init__(self, db_manager, max_entries=SUMMARY_CACHE_MAX_ENTRIES, max_age_days=SUMMARY_CACHE_MAX_AGE_DAYS):
+        """
+        Args:
+            db_manager (DatabaseManager): Database holding the cache
+            max_entries (int): Maximum number of cached summaries, the least recently used are evicted
+            max_age_days (int): Cached summaries older than this are evicted
+        """
+        self.db_manager = db_manager
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(caption, goal, model, prompt_template):
+        """Returns the cache key of a summary"""
+        content = json.dumps([
+            normalize_caption(caption),
+            (goal or "").strip().lower(),
+            model,
+            hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()
+        ])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, caption, goal, model, prompt_template):
+        """
+        Returns:
+            str or None: The cached summary, None on a cache miss
+        """
+        summary = self.db_manager.get_cached_summary(self.key(caption, goal, model, prompt_template))
+        with self._lock:
+            if summary is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return summary
+
+    def put(self, caption, goal, model, prompt_template, summary):
+        """Stores a summary in the cache"""
+        self.db_manager.save_cached_summary(self.key(caption, goal, model, prompt_template), summary)
+
+    def evict(self):
+        """Removes the expired and the least recently used summaries"""
+        removed = self.db_manager.evict_summary_cache(self.max_entries, self.max_age_days)
+        if removed:
+            print(f"Evicted {removed} cached summaries")
+
+    def hit_rate(self):
+        """Returns the share of lookups answered by the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def report(self):
+        """Returns a printable report of the cache usage"""
+        return f"Summary cache: {self.hits} hits, {self.misses} misses ({self.hit_rate():.0%} hit rate)"
@@ -0,0 +1,75 @@
+import json
+import os
+from datetime import datetime
+
+from config import INSTAGRAM_BASE_URL
+from network_extractor import load_feed_response, parse_feed_file, parse_feed_response, parse_media_node
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "web_profile_info.json")
+
+
+def test_parse_feed_file_reads_every_post_of_the_handle():
+    posts = parse_feed_file(FIXTURE, "example_venue")
+
+    # The post authored by another profile is skipped, the carousel children are not posts
+    assert [post.post_id for post in posts] == ["C7pinned01", "C7carou02", "C7reel0003"]
+    assert all(post.handle == "example_venue" for post in posts)
+
+
+def test_parse_feed_file_fields():
+    pinned, carousel, reel = parse_feed_file(FIXTURE, "example_venue")
+
+    assert pinned.pinned
+    assert pinned.caption == "Opening hours for the summer season"
+    assert pinned.date == datetime(2024, 5, 23, 21, 33, 20)
+    assert pinned.url == f"{INSTAGRAM_BASE_URL}/p/C7pinned01/"
+
+    assert not carousel.pinned
+    assert carousel.caption == "Live music on Saturday, doors at 21:00"
+    assert carousel.date == datetime(2024, 6, 1, 12, 0)
+    assert carousel.url == f"{INSTAGRAM_BASE_URL}/p/C7carou02/"
+
+    assert reel.caption == ""
+    assert reel.date == datetime(2024, 5, 29, 16, 26, 40)
+    assert reel.url == f"{INSTAGRAM_BASE_URL}/reel/C7reel0003/"
+
+
+def test_parse_feed_response_without_handle_keeps_every_author():
+    with open(FIXTURE, "r", encoding="utf-8") as file:
+        data = json.load(file)
+
+    posts = parse_feed_response(data)
+
+    assert [post.post_id for post in posts] == ["C7pinned01", "C7carou02", "C7reel0003", "C7other004"]
+    assert all(post.handle is None for post in posts)
+
+
+def test_load_feed_response_strips_the_hijacking_guard():
+    with open(FIXTURE, "r", encoding="utf-8") as file:
+        body = file.read()
+
+    assert load_feed_response("for (;;);" + body) == json.loads(body)
+    assert load_feed_response("<html></html>") is None
+
+
+def test_parse_media_node_rest_shape():
+    node = {
+        "code": "C7rest0001",
+        "taken_at": 1717243200,
+        "product_type": "clips",
+        "caption": {"text": "Reel from the feed API"},
+        "clips_tab_pinned_user_ids": ["1000000001"],
+        "user": {"username": "example_venue"},
+    }
+
+    post = parse_media_node(node, "example_venue")
+
+    assert post.post_id == "C7rest0001"
+    assert post.caption == "Reel from the feed API"
+    assert post.date == datetime(2024, 6, 1, 12, 0)
+    assert post.url == f"{INSTAGRAM_BASE_URL}/reel/C7rest0001/"
+    assert post.pinned
+
+
+def test_parse_media_node_without_timestamp():
+    assert parse_media_node({"code": "C7rest0002", "caption": None}) is None
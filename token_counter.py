@@ -0,0 +1,79 @@
+import threading
+
+import requests
+
+from config import OLLAMA_URL
+
+
+class TokenCounter:
+    """
+    Counts tokens with the tokenizer of the Ollama model. When the server does not expose it,
+    falls back to an estimate calibrated on the prompt token counts reported by the generations.
+    """
+
+    def __init__(self, model, session=None, base_url=OLLAMA_URL, timeout=10):
+        """
+        Args:
+            model (str): The Ollama model name
+            session (requests.Session, optional): Session reused for the tokenize requests
+            base_url (str): Ollama server url
+            timeout (float): Seconds to wait for a tokenize response
+        """
+        self.model = model
+        self.session = session if session is not None else requests.Session()
+        self.tokenize_url = f"{base_url}/api/tokenize"
+        self.timeout = timeout
+
+        # None until the first request tells whether the endpoint exists
+        self.tokenizer_available = None
+        self._chars = 0
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def _tokenize(self, text):
+        """Returns the number of tokens from the Ollama tokenizer, None if it is not available"""
+        if self.tokenizer_available is False:
+            return None
+
+        try:
+            response = self.session.post(
+                self.tokenize_url,
+                json={"model": self.model, "content": text},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            # Retrying on every count would add a failing request per post
+            self.tokenizer_available = False
+            print(f"Ollama tokenizer not reachable, estimating token counts: {e}")
+            return None
+
+        if response.status_code != 200:
+            self.tokenizer_available = False
+            print("Ollama tokenizer not available, estimating token counts")
+            return None
+
+        self.tokenizer_available = True
+        return len(response.json().get("tokens", []))
+
+    def calibrate(self, chars, tokens):
+        """Learn the characters per token ratio from a generation, e.g. its prompt_eval_count"""
+        if chars > 0 and tokens > 0:
+            with self._lock:
+                self._chars += chars
+                self._tokens += tokens
+
+    def chars_per_token(self):
+        """Returns the learned characters per token ratio, 4 until a generation is seen"""
+        with self._lock:
+            return self._chars / self._tokens if self._tokens else 4
+
+    def count(self, text):
+        """Returns the number of tokens of the text"""
+        if not text:
+            return 0
+
+        tokens = self._tokenize(text)
+        if tokens is not None:
+            return tokens
+
+        return int(len(text) / self.chars_per_token()) + 1
@@ -0,0 +1,190 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+import requests
+
+from cli_utils import parse_date
+from config import DATABASE_FILE, EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, OLLAMA_URL, OLLAMA_KEEP_ALIVE
+from database import DatabaseManager
+
+
+class VectorIndex:
+    """
+    Semantic index of every stored post: the clean captions are embedded by Ollama, the vectors are
+    stored as float32 blobs in the database and searched in memory with a single matrix product.
+    """
+
+    def __init__(self, db_manager, model=EMBEDDING_MODEL, base_url=OLLAMA_URL, batch_size=EMBEDDING_BATCH_SIZE,
+                 timeout=120):
+        """
+        Args:
+            db_manager (DatabaseManager): Database holding the posts and their vectors
+            model (str): The Ollama embedding model
+            base_url (str): Ollama server url
+            batch_size (int): Posts embedded in a single request
+            timeout (float): Seconds to wait for an embedding response
+        """
+        self.db_manager = db_manager
+        self.model = model
+        self.embed_url = f"{base_url}/api/embed"
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        # Normalized vectors loaded from the database, rebuilt after every update
+        self._post_ids = None
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        """
+        Embed texts with the Ollama model
+
+        Returns:
+            numpy.ndarray: float32 matrix with one row per text
+        """
+        response = self.session.post(
+            self.embed_url,
+            json={"model": self.model, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Embedding failed: {response.status_code}, {response.text}")
+        return np.asarray(response.json()["embeddings"], dtype=np.float32)
+
+    def update(self):
+        """
+        Embed the stored posts that have no vector yet
+
+        Returns:
+            int: Number of embedded posts
+        """
+        embedded = 0
+        while True:
+            pending = self.db_manager.get_posts_without_embedding(self.model, limit=self.batch_size * 8)
+            if not pending:
+                break
+
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                vectors = self.embed([caption for _, caption in batch])
+                self.db_manager.save_embeddings(self.model, [
+                    (post_id, vector.shape[0], vector.tobytes()) for (post_id, _), vector in zip(batch, vectors)
+                ])
+                embedded += len(batch)
+
+        if embedded:
+            with self._lock:
+                self._matrix = None
+        return embedded
+
+    def load(self):
+        """Returns the post ids and the matrix of their normalized vectors, loading them from the database once"""
+        with self._lock:
+            if self._matrix is None:
+                rows = self.db_manager.get_embeddings(self.model)
+                dimensions = max((row[1] for row in rows), default=0)
+                # Vectors of another size come from an older version of the model, they are left out
+                rows = [row for row in rows if row[1] == dimensions]
+
+                self._post_ids = [post_id for post_id, _, _ in rows]
+                matrix = np.frombuffer(b"".join(vector for _, _, vector in rows), dtype=np.float32)
+                matrix = matrix.reshape(len(rows), dimensions) if rows else np.zeros((0, 0), dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._matrix = matrix / np.where(norms == 0, 1, norms)
+            return self._post_ids, self._matrix
+
+    def search(self, query, k=10, handles=None, since=None, until=None):
+        """
+        Find the stored posts closest in meaning to the query
+
+        Args:
+            query (str): Free text, e.g. the goal
+            k (int): Maximum number of results
+            handles (list, optional): Only posts of these handles
+            since (datetime, optional): Only posts published at or after this date
+            until (datetime, optional): Only posts published before this date
+
+        Returns:
+            list: List of (InstagramPost, cosine similarity) tuples, most similar first
+        """
+        post_ids, matrix = self.load()
+        if not post_ids:
+            return []
+
+        vector = self.embed([query])[0]
+        if vector.shape[0] != matrix.shape[1]:
+            raise RuntimeError(f"The stored vectors are not from {self.model}, run an update")
+        similarities = matrix @ (vector / (np.linalg.norm(vector) or 1))
+
+        filtered = handles or since is not None or until is not None
+        if filtered:
+            # Filters are applied after ranking, walk the whole ranking until enough posts pass them
+            ranking = np.argsort(-similarities)
+        else:
+            top = np.argpartition(-similarities, min(k, len(post_ids)) - 1)[:k]
+            ranking = top[np.argsort(-similarities[top])]
+
+        results = []
+        chunk_size = max(k * 10, 500)
+        for start in range(0, len(ranking), chunk_size):
+            chunk = ranking[start:start + chunk_size]
+            posts = self.db_manager.get_posts_by_ids(post_ids[index] for index in chunk)
+            for index in chunk:
+                post = posts.get(post_ids[index])
+                if post is None:
+                    continue
+                if handles and post.handle not in handles:
+                    continue
+                if since is not None and post.date < since:
+                    continue
+                if until is not None and post.date >= until:
+                    continue
+                results.append((post, float(similarities[index])))
+                if len(results) == k:
+                    return results
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic search of every stored post")
+    parser.add_argument("query", nargs="*", help="what to look for, e.g. a goal")
+    parser.add_argument("--update", action="store_true", help="embed the stored posts without a vector first")
+    parser.add_argument("--k", type=int, default=10, help="maximum number of results")
+    parser.add_argument("--handle", action="append", dest="handles", help="only posts of this handle, repeatable")
+    parser.add_argument("--since", type=parse_date, help="only posts published from this date, YYYY-MM-DD")
+    parser.add_argument("--until", type=parse_date, help="only posts published before this date, YYYY-MM-DD")
+    parser.add_argument("--db", default=DATABASE_FILE, help="database file")
+    args = parser.parse_args()
+
+    if not args.query and not args.update:
+        parser.error("give a query or --update")
+
+    db_manager = DatabaseManager(args.db)
+    db_manager.setup_tables()
+    index = VectorIndex(db_manager)
+
+    if args.update:
+        start = time.perf_counter()
+        embedded = index.update()
+        print(f"Embedded {embedded} posts in {time.perf_counter() - start:.1f}s")
+
+    if args.query:
+        index.load()
+        start = time.perf_counter()
+        results = index.search(" ".join(args.query), args.k, args.handles, args.since, args.until)
+        elapsed = time.perf_counter() - start
+
+        for post, similarity in results:
+            caption = " ".join((post.caption or "").split())
+            print(f"{post.date:%Y-%m-%d} {post.handle} {post.url} ({similarity:.2f})")
+            print(f"    {caption[:200]}\n")
+        print(f"{len(results)} results in {elapsed * 1000:.1f} ms, including the query embedding")
+
+    db_manager.close()
+
+
+if __name__ == "__main__":
+    main()